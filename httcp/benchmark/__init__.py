@@ -0,0 +1,10 @@
+# coding: utf-8
+
+"""
+Standalone benchmarks of the PhiCP production chain on synthetic tau decays.
+
+Usage:
+  python -m httcp.benchmark --events 20000 --output baseline.json
+  python -m httcp.benchmark --events 20000 --compare baseline.json
+  python -m httcp.benchmark.precision --events 20000
+"""
@@ -0,0 +1,8 @@
+# coding: utf-8
+
+import sys
+
+from httcp.benchmark.phicp import main
+
+
+sys.exit(main())
@@ -0,0 +1,282 @@
+# coding: utf-8
+
+"""
+Timing of the PhiCP production chain on synthetic events, per decay-mode pair.
+
+Stages:
+  rearrange    : reArrangeDecayProducts (pions sorting, pi0 reconstruction)
+  pvc_a1       : PolarimetricA1.PVC on every a1 leg
+  GetPhiCP_PV  : GetPhiCP with PV on both legs
+  GetPhiCP_DP  : GetPhiCP with DP on both legs (rho / a1 pairs only)
+  ProducePhiCP : the full producer, i.e. all the mode masks
+
+For every stage the best wall time out of `repeat` runs, the throughput and the
+peak resident set size reached during the stage are reported.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+from types import SimpleNamespace
+
+from columnflow.util import maybe_import
+
+from httcp.benchmark.synthetic import generate_events, DECAY_MODES
+from httcp.production.ReArrangeHcandProds import reArrangeDecayProducts, PI0_METHODS
+from httcp.production.PhiCP_Estimator import GetPhiCP, PHICP_PRECISIONS, ZMFCache
+from httcp.production.PhiCP_Producer import ProducePhiCP
+from httcp.production.PolarimetricA1 import PolarimetricA1
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+
+
+ALL_PAIRS = [(m1, m2) for m1 in DECAY_MODES for m2 in DECAY_MODES]
+
+# version of the baseline file layout
+BASELINE_VERSION = 1
+
+
+def run_benchmark(
+        n_events: int = 10000,
+        pairs: list | None = None,
+        repeat: int = 3,
+        seed: int = 0,
+        use_a1_kernel: bool = False,
+        use_a1_table: bool = False,
+        use_acop_kernel: bool = False,
+        precision: str = "float64",
+        pi0_method: str = "simpleIC",
+) -> dict:
+    """
+    Inputs:
+      n_events        : events per decay-mode pair
+      pairs           : list of (mode_leg1, mode_leg2), default: all pi/rho/a1 combinations
+      repeat          : number of runs per stage, the fastest one is kept
+      seed            : random seed of the event generation
+      use_a1_kernel   : ProducePhiCP / GetPhiCP option
+      use_a1_table    : ProducePhiCP / GetPhiCP option
+      use_acop_kernel : ProducePhiCP / GetPhiCP option
+      precision       : ProducePhiCP / GetPhiCP option
+      pi0_method      : reArrangeDecayProducts option
+    Output:
+      dict{
+        meta    : software versions and settings
+        results : {"<mode_leg1>-<mode_leg2>": {stage: {seconds, events_per_s, peak_rss_mb}}}
+      }
+    """
+    pairs = pairs or ALL_PAIRS
+    options = {"use_a1_kernel": use_a1_kernel, "use_a1_table": use_a1_table,
+               "use_acop_kernel": use_acop_kernel, "precision": precision}
+    producer = SimpleNamespace(**options)
+    rearranger = SimpleNamespace(pi0_method=pi0_method)
+
+    results = {}
+    for mode_leg1, mode_leg2 in pairs:
+        events = generate_events(n_events, mode_leg1, mode_leg2, seed=seed)
+        stages = {}
+
+        stages["rearrange"] = time_stage(lambda: reArrangeDecayProducts.call_func(rearranger, events),
+                                         n_events, repeat)
+        _, p4hcandinfo = reArrangeDecayProducts.call_func(rearranger, events)
+        # every run starts from an empty boost cache
+        fresh = lambda: {**p4hcandinfo, "zmf": ZMFCache()}
+
+        legs = [(p4hcandinfo[f"p4h{i}"], p4hcandinfo[f"p4h{i}pi"])
+                for i, mode in [(1, mode_leg1), (2, mode_leg2)] if mode == "a1"]
+        if legs:
+            stages["pvc_a1"] = time_stage(lambda: [_pvc_a1(*leg, **options) for leg in legs],
+                                          n_events, repeat)
+
+        stages["GetPhiCP_PV"] = time_stage(
+            lambda: GetPhiCP(fresh(), "PV", "PV", mode_leg1, mode_leg2, **options),
+            n_events, repeat,
+        )
+        if "pi" not in (mode_leg1, mode_leg2):
+            stages["GetPhiCP_DP"] = time_stage(
+                lambda: GetPhiCP(fresh(), "DP", "DP", mode_leg1, mode_leg2, **options),
+                n_events, repeat,
+            )
+
+        stages["ProducePhiCP"] = time_stage(
+            lambda: ProducePhiCP.call_func(producer, events, fresh()),
+            n_events, repeat,
+        )
+
+        results[f"{mode_leg1}-{mode_leg2}"] = stages
+
+    return {"meta": _meta(n_events, repeat, seed, {**options, "pi0_method": pi0_method}), "results": results}
+
+
+def time_stage(func, n_events: int, repeat: int = 3) -> dict:
+    """
+    Runs func repeat times, returns the best wall time, the throughput and the peak RSS in MB
+    """
+    best = float("inf")
+    peak = 0.0
+    for _ in range(max(repeat, 1)):
+        _reset_peak_rss()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, peak_rss_mb())
+
+    return {
+        "seconds": best,
+        "events_per_s": n_events/best if best > 0 else float("inf"),
+        "peak_rss_mb": peak,
+    }
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the process in MB. On linux this is VmHWM, which
+    is reset before every stage, elsewhere the peak since the process started.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return float(line.split()[1])/1024.
+    except OSError:
+        pass
+    # kB on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/1024.**2 if sys.platform == "darwin" else rss/1024.
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Compares the throughput of every stage with a baseline produced by run_benchmark
+    Returns a list of (pair, stage, baseline events/s, events/s, ratio) for all the stages
+    that are slower than the baseline by more than tolerance (fraction)
+    """
+    regressions = []
+    for pair, stages in results["results"].items():
+        for stage, res in stages.items():
+            base = baseline["results"].get(pair, {}).get(stage)
+            if base is None:
+                continue
+            ratio = res["events_per_s"]/base["events_per_s"]
+            if ratio < 1.0 - tolerance:
+                regressions.append((pair, stage, base["events_per_s"], res["events_per_s"], ratio))
+
+    return regressions
+
+
+def print_results(results: dict, baseline: dict | None = None) -> None:
+    header = f"{'pair':<10} {'stage':<14} {'seconds':>10} {'events/s':>12} {'peak RSS MB':>12}"
+    if baseline:
+        header += f" {'vs baseline':>12}"
+    print(header)
+    print("-"*len(header))
+    for pair, stages in results["results"].items():
+        for stage, res in stages.items():
+            line = (f"{pair:<10} {stage:<14} {res['seconds']:>10.4f} {res['events_per_s']:>12.0f}"
+                    f" {res['peak_rss_mb']:>12.1f}")
+            base = (baseline or {}).get("results", {}).get(pair, {}).get(stage)
+            if base:
+                line += f" {res['events_per_s']/base['events_per_s']:>11.2f}x"
+            print(line)
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m httcp.benchmark",
+        description="Benchmark of the PhiCP production chain on synthetic tau decays",
+    )
+    parser.add_argument("--events", "-n", type=int, default=10000, help="events per decay-mode pair")
+    parser.add_argument("--pairs", "-p", default=None,
+                        help="comma separated decay-mode pairs, e.g. 'a1-a1,rho-pi' (default: all)")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--a1-kernel", action="store_true", help="use the compiled a1 kernel")
+    parser.add_argument("--a1-table", action="store_true", help="use the tabulated a1 lineshape")
+    parser.add_argument("--acop-kernel", action="store_true", help="use the compiled acoplanarity angle kernel")
+    parser.add_argument("--precision", choices=PHICP_PRECISIONS, default="float64",
+                        help="floating point precision of the PhiCP computation")
+    parser.add_argument("--pi0-method", choices=PI0_METHODS, default="simpleIC",
+                        help="pi0 reconstruction of reArrangeDecayProducts")
+    parser.add_argument("--output", "-o", default=None, help="write the results to this json file")
+    parser.add_argument("--compare", "-c", default=None, help="baseline json file to compare with")
+    parser.add_argument("--tolerance", "-t", type=float, default=0.2,
+                        help="allowed fractional throughput loss w.r.t. the baseline")
+    args = parser.parse_args(argv)
+
+    pairs = None
+    if args.pairs:
+        pairs = [tuple(pair.split("-")) for pair in args.pairs.split(",")]
+        for pair in pairs:
+            if len(pair) != 2 or not set(pair) <= set(DECAY_MODES):
+                parser.error(f"invalid decay-mode pair {'-'.join(pair)}, modes: {', '.join(DECAY_MODES)}")
+
+    results = run_benchmark(
+        n_events=args.events,
+        pairs=pairs,
+        repeat=args.repeat,
+        seed=args.seed,
+        use_a1_kernel=args.a1_kernel,
+        use_a1_table=args.a1_table,
+        use_acop_kernel=args.acop_kernel,
+        precision=args.precision,
+        pi0_method=args.pi0_method,
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for pair, stage, base, new, ratio in regressions:
+            print(f"REGRESSION {pair} {stage}: {base:.0f} -> {new:.0f} events/s ({ratio:.2f}x)")
+        return 1 if regressions else 0
+
+    return 0
+
+
+# PRIVATE
+def _pvc_a1(p4h: ak.Array, p4hpi: ak.Array, **options) -> ak.Array:
+    a1pol = PolarimetricA1(p4h, p4hpi[:, 0:1], p4hpi[:, 1:2], p4hpi[:, 2:3], p4h.charge)
+    a1pol.useLineshapeTable = options.get("use_a1_table", False)
+    return a1pol.PVC(use_kernel=options.get("use_a1_kernel", False))
+
+
+def _reset_peak_rss() -> None:
+    # writing 5 to clear_refs resets VmHWM to the current RSS (linux only)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _meta(n_events: int, repeat: int, seed: int, options: dict) -> dict:
+    return {
+        "version": BASELINE_VERSION,
+        "n_events": n_events,
+        "repeat": repeat,
+        "seed": seed,
+        "options": options,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "awkward": ak.__version__,
+        "coffea": coffea.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
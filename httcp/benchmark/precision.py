@@ -0,0 +1,213 @@
+# coding: utf-8
+
+"""
+Validation of the single precision mode of the PhiCP computation.
+
+For every decay-mode pair and method the PhiCP obtained with precision="float32"
+is compared event by event with the default float64 one. As a reference for the
+conditioning of the estimator, the float64 PhiCP is also recomputed from inputs
+rounded to float32: if that already moves PhiCP by more than the tolerance, the
+pair is reported as ill-conditioned rather than as a float32 failure.
+
+Columns (|dphi| is wrapped to [0, pi]):
+  p50, p99, max : quantiles of |dphi| float32 vs float64, in rad
+  >tol          : fraction of events with |dphi| > tolerance
+  rounding p99  : p99 of |dphi| with float32-rounded inputs, computed in float64
+  hist          : largest bin difference of the two PhiCP histograms, in units
+                  of the statistical uncertainty of the bin
+  nan           : events with NaN PhiCP in float64 / float32
+
+Usage:
+  python -m httcp.benchmark.precision --events 20000 --output precision.json
+"""
+
+from __future__ import annotations
+
+import sys
+import json
+import argparse
+from types import SimpleNamespace
+
+from columnflow.util import maybe_import
+
+from httcp.benchmark.synthetic import generate_events, DECAY_MODES
+from httcp.production.ReArrangeHcandProds import reArrangeDecayProducts
+from httcp.production.PhiCP_Estimator import GetPhiCP, PHICP_PRECISIONS
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+ALL_PAIRS = [(m1, m2) for m1 in DECAY_MODES for m2 in DECAY_MODES]
+
+# histogram used for the shape comparison
+PHICP_BINS = np.linspace(0.0, 2*np.pi, 21)
+
+
+def validate_precision(
+        n_events: int = 20000,
+        pairs: list | None = None,
+        seed: int = 0,
+        precision: str = "float32",
+        tolerance: float = 1e-2,
+) -> dict:
+    """
+    Inputs:
+      n_events  : events per decay-mode pair
+      pairs     : list of (mode_leg1, mode_leg2), default: all pi/rho/a1 combinations
+      seed      : random seed of the event generation
+      precision : precision to validate against float64
+      tolerance : |dphi| in rad above which an event counts as different
+    Output:
+      {"<mode_leg1>-<mode_leg2>": {method: {p50, p99, max, frac_above_tol, rounding_p99,
+                                            hist_max_pull, nan_float64, nan_<precision>, status}}}
+      status is "ok", "ill-conditioned" or "fail"
+    """
+    if precision not in PHICP_PRECISIONS:
+        raise RuntimeError(f"Wrong precision : {precision}")
+
+    pairs = pairs or ALL_PAIRS
+    report = {}
+    for mode_leg1, mode_leg2 in pairs:
+        events = generate_events(n_events, mode_leg1, mode_leg2, seed=seed)
+        _, p4hcandinfo = reArrangeDecayProducts.call_func(SimpleNamespace(pi0_method="simpleIC"), events)
+        # the rounded inputs are read from the jagged arrays, without the decay record
+        p4hcandinfo_rounded = {key: _castFloats(_castFloats(val, precision), "float64")
+                               for key, val in p4hcandinfo.items() if key not in ("zmf", "decay")}
+
+        methods = ["PV"] if "pi" in (mode_leg1, mode_leg2) else ["PV", "DP"]
+        report[f"{mode_leg1}-{mode_leg2}"] = {}
+        for method in methods:
+            args = (method, method, mode_leg1, mode_leg2)
+            phicp     = _flat(GetPhiCP(p4hcandinfo, *args))
+            phicp_low = _flat(GetPhiCP(p4hcandinfo, *args, precision=precision))
+            phicp_rnd = _flat(GetPhiCP(p4hcandinfo_rounded, *args))
+
+            report[f"{mode_leg1}-{mode_leg2}"][method] = compare_phicp(phicp, phicp_low, phicp_rnd,
+                                                                       tolerance, precision)
+
+    return report
+
+
+def compare_phicp(
+        phicp: np.ndarray,
+        phicp_low: np.ndarray,
+        phicp_rounded: np.ndarray,
+        tolerance: float,
+        precision: str = "float32",
+) -> dict:
+    """
+    Inputs:
+      phicp         : float64 PhiCP
+      phicp_low     : PhiCP computed with the lower precision
+      phicp_rounded : float64 PhiCP computed from rounded inputs
+      tolerance     : |dphi| in rad above which an event counts as different
+    Output:
+      dict of the report columns of one pair and method
+    """
+    dphi = _deltaPhi(phicp, phicp_low)
+    dphi_rounded = _deltaPhi(phicp, phicp_rounded)
+    valid = np.isfinite(dphi)
+
+    h, _ = np.histogram(phicp[np.isfinite(phicp)], bins=PHICP_BINS)
+    h_low, _ = np.histogram(phicp_low[np.isfinite(phicp_low)], bins=PHICP_BINS)
+    pull = np.abs(h - h_low)/np.sqrt(np.maximum(h + h_low, 1))
+
+    res = {
+        "p50": _quantile(dphi[valid], 50),
+        "p99": _quantile(dphi[valid], 99),
+        "max": float(np.max(dphi[valid])) if valid.any() else 0.0,
+        "frac_above_tol": float(np.mean(dphi[valid] > tolerance)) if valid.any() else 0.0,
+        "rounding_p99": _quantile(dphi_rounded[np.isfinite(dphi_rounded)], 99),
+        "hist_max_pull": float(np.max(pull)),
+        "nan_float64": int(np.sum(np.isnan(phicp))),
+        f"nan_{precision}": int(np.sum(np.isnan(phicp_low))),
+    }
+
+    if res["rounding_p99"] > tolerance:
+        res["status"] = "ill-conditioned"
+    elif res["p99"] > tolerance or res[f"nan_{precision}"] > res["nan_float64"]:
+        res["status"] = "fail"
+    else:
+        res["status"] = "ok"
+
+    return res
+
+
+def print_report(report: dict, precision: str = "float32") -> None:
+    header = (f"{'pair':<10} {'method':<6} {'p50':>9} {'p99':>9} {'max':>9} {'>tol':>8} "
+              f"{'rounding p99':>13} {'hist':>6} {'nan':>9}  status")
+    print(header)
+    print("-"*len(header))
+    for pair, methods in report.items():
+        for method, res in methods.items():
+            nan = f"{res['nan_float64']}/{res[f'nan_{precision}']}"
+            print(f"{pair:<10} {method:<6} {res['p50']:>9.1e} {res['p99']:>9.1e} {res['max']:>9.1e} "
+                  f"{res['frac_above_tol']:>8.4f} {res['rounding_p99']:>13.1e} "
+                  f"{res['hist_max_pull']:>6.2f} {nan:>9}  {res['status']}")
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m httcp.benchmark.precision",
+        description="Compares the reduced precision PhiCP with the float64 one on synthetic tau decays",
+    )
+    parser.add_argument("--events", "-n", type=int, default=20000, help="events per decay-mode pair")
+    parser.add_argument("--pairs", "-p", default=None,
+                        help="comma separated decay-mode pairs, e.g. 'a1-a1,rho-pi' (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--precision", choices=[p for p in PHICP_PRECISIONS if p != "float64"],
+                        default="float32")
+    parser.add_argument("--tolerance", "-t", type=float, default=1e-2,
+                        help="|dphi| in rad above which an event counts as different")
+    parser.add_argument("--output", "-o", default=None, help="write the report to this json file")
+    args = parser.parse_args(argv)
+
+    pairs = None
+    if args.pairs:
+        pairs = [tuple(pair.split("-")) for pair in args.pairs.split(",")]
+        for pair in pairs:
+            if len(pair) != 2 or not set(pair) <= set(DECAY_MODES):
+                parser.error(f"invalid decay-mode pair {'-'.join(pair)}, modes: {', '.join(DECAY_MODES)}")
+
+    report = validate_precision(
+        n_events=args.events,
+        pairs=pairs,
+        seed=args.seed,
+        precision=args.precision,
+        tolerance=args.tolerance,
+    )
+    print_report(report, args.precision)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = [res for methods in report.values() for res in methods.values() if res["status"] == "fail"]
+    return 1 if failed else 0
+
+
+# PRIVATE
+def _flat(phicp: ak.Array) -> np.ndarray:
+    return ak.to_numpy(ak.flatten(phicp)).astype(np.float64)
+
+
+def _castFloats(array: ak.Array, dtype: str) -> ak.Array:
+    # casts the floating point fields only, charge / pdgId / decayMode are kept as they are
+    def cast(layout, **kwargs):
+        if layout.is_numpy and np.issubdtype(layout.dtype, np.floating) and layout.dtype != dtype:
+            return ak.contents.NumpyArray(layout.data.astype(dtype), parameters=layout.parameters)
+    return ak.transform(cast, array)
+
+
+def _deltaPhi(phi1: np.ndarray, phi2: np.ndarray) -> np.ndarray:
+    dphi = np.abs(phi1 - phi2)
+    return np.minimum(dphi, 2*np.pi - dphi)
+
+
+def _quantile(values: np.ndarray, q: float) -> float:
+    return float(np.percentile(values, q)) if values.size else 0.0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
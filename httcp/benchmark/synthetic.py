@@ -0,0 +1,179 @@
+# coding: utf-8
+
+"""
+Synthetic H -> tau tau events with hadronic tau decays, laid out like the
+hcand / hcandprod columns written by the higgscandprod selector.
+
+The taus come from a 125 GeV Higgs with a random transverse boost and decay
+isotropically through sequential two-body decays:
+  pi  (DM 0)  : tau -> pi nu
+  rho (DM 1)  : tau -> rho nu, rho -> pi pi0 (Breit-Wigner mass), pi0 -> gamma gamma
+  a1  (DM 10) : tau -> a1 nu, a1 -> rho0 pi, rho0 -> pi pi (3 charged pions)
+This is not a physics generator, but the multiplicities, the invariant masses
+and the boosts are the ones the PhiCP chain sees in real events.
+hcand carries the full tau momentum (like GenTau), so that the polarimetric
+vectors are well defined.
+"""
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.nanoaod")
+
+
+MH      = 125.10
+MTAU    = 1.77686
+MPI     = 0.13957
+MPI0    = 0.13498
+MRHO    = 0.77526
+GRHO    = 0.1491
+MA1     = 1.230
+GA1     = 0.420
+
+# decay mode names used in the benchmark and the corresponding tau decayMode
+DECAY_MODES = {"pi": 0, "rho": 1, "a1": 10}
+
+
+def generate_events(
+        n_events: int,
+        mode_leg1: str,
+        mode_leg2: str,
+        seed: int = 0,
+        channel_id: int = 4,
+) -> ak.Array:
+    """
+    Inputs:
+      n_events   : number of events
+      mode_leg1  : "pi/rho/a1" for hcand 1
+      mode_leg2  : "pi/rho/a1" for hcand 2
+      seed       : random seed
+      channel_id : channel_id of all events (4: tautau)
+    Output:
+      events with event, channel_id, hcand (2 per event: pt, eta, phi, mass,
+      charge, decayMode) and hcandprod (2 lists per event: pt, eta, phi, mass,
+      charge, pdgId)
+    """
+    rng = np.random.default_rng(seed)
+    n = n_events
+
+    # Higgs with a falling pT spectrum, rapidity |y| < 2.5
+    pt_h = rng.exponential(40.0, n)
+    phi_h = rng.uniform(-np.pi, np.pi, n)
+    y_h = rng.uniform(-2.5, 2.5, n)
+    mt_h = np.sqrt(MH**2 + pt_h**2)
+    higgs = np.stack([mt_h*np.cosh(y_h), pt_h*np.cos(phi_h), pt_h*np.sin(phi_h), mt_h*np.sinh(y_h)])
+
+    tau1, tau2 = _two_body(rng, higgs, np.full(n, MTAU), np.full(n, MTAU))
+
+    # opposite charges, random which one is leading
+    charge1 = rng.choice([-1, 1], n)
+    charge2 = -charge1
+
+    legs = [
+        _decay_tau(rng, tau, charge, mode)
+        for tau, charge, mode in [(tau1, charge1, mode_leg1), (tau2, charge2, mode_leg2)]
+    ]
+
+    hcand = ak.from_regular(ak.concatenate([leg[0][:, None] for leg in legs], axis=1))
+    hcandprod = ak.from_regular(ak.concatenate([leg[1][:, None] for leg in legs], axis=1))
+
+    return ak.zip(
+        {
+            "event": np.arange(n, dtype=np.uint64),
+            "channel_id": np.full(n, channel_id, dtype=np.uint8),
+            "hcand": hcand,
+            "hcandprod": hcandprod,
+        },
+        depth_limit=1,
+        behavior=coffea.nanoevents.methods.nanoaod.behavior,
+    )
+
+
+# PRIVATE
+def _boost(p4: np.ndarray, parent: np.ndarray) -> np.ndarray:
+    # boost (4, n) p4 from the rest frame of parent (4, n) to the frame parent is given in
+    b = parent[1:]/parent[0]
+    b2 = np.sum(b*b, axis=0)
+    gamma = 1.0/np.sqrt(1.0 - b2)
+    bp = np.sum(b*p4[1:], axis=0)
+    gamma2 = np.where(b2 > 0, (gamma - 1.0)/np.where(b2 > 0, b2, 1.0), 0.0)
+    E = gamma*(p4[0] + bp)
+    p = p4[1:] + b*(gamma2*bp + gamma*p4[0])
+    return np.concatenate([E[None], p])
+
+
+def _two_body(rng, parent: np.ndarray, m1: np.ndarray, m2: np.ndarray) -> tuple:
+    # isotropic two-body decay of parent (4, n) into daughters of mass m1, m2, in the parent frame
+    M = np.sqrt(np.maximum(parent[0]**2 - np.sum(parent[1:]**2, axis=0), 0.0))
+    p = np.sqrt(np.maximum((M**2 - (m1 + m2)**2)*(M**2 - (m1 - m2)**2), 0.0))/(2*M)
+    cos = rng.uniform(-1, 1, M.size)
+    sin = np.sqrt(1 - cos**2)
+    phi = rng.uniform(-np.pi, np.pi, M.size)
+    d = np.stack([sin*np.cos(phi), sin*np.sin(phi), cos])*p
+    d1 = np.concatenate([np.sqrt(m1**2 + p**2)[None], d])
+    d2 = np.concatenate([np.sqrt(m2**2 + p**2)[None], -d])
+    return _boost(d1, parent), _boost(d2, parent)
+
+
+def _bw_mass(rng, m: float, g: float, mmin: np.ndarray, mmax: np.ndarray) -> np.ndarray:
+    # relativistic Breit-Wigner masses within [mmin, mmax], by inverse transform of the Cauchy cdf
+    lo = np.arctan((mmin**2 - m**2)/(m*g))
+    hi = np.arctan((mmax**2 - m**2)/(m*g))
+    return np.sqrt(m**2 + m*g*np.tan(rng.uniform(lo, hi)))
+
+
+def _decay_tau(rng, tau: np.ndarray, charge: np.ndarray, mode: str) -> tuple:
+    """
+    Returns the hcand record (1 per event) and the list of its decay products
+    """
+    n = tau.shape[1]
+    if mode == "pi":
+        pi, _ = _two_body(rng, tau, np.full(n, MPI), np.zeros(n))
+        prods = [(pi, 211*charge, charge, MPI)]
+    elif mode == "rho":
+        m_rho = _bw_mass(rng, MRHO, GRHO, np.full(n, MPI + MPI0 + 1e-3), np.full(n, MTAU - 1e-3))
+        rho, _ = _two_body(rng, tau, m_rho, np.zeros(n))
+        pi, pi0 = _two_body(rng, rho, np.full(n, MPI), np.full(n, MPI0))
+        g1, g2 = _two_body(rng, pi0, np.zeros(n), np.zeros(n))
+        zero = np.zeros(n, dtype=np.int64)
+        prods = [(pi, 211*charge, charge, MPI), (g1, zero + 22, zero, 0.0), (g2, zero + 22, zero, 0.0)]
+    elif mode == "a1":
+        m_a1 = _bw_mass(rng, MA1, GA1, np.full(n, 3*MPI + 1e-2), np.full(n, MTAU - 1e-3))
+        a1, _ = _two_body(rng, tau, m_a1, np.zeros(n))
+        m_rho = _bw_mass(rng, MRHO, GRHO, np.full(n, 2*MPI + 1e-3), m_a1 - MPI - 1e-3)
+        rho, pi_ss1 = _two_body(rng, a1, m_rho, np.full(n, MPI))
+        pi_ss2, pi_os = _two_body(rng, rho, np.full(n, MPI), np.full(n, MPI))
+        prods = [(pi_ss1, 211*charge, charge, MPI), (pi_os, -211*charge, -charge, MPI),
+                 (pi_ss2, 211*charge, charge, MPI)]
+    else:
+        raise RuntimeError(f"Wrong mode : {mode}")
+
+    hcand = ak.zip({
+        **_pt_eta_phi_m(tau),
+        "charge": charge.astype(np.int64),
+        "decayMode": np.full(n, DECAY_MODES[mode], dtype=np.int64),
+    })
+
+    # (n, nprods) products, flattened to one list per event
+    nprods = len(prods)
+    fields = {key: np.stack([comp[key] for comp in (_pt_eta_phi_m(p4) for p4, _, _, _ in prods)], axis=1)
+              for key in ["pt", "eta", "phi"]}
+    fields["mass"] = np.stack([np.full(n, m) for _, _, _, m in prods], axis=1)
+    fields["charge"] = np.stack([q for _, _, q, _ in prods], axis=1).astype(np.int64)
+    fields["pdgId"] = np.stack([pdg for _, pdg, _, _ in prods], axis=1).astype(np.int64)
+    counts = np.full(n, nprods)
+    hcandprod = ak.zip({key: ak.unflatten(val.ravel(), counts) for key, val in fields.items()})
+
+    return hcand, hcandprod
+
+
+def _pt_eta_phi_m(p4: np.ndarray) -> dict:
+    pt = np.hypot(p4[1], p4[2])
+    return {
+        "pt": pt,
+        "eta": np.arcsinh(p4[3]/pt),
+        "phi": np.arctan2(p4[2], p4[1]),
+        "mass": np.sqrt(np.maximum(p4[0]**2 - np.sum(p4[1:]**2, axis=0), 0.0)),
+    }
@@ -93,6 +93,9 @@ def add_run3_preEE (ana: od.Analysis,
     cfg.x.default_categories = ("incl",)
     #cfg.x.default_variables = ("n_jet", "jet1_pt")
     cfg.x.default_variables = ("event","channel_id")
+    # PhiCP columns computed by hcand_features (names or patterns, all if not set),
+    # datasets can override it with their own phicp_columns aux, see PhiCP_Producer
+    #cfg.x.phicp_columns = ("PhiCP_PVPV", "PhiCP_DPDP")
     cfg.x.default_weight_producer = "main"
 
     # process groups for conveniently looping over certain processs
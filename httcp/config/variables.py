@@ -59,6 +59,10 @@ def keep_columns(cfg: od.Config) -> None:
             f"matched_triggerID_{var}" for var in [
                 "e", "mu", "tau",
             ]
+        } | {
+            f"matched_triggers_{var}" for var in [ # bit per trigger, see httcp.selection.trigger.trigger_id_bits
+                "e", "mu", "tau",
+            ]
         } | {
             f"TrigObj.{var}" for var in [
                 "id", "pt", "eta", "phi", "filterBits",
@@ -0,0 +1,143 @@
+# coding: utf-8
+
+"""
+Compressed-sparse-row index of the GenPart decay tree of a chunk.
+
+The tree is built once from the flat genPartIdxMother and pdgId buffers, with the same
+definitions as the coffea GenParticle self-references (genPartIdxMotherG, distinctParentIdxG,
+childrenIdxG, distinctChildrenIdxG), so that the parents and children of any set of
+particles are read with numpy indexing instead of resolving the global indices of every
+collection through the behaviors (GenPart.distinctParent, GenPart._apply_global_index).
+
+All indices are global, i.e. positions in the flattened GenPart collection of the chunk,
+-1 if there is no such particle. The children of particle i are
+children[children_offsets[i]:children_offsets[i+1]], in increasing index.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+class GenPartTree(object):
+    """
+    Attributes:
+      offsets                   : (events + 1) offsets of the GenPart lists
+      pdgid                     : (n,) pdgId of the particles
+      parent                    : (n,) global index of the mother
+      distinct_parent           : (n,) first ancestor with a different pdgId
+      children_offsets          : (n + 1) offsets of the children of every particle
+      children                  : global indices of the children
+      distinct_children_offsets : (n + 1) offsets of the distinct children
+      distinct_children         : global indices of the particles whose distinct parent it is
+    """
+    def __init__(self, offsets: np.ndarray, mother: np.ndarray, pdgid: np.ndarray):
+        """
+        Inputs:
+          offsets : (events + 1) offsets of the GenPart lists
+          mother  : (n,) genPartIdxMother, index within the event
+          pdgid   : (n,) pdgId
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.pdgid   = np.asarray(pdgid)
+
+        mother = np.asarray(mother, dtype=np.int64)
+        event  = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        self.parent = np.where(mother >= 0, mother + self.offsets[:-1][event], -1)
+
+        self.distinct_parent = _distinctParent(self.parent, self.pdgid)
+
+        self.children_offsets, self.children = _children(self.parent)
+        self.distinct_children_offsets, self.distinct_children = _children(self.distinct_parent)
+
+    def __len__(self) -> int:
+        return len(self.pdgid)
+
+    @classmethod
+    def from_genpart(cls, genpart: ak.Array) -> "GenPartTree":
+        """
+        Inputs:
+          genpart : events.GenPart, not sliced (genPartIdxMother is the index within the event)
+        """
+        counts  = ak.to_numpy(ak.num(genpart.pdgId, axis=1))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(offsets,
+                   ak.to_numpy(ak.flatten(genpart.genPartIdxMother, axis=1)),
+                   ak.to_numpy(ak.flatten(genpart.pdgId, axis=1)))
+
+    def to_global(self, index: ak.Array) -> ak.Array:
+        """
+        Global indices of (events, var) indices within the event (e.g. rawIdx), -1 stays -1
+        """
+        start = ak.Array(self.offsets[:-1])
+        return ak.where(index >= 0, index + start, -1)
+
+    def to_local(self, index: np.ndarray) -> np.ndarray:
+        """
+        Flat global indices to indices within the event, -1 stays -1
+        """
+        index = np.asarray(index)
+        event = np.searchsorted(self.offsets, index, side="right") - 1
+        return np.where(index >= 0, index - self.offsets[np.maximum(event, 0)], -1)
+
+    def get_children(self, index: ak.Array, distinct: bool = False) -> ak.Array:
+        """
+        Inputs:
+          index    : (events, var) global indices
+          distinct : distinct children (distinctChildrenIdxG) instead of the children
+        Output:
+          (events, var, var) global indices of the children, no children for -1 / None
+        """
+        offsets, children = ((self.distinct_children_offsets, self.distinct_children) if distinct
+                             else (self.children_offsets, self.children))
+        flat   = ak.to_numpy(ak.fill_none(ak.flatten(index, axis=1), -1))
+        counts = np.where(flat >= 0, offsets[flat + 1] - offsets[flat], 0)
+        # positions of the children of all the particles in a single gather
+        inner  = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        flat_children = children[np.repeat(offsets[flat], counts) + inner]
+        return ak.unflatten(ak.unflatten(flat_children, counts), ak.num(index, axis=1))
+
+    def take(self, genpart: ak.Array, index: ak.Array) -> ak.Array:
+        """
+        Particles of the global (events, var[, var]) indices, same as GenPart._apply_global_index
+        """
+        flat_genpart = ak.flatten(genpart, axis=1)
+        flat_index   = ak.flatten(index, axis=None)
+        out = flat_genpart[ak.to_numpy(flat_index)]
+        for counts in _countsPerLevel(index):
+            out = ak.unflatten(out, counts)
+        return out
+
+
+# PRIVATE
+def _distinctParent(parent: np.ndarray, pdgid: np.ndarray) -> np.ndarray:
+    # walks up the copies of all the particles at once, one generation per iteration
+    out    = parent.copy()
+    active = np.flatnonzero(out >= 0)
+    while active.size:
+        active = active[pdgid[out[active]] == pdgid[active]]
+        out[active] = parent[out[active]]
+        active = active[out[active] >= 0]
+    return out
+
+
+def _children(parent: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # as the coffea kernel, only the particles after the parent are its children
+    child    = np.flatnonzero((parent >= 0) & (parent <= np.arange(len(parent))))
+    order    = np.argsort(parent[child], kind="stable")
+    children = child[order]
+    offsets  = np.zeros(len(parent) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parent[child], minlength=len(parent)), out=offsets[1:])
+    return offsets, children
+
+
+def _countsPerLevel(index: ak.Array) -> list:
+    # counts of the nested lists, innermost first, to unflatten the flat particles
+    counts = []
+    for axis in range(index.ndim - 1, 0, -1):
+        counts.append(ak.to_numpy(ak.flatten(ak.num(index, axis=axis), axis=None)))
+    return counts
@@ -0,0 +1,186 @@
+# coding: utf-8
+
+"""
+Flat structure-of-arrays Lorentz vectors for the production layer.
+
+4-vectors are contiguous (4, n) numpy buffers ordered as (E, px, py, pz), 3-vectors
+are (3, n) buffers ordered as (px, py, pz), so that p4[1:] is the 3-vector part of p4.
+Any trailing shape works as long as the first axis holds the components, e.g. (4, 3, n)
+for three pions per event. A jagged collection is described by its flat buffer and the
+(events + 1) offsets of its lists, see from_awkward / to_awkward.
+
+The expressions are the ones of coffea's vector behaviors (e.g. unit is v*(1/|v|),
+dot is the 3-vector product of the spatial components), so the results are the same
+to the last bit, without the behavior dispatch and the record zipping of every step.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.vector")
+
+
+def from_awkward(array: ak.Array, dtype: str | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Inputs:
+      array : (events, var) vector records, pt/eta/phi/mass (hcand, hcandprod, PtEtaPhiMLorentzVector)
+              or cartesian x/y/z[/t] (LorentzVector, ThreeVector)
+      dtype : floating point type of the buffer, the components are cast before the
+              conversion to cartesian, default: the type of the components
+    Output:
+      (4, n) buffer, (3, n) for ThreeVectors, and the (events + 1) offsets of the lists
+      missing lists are empty, missing vectors are NaN
+    """
+    counts = ak.to_numpy(ak.fill_none(ak.num(array, axis=1), 0))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    flat = ak.flatten(array, axis=1)
+    def comp(name):
+        values = ak.to_numpy(ak.fill_none(flat[name], np.nan))
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    fields = ak.fields(flat)
+    if "pt" in fields:
+        return from_ptetaphim(comp("pt"), comp("eta"), comp("phi"), comp("mass")), offsets
+    if "t" in fields:
+        return np.stack([comp("t"), comp("x"), comp("y"), comp("z")]), offsets
+    return np.stack([comp("x"), comp("y"), comp("z")]), offsets
+
+
+def to_awkward(vec: np.ndarray, offsets: np.ndarray, with_name: str | None = None) -> ak.Array:
+    """
+    Inputs:
+      vec       : (4, n) or (3, n) buffer
+      offsets   : (events + 1) offsets of the lists
+      with_name : record name, default LorentzVector / ThreeVector
+    Output:
+      jagged vector records with coffea behavior, the fields are views of the rows of vec (no copy)
+    """
+    if len(vec) == 4:
+        fields, rows = ["x", "y", "z", "t"], [vec[1], vec[2], vec[3], vec[0]]
+    else:
+        fields, rows = ["x", "y", "z"], [vec[0], vec[1], vec[2]]
+    with_name = with_name or ("LorentzVector" if len(vec) == 4 else "ThreeVector")
+
+    content = ak.contents.RecordArray(
+        [ak.contents.NumpyArray(np.ascontiguousarray(row)) for row in rows],
+        fields,
+        parameters={"__record__": with_name},
+    )
+    layout = ak.contents.ListOffsetArray(ak.index.Index64(np.asarray(offsets, dtype=np.int64)), content)
+    return ak.Array(layout, behavior=coffea.nanoevents.methods.vector.behavior)
+
+
+def offsets_from_counts(counts: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def nth(vec: np.ndarray, offsets: np.ndarray, index: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The index-th vector of every event as a (4, events) buffer, zero for the events
+    that have less than index + 1 vectors, and the mask of the events that have it
+    """
+    has = np.diff(offsets) > index
+    out = np.zeros(vec.shape[:1] + has.shape, dtype=vec.dtype)
+    out[:, has] = vec[:, offsets[:-1][has] + index]
+    return out, has
+
+
+def from_ptetaphim(pt: np.ndarray, eta: np.ndarray, phi: np.ndarray, mass: np.ndarray) -> np.ndarray:
+    # same conversion as coffea's PtEtaPhiMLorentzVector
+    return np.stack([np.hypot(pt*np.cosh(eta), mass),
+                     pt*np.cos(phi),
+                     pt*np.sin(phi),
+                     pt*np.sinh(eta)])
+
+
+def dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # minkowski product (+, -, -, -) of 4-vectors
+    return a[0]*b[0] - a[1]*b[1] - a[2]*b[2] - a[3]*b[3]
+
+
+def dot3(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # euclidean product of 3-vectors, same as coffea's dot (use p4[1:] for 4-vectors)
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+
+
+def mass2(p4: np.ndarray) -> np.ndarray:
+    return p4[0]*p4[0] - p4[1]*p4[1] - p4[2]*p4[2] - p4[3]*p4[3]
+
+
+def mass(p4: np.ndarray) -> np.ndarray:
+    return np.sqrt(mass2(p4))
+
+
+def rho(v: np.ndarray) -> np.ndarray:
+    # length of a 3-vector
+    return np.sqrt(dot3(v, v))
+
+
+def pt(v: np.ndarray) -> np.ndarray:
+    # transverse momentum of a 3-vector
+    return np.sqrt(v[0]*v[0] + v[1]*v[1])
+
+
+def eta(v: np.ndarray) -> np.ndarray:
+    return np.arcsinh(v[2]/pt(v))
+
+
+def phi(v: np.ndarray) -> np.ndarray:
+    return np.arctan2(v[1], v[0])
+
+
+def unit(v: np.ndarray) -> np.ndarray:
+    return v*(1/rho(v))
+
+
+def cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.stack([a[1]*b[2] - a[2]*b[1],
+                     a[2]*b[0] - a[0]*b[2],
+                     a[0]*b[1] - a[1]*b[0]])
+
+
+def boostvec(p4: np.ndarray) -> np.ndarray:
+    """
+    The 3-vector part divided by E, the unit vector where |E| <= |p|, zero for a zero p
+    To boost a vector into the rest frame of p4, use -boostvec(p4)
+    """
+    r = rho(p4[1:])
+    t = p4[0]
+    with np.errstate(divide="ignore"):
+        factor = np.where(r == 0, 0, np.where(np.abs(t) <= r, 1/r, 1/t))
+    return p4[1:]*factor
+
+
+def boost(p4: np.ndarray, beta: np.ndarray) -> np.ndarray:
+    """
+    Lorentz boost of p4 by the 3-vector beta, beta broadcasts against the vectors
+    (e.g. beta (3, events) for p4 (4, 3, events))
+    """
+    b2     = dot3(beta, beta)
+    gamma  = (1 - b2) ** (-0.5)
+    mask   = b2 == 0
+    gamma2 = np.where(mask, 0, (gamma - 1)/np.where(mask, 1, b2))
+
+    bp = dot3(p4[1:], beta)
+    t  = p4[0]
+    return np.stack([gamma*(t + bp),
+                     p4[1] + (gamma2*bp*beta[0] + t*gamma*beta[0]),
+                     p4[2] + (gamma2*bp*beta[1] + t*gamma*beta[1]),
+                     p4[3] + (gamma2*bp*beta[2] + t*gamma*beta[2])])
+
+
+def delta_phi(phi1: np.ndarray, phi2: np.ndarray) -> np.ndarray:
+    # within [-pi, pi)
+    return (phi1 - phi2 + np.pi) % (2*np.pi) - np.pi
+
+
+def delta_r(eta1: np.ndarray, phi1: np.ndarray, eta2: np.ndarray, phi2: np.ndarray) -> np.ndarray:
+    return np.hypot(eta1 - eta2, delta_phi(phi1, phi2))
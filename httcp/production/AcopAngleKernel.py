@@ -0,0 +1,65 @@
+"""
+Per-event compiled kernel for the acoplanarity angle of the PhiCP estimator.
+
+Scalar port of PhiCP_Estimator._acopAngle and _getSign. The P/R/H vectors, the charges and the
+phase-shift are read from the flat buffers of _prepareFlatVecs and the angle in [0, 2pi) is
+written in a single pass, without the charge selections of whole (3, n) vectors. Functions are
+compiled with numba when it is available (see httcp.util.maybe_njit).
+"""
+
+from columnflow.util import maybe_import
+
+from httcp.util import maybe_njit
+
+np = maybe_import("numpy")
+
+
+@maybe_njit
+def acop_angle_kernel(P1, R1, H1, C1, P2, R2, H2, C2, Y, has_y, out):
+    """
+    Inputs:
+        P1, R1, H1    : (3, n) vectors of leg 1, see PhiCP_Estimator.PrepareVecsForPhiCP
+        P2, R2, H2    : (3, n) vectors of leg 2
+        C1, C2        : (n,) charges of the legs, C2 is unused (the legs have opposite charges)
+        Y             : (n,) product of the phase-shifts, only read if has_y
+        has_y         : the method of one of the legs has a phase-shift (DP)
+        out           : (n,) output buffer
+    Output:
+        out, acoplanarity angle in [0, 2pi)
+    """
+    n = out.shape[0]
+    twopi = 2*np.pi
+
+    for i in range(n):
+        cos = R2[0, i]*R1[0, i] + R2[1, i]*R1[1, i] + R2[2, i]*R1[2, i]
+        # same as np.clip, NaN stays NaN
+        if cos > 1.0:
+            cos = 1.0
+        elif cos < -1.0:
+            cos = -1.0
+        acop = np.arccos(cos)
+
+        # sign of Pm.(Hp x Hm), Pm / Hm belong to the tau-
+        if C1[i] < 0:
+            pm0, pm1, pm2 = P1[0, i], P1[1, i], P1[2, i]
+            hm0, hm1, hm2 = H1[0, i], H1[1, i], H1[2, i]
+            hp0, hp1, hp2 = H2[0, i], H2[1, i], H2[2, i]
+        else:
+            pm0, pm1, pm2 = P2[0, i], P2[1, i], P2[2, i]
+            hm0, hm1, hm2 = H2[0, i], H2[1, i], H2[2, i]
+            hp0, hp1, hp2 = H1[0, i], H1[1, i], H1[2, i]
+
+        sign = (pm0*(hp1*hm2 - hp2*hm1)
+                + pm1*(hp2*hm0 - hp0*hm2)
+                + pm2*(hp0*hm1 - hp1*hm0))
+        if sign < 0.0:
+            acop = twopi - acop
+
+        if has_y and Y[i] < 0.0:
+            acop = acop + np.pi
+            if acop > twopi:
+                acop = acop - twopi
+
+        out[i] = acop
+
+    return out
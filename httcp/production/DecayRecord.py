@@ -0,0 +1,106 @@
+# coding: utf-8
+
+"""
+Fixed-width record of the two hcand legs and of their decay products.
+
+Every leg has one tau, up to three charged pions and one pi0, stored in a regular
+(events, 2 legs, 5 slots, 4 components) float64 buffer with the components ordered as
+(E, px, py, pz), see httcp.lorentz. The slots that are filled are flagged in a
+(events, 2) uint8 bitmask, so the legs of a decay mode are selected with one comparison
+and the vectors are numpy views of the buffer, without jagged indexing. Being a plain
+numpy buffer, the record can also be saved and memory-mapped as it is.
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+from httcp import lorentz
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# slots of a leg, the pions are in the order of getpions (os, ss1, ss2 for three pions)
+DECAY_SLOTS = ("tau", "pi1", "pi2", "pi3", "pi0")
+SLOT_TAU = 0
+SLOT_PI  = 1
+SLOT_PI0 = 4
+NPIONS   = 3
+
+# flags of a leg, bit i is set if slot i is filled, plus the overflow bits
+# set if the leg has more pions / pi0 than slots (these are not stored)
+OVERFLOW_PI  = 1 << 5
+OVERFLOW_PI0 = 1 << 6
+
+
+class DecayRecord(object):
+    """
+    Attributes:
+      p4     : (events, 2, 5, 4) float64 4-vectors, zero in the empty slots
+      flags  : (events, 2) uint8 filled slots and overflow bits
+      charge : (events, 2) charge of the hcand, zero if missing
+    Indexing it with event indices (like the p4 arrays of the p4hcandinfo dict)
+    returns the record of these events.
+    """
+    def __init__(self, p4: np.ndarray, flags: np.ndarray, charge: np.ndarray):
+        self.p4     = p4
+        self.flags  = flags
+        self.charge = charge
+
+    def __len__(self) -> int:
+        return len(self.p4)
+
+    def __getitem__(self, idx) -> "DecayRecord":
+        return DecayRecord(self.p4[idx], self.flags[idx], self.charge[idx])
+
+    @classmethod
+    def fromLegs(cls, legs: list) -> "DecayRecord":
+        """
+        Inputs:
+          legs : [(hcand, pions, pi0), (hcand, pions, pi0)] jagged vector records of the
+                 two legs, as in the p4hcandinfo dict of reArrangeDecayProducts
+        """
+        n      = len(legs[0][0])
+        p4     = np.zeros((n, 2, len(DECAY_SLOTS), 4), dtype=np.float64)
+        flags  = np.zeros((n, 2), dtype=np.uint8)
+        charge = None
+
+        for ileg, (hcand, pions, pi0) in enumerate(legs):
+            for first, nslots, overflow, vecs in [(SLOT_TAU, 1, 0, hcand),
+                                                  (SLOT_PI, NPIONS, OVERFLOW_PI, pions),
+                                                  (SLOT_PI0, 1, OVERFLOW_PI0, pi0)]:
+                vec, offsets = lorentz.from_awkward(vecs, "float64")
+                for i in range(nslots):
+                    slot, has = lorentz.nth(vec, offsets, i)
+                    p4[:, ileg, first + i] = slot.T
+                    flags[:, ileg] |= has.astype(np.uint8) << (first + i)
+                if overflow:
+                    flags[:, ileg] |= (np.diff(offsets) > nslots).astype(np.uint8)*overflow
+
+            leg_charge = ak.to_numpy(ak.fill_none(ak.firsts(hcand.charge, axis=1), 0))
+            if charge is None:
+                charge = np.zeros((n, 2), dtype=leg_charge.dtype)
+            charge[:, ileg] = leg_charge
+
+        return cls(p4, flags, charge)
+
+    def vec(self, leg: int, slot: int, nslots: int | None = None) -> np.ndarray:
+        """
+        (4, events) view of a slot of the leg, (4, nslots, events) for nslots consecutive slots
+        """
+        if nslots is None:
+            return self.p4[:, leg, slot].T
+        return self.p4[:, leg, slot:slot + nslots].transpose(2, 1, 0)
+
+    def hasProducts(self, leg: int, npions: int, npi0: int | None = None) -> np.ndarray:
+        """
+        Mask of the events where the leg has one tau and exactly npions pions (up to 3),
+        and exactly npi0 pi0 (0 or 1) if npi0 is given, any number otherwise
+        """
+        mask = (1 << SLOT_TAU) | (((1 << NPIONS) - 1) << SLOT_PI) | OVERFLOW_PI
+        want = (1 << SLOT_TAU) | (((1 << npions) - 1) << SLOT_PI)
+        if npi0 is not None:
+            mask |= (1 << SLOT_PI0) | OVERFLOW_PI0
+            want |= npi0 << SLOT_PI0
+        return (self.flags[:, leg] & mask) == want
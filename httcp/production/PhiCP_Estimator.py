@@ -5,10 +5,55 @@ np = maybe_import("numpy")
 ak = maybe_import("awkward")
 coffea = maybe_import("coffea")
 
-from httcp.production.PolarimetricA1 import PolarimetricA1
+from httcp import lorentz
+from httcp.util import HAS_NUMBA
+from httcp.production.DecayRecord import DecayRecord, SLOT_TAU, SLOT_PI, SLOT_PI0
+from httcp.production.PolarimetricA1 import PolarimetricA1, A1_MODEL_SHIFTS
 from IPython import embed
 
 
+# floating point precision of the PhiCP computation
+# float32: the 4-vectors of the rho legs are cast to single precision, the pi and a1 legs
+#          stay in double precision (the pi-pi PV sign is degenerate with rounded inputs, the
+#          a1 PV is almost collinear to the tau and the DP pairing of the pions can flip),
+#          see httcp.benchmark.precision
+PHICP_PRECISIONS = ("float64", "float32")
+PHICP_FLOAT64_MODES = ("pi", "a1")
+
+# leg modes each method of GetPhiCPMethods applies to
+# IP needs the impact parameter of the legs, which is not stored in hcand yet
+PHICP_LEG_METHODS = {"PV": ("pi", "rho", "a1"), "DP": ("rho", "a1")}
+
+# number of charged pions of the leg modes
+PHICP_LEG_NPIONS = {"pi": 1, "rho": 1, "a1": 3}
+
+
+class ZMFCache(object):
+    """
+    Cache of the flat leg vectors, of the zero momentum frames of the PhiCP methods and
+    of the vectors boosted into them, shared by all the methods and mode pairs evaluated
+    on the same events. reArrangeDecayProducts attaches one to the p4hcandinfo dict ("zmf"),
+    indexing it with event indices (like the p4 arrays of the dict) returns the cache of
+    these events, with the entries already computed sliced instead of recomputed.
+    Entries (numpy, the last axis is the event axis, see httcp.lorentz):
+      (leg, mode)         : dict of the flat vectors of the leg, see _legVecs
+      frame name          : (3, events) boost vector to the frame
+      (frame name, ...)   : vector boosted to the frame
+    """
+    def __init__(self, entries: dict = None):
+        self.entries = entries if entries is not None else {}
+
+    def __getitem__(self, idx) -> "ZMFCache":
+        return ZMFCache({key: _sliceEvents(val, idx) for key, val in self.entries.items()})
+
+    def get(self, key, func):
+        # func computes the entry if it is not cached yet
+        if key not in self.entries:
+            self.entries[key] = func()
+        return self.entries[key]
+
+
+
 def GetPhiCP(
         p4hcandinfodict: dict, 
         method_leg1: str, 
@@ -26,27 +71,121 @@ def GetPhiCP(
       method_leg1     : "DP/PV/IP"
       mode_leg1       : "e/mu/pi/rho/a1"
       mode_leg1       : "pi/rho/a1"
+      kwars           : forwarded to PrepareVecsForPhiCP (e.g. use_a1_kernel, use_a1_table)
+      use_acop_kernel : compute the angle with the compiled kernel (needs numba) [optional]
     Output:
       Final PhiCP array for any methods / configurations
     Steps:
       Prepares the input vectors for PhiCP
       Compute the PhiCP
     """
-    phicp_input_vec_dict = PrepareVecsForPhiCP(p4hcandinfodict,
-                                               method_leg1, method_leg2, 
-                                               mode_leg1, mode_leg2)
-    phicp = ak.values_astype(ComputeAcopAngle(phicp_input_vec_dict), np.float32)
-    phicp = ak.enforce_type(phicp, "var * float32")
+    use_acop_kernel = kwars.pop("use_acop_kernel", False)
+    phicp_input_vec_dict, valid = _prepareFlatVecs(p4hcandinfodict,
+                                                   method_leg1, method_leg2,
+                                                   mode_leg1, mode_leg2,
+                                                   **kwars)
+    phicp = _castPhiCP(_acopAngle(phicp_input_vec_dict, use_acop_kernel), valid)
     
     return phicp
 
 
+def GetPhiCPA1Variations(
+        p4hcandinfodict: dict, 
+        method_leg1: str, 
+        method_leg2: str,
+        mode_leg1: str, 
+        mode_leg2: str,
+        **kwars
+) -> dict:
+    """
+    Inputs:
+      same as GetPhiCP
+    Output:
+      dict{
+        nominal : PhiCP for the nominal a1 model
+        up      : PhiCP for the UP a1 model
+        down    : PhiCP for the DOWN a1 model
+      }
+    Steps:
+      The a1 polarimetric vectors of all the models are computed in one pass
+      (PolarimetricA1.PVCVariations), the other vectors are shared
+      Compute the PhiCP for every model
+    """
+    use_acop_kernel = kwars.pop("use_acop_kernel", False)
+    phicp_input_vec_dicts, valid = _prepareFlatVecs(p4hcandinfodict,
+                                                    method_leg1, method_leg2,
+                                                    mode_leg1, mode_leg2,
+                                                    a1_variations=True,
+                                                    **kwars)
+    return {name: _castPhiCP(_acopAngle(vecs, use_acop_kernel), valid)
+            for name, vecs in phicp_input_vec_dicts.items()}
+
+
+def GetPhiCPMethods(
+        p4hcandinfodict: dict, 
+        methods: list,
+        mode_leg1: str, 
+        mode_leg2: str,
+        **kwars
+) -> dict:
+    """
+    Inputs:
+      p4hcandinfodict : full hcand dict
+      methods         : list of (method_leg1, method_leg2), e.g. [("PV", "PV"), ("DP", "DP")]
+      mode_leg1       : "pi/rho/a1"
+      mode_leg2       : "pi/rho/a1"
+      kwars           : forwarded to PrepareVecsForPhiCP (e.g. use_a1_kernel, a1_variations)
+                        and use_acop_kernel, see GetPhiCP
+    Output:
+      dict{
+        <method_leg1><method_leg2>                  : PhiCP, e.g. PVPV
+        <method_leg1><method_leg2>_a1model_<up/down> : PhiCP for the shifted a1 models, only
+                                                       with a1_variations and a PV a1 leg
+      }
+    Steps:
+      Prepares the input vectors of every method, the leg vectors and the boosts
+      are shared through the ZMFCache of the dict
+      Compute the PhiCP of all the methods
+    """
+    if p4hcandinfodict.get("zmf") is None:
+        p4hcandinfodict = {**p4hcandinfodict, "zmf": ZMFCache()}
+
+    a1_variations = kwars.pop("a1_variations", False)
+    use_acop_kernel = kwars.pop("use_acop_kernel", False)
+    vecsdicts = {}
+    valid = None
+    for method_leg1, method_leg2 in methods:
+        if (mode_leg1 not in PHICP_LEG_METHODS.get(method_leg1, ())
+                or mode_leg2 not in PHICP_LEG_METHODS.get(method_leg2, ())):
+            raise RuntimeError(f"Wrong method / mode : {method_leg1}-{method_leg2} / {mode_leg1}-{mode_leg2}")
+        name = f"{method_leg1}{method_leg2}"
+        has_a1pv = ("PV", "a1") in [(method_leg1, mode_leg1), (method_leg2, mode_leg2)]
+        if a1_variations and has_a1pv:
+            vecs, valid = _prepareFlatVecs(p4hcandinfodict,
+                                           method_leg1, method_leg2,
+                                           mode_leg1, mode_leg2,
+                                           a1_variations=True,
+                                           **kwars)
+            vecsdicts[name] = vecs["nominal"]
+            for shift in ["up", "down"]:
+                vecsdicts[f"{name}_a1model_{shift}"] = vecs[shift]
+        else:
+            vecsdicts[name], valid = _prepareFlatVecs(p4hcandinfodict,
+                                                      method_leg1, method_leg2,
+                                                      mode_leg1, mode_leg2,
+                                                      **kwars)
+
+    # the events with valid legs only depend on the modes, they are the same for all the methods
+    return {name: _castPhiCP(_acopAngle(vecs, use_acop_kernel), valid) for name, vecs in vecsdicts.items()}
+
+
 def PrepareVecsForPhiCP(
         p4hcandinfodict: dict, 
         method_leg1: str, 
         method_leg2: str, 
         mode_leg1: str, 
-        mode_leg2: str
+        mode_leg2: str,
+        **kwargs
 ) -> dict:
     """
     Inputs:
@@ -55,6 +194,13 @@ def PrepareVecsForPhiCP(
       method_leg1     : "DP/PV/IP"
       mode_leg1       : "e/mu/pi/rho/a1"
       mode_leg1       : "pi/rho/a1"
+      use_a1_kernel   : use the compiled kernel for the a1 polarimetric vector [optional]
+      use_a1_table    : use the tabulated a1 lineshape for the a1 polarimetric vector [optional]
+      a1_variations   : return one dict per a1 model, see A1_MODEL_SHIFTS [optional]
+      precision       : "float64" (default) or "float32", see PHICP_PRECISIONS [optional]
+      p4hcandinfodict["zmf"] : ZMFCache, the boosts are taken from / stored in it [optional]
+      p4hcandinfodict["decay"] : DecayRecord, the legs are read from it instead of the
+                                 jagged p4h* arrays [optional]
     Output:
       dict{
         P1 : tau/pi/... for hcand1
@@ -68,33 +214,19 @@ def PrepareVecsForPhiCP(
         Y1 : Phase-shift for hacnd1 [only for DP]
         Y2 : Phase-shift for hacnd2 [only for DP]
       }
+      one entry per event, none if a leg does not have the decay products of its mode
     Steps:
-      Prepare input vectors for PhiCP calculation
+      Prepare input vectors for PhiCP calculation on flat buffers (_prepareFlatVecs)
+      Scatter them to jagged arrays
     """
-    p4h1    = p4hcandinfodict["p4h1"]
-    p4h1pi  = p4hcandinfodict["p4h1pi"]
-    p4h1pi0 = p4hcandinfodict["p4h1pi0"]
-    p4h2    = p4hcandinfodict["p4h2"]
-    p4h2pi  = p4hcandinfodict["p4h2pi"]
-    p4h2pi0 = p4hcandinfodict["p4h2pi0"]
-    
-    _P1, _R1, _C1 = _prepareVecs(p4h1, p4h1pi, p4h1pi0, method_leg1, mode_leg1)
-    _P2, _R2, _C2 = _prepareVecs(p4h2, p4h2pi, p4h2pi0, method_leg2, mode_leg2)
+    vecs, valid = _prepareFlatVecs(p4hcandinfodict,
+                                   method_leg1, method_leg2,
+                                   mode_leg1, mode_leg2,
+                                   **kwargs)
+    if not kwargs.get("a1_variations", False):
+        return _toAwkwardVecs(vecs, valid)
 
-    # Get Boost
-    boostv = _getBoost(_P1, _R1,
-                       _P2, _R2,
-                       method_leg1, 
-                       method_leg2,
-                       mode_leg1, 
-                       mode_leg2)
-
-    P1, R1, H1, Y1 = _reStructureVecs(boostv, _P1, _R1, p4h1pi0, method_leg1, mode_leg1)
-    P2, R2, H2, Y2 = _reStructureVecs(boostv, _P2, _R2, p4h2pi0, method_leg2, mode_leg2)
-
-    return {"P1" : P1, "R1" : R1, "H1": H1, "C1": _C1,
-            "P2" : P2, "R2" : R2, "H2": H2, "C2": _C2,
-            "Y1" : Y1, "Y2" : Y2}
+    return {name: _toAwkwardVecs(vecsdict, valid) for name, vecsdict in vecs.items()}
 
 
 
@@ -107,9 +239,26 @@ def ComputeAcopAngle(vecsdict):
        H1/H2  --> R1/R2
        Y1     --> phase-shift for leg 1
        Y2     --> phase-shift for leg 2
+    The jagged inputs are converted to flat buffers, see _acopAngle
     """
     #embed()
     assert len(vecsdict) == 10, "input dict to ComputeAcopAngle does not have proper structure"
+    flat = {}
+    for key, vec in vecsdict.items():
+        if vec is None:
+            flat[key] = None
+        elif key[0] in ["P", "R", "H"]:
+            flat[key], offsets = lorentz.from_awkward(vec)
+        else:
+            flat[key] = ak.to_numpy(ak.flatten(vec, axis=1))
+
+    return ak.unflatten(_acopAngle(flat), np.diff(offsets))
+
+
+# PRIVATE
+def _acopAngle(vecsdict: dict, use_kernel: bool = False) -> np.ndarray:
+    # ComputeAcopAngle on flat (3, events) vectors and (events) charges / phase-shifts
+    # with use_kernel and numba, the angle is computed by AcopAngleKernel in one loop
     P1 = vecsdict["P1"]
     R1 = vecsdict["R1"]
     H1 = vecsdict["H1"]
@@ -130,39 +279,196 @@ def ComputeAcopAngle(vecsdict):
         if Y2 is not None:
             Y = Y2
             
-    acop = np.arccos(R2.dot(R1))
+    if use_kernel and HAS_NUMBA:
+        from httcp.production.AcopAngleKernel import acop_angle_kernel
+        out = np.empty(len(C1), dtype=np.result_type(R1, R2))
+        return acop_angle_kernel(P1, R1, H1, C1, P2, R2, H2, C2,
+                                 Y if Y is not None else out, Y is not None, out)
+
+    # R1 / R2 are unit vectors, rounding can push their product out of [-1, 1] (float32)
+    acop = np.arccos(np.clip(lorentz.dot3(R2, R1), -1.0, 1.0))
     sign = _getSign(P1,H1,P2,H2,C1,C2) #P1.dot(H2.cross(H1))
-    acop = ak.where(sign < 0.0, 2*np.pi - acop, acop)
+    acop = np.where(sign < 0.0, 2*np.pi - acop, acop)
     if Y is not None:
-        acop  = ak.where(Y < 0.0, acop + np.pi, acop)
-        acop  = ak.where((Y < 0.0) & (acop > 2*np.pi), 
+        acop  = np.where(Y < 0.0, acop + np.pi, acop)
+        acop  = np.where((Y < 0.0) & (acop > 2*np.pi),
                          acop - 2*np.pi, 
                          acop)
         
     return acop
 
 
-# PRIVATE
+def _prepareFlatVecs(
+        p4hcandinfodict: dict,
+        method_leg1: str,
+        method_leg2: str,
+        mode_leg1: str,
+        mode_leg2: str,
+        **kwargs
+) -> tuple[dict, np.ndarray]:
+    """
+    PrepareVecsForPhiCP on flat buffers, one vector per event (see httcp.lorentz)
+    Returns the dict of PrepareVecsForPhiCP with (3, events) vectors and (events) charges /
+    phase-shifts, and the mask of the events where both legs have the decay products of
+    their modes, the vectors of the other events are meaningless
+    """
+    precision = kwargs.pop("precision", "float64")
+    if precision not in PHICP_PRECISIONS:
+        raise RuntimeError(f"Wrong precision : {precision}")
+    dtype = lambda mode: "float64" if mode in PHICP_FLOAT64_MODES else precision
+
+    # the cached vectors are float64, reduced precision inputs get a cache of their own
+    zmf   = p4hcandinfodict.get("zmf") if precision == "float64" else None
+    zmf   = zmf if zmf is not None else ZMFCache()
+
+    leg1  = zmf.get(("h1", mode_leg1), lambda: _leg(p4hcandinfodict, 1, mode_leg1, dtype(mode_leg1)))
+    leg2  = zmf.get(("h2", mode_leg2), lambda: _leg(p4hcandinfodict, 2, mode_leg2, dtype(mode_leg2)))
+
+    _P1, _R1 = _prepareVecs(leg1, method_leg1, mode_leg1)
+    _P2, _R2 = _prepareVecs(leg2, method_leg2, mode_leg2)
+
+    # Get Boost
+    frame = _frameName(method_leg1, method_leg2, mode_leg1, mode_leg2)
+    beta  = zmf.get(frame, lambda: -_getBoost(_P1, _R1,
+                                              _P2, _R2,
+                                              method_leg1,
+                                              method_leg2,
+                                              mode_leg1,
+                                              mode_leg2))
+    # vectors are cached per leg, method and mode, the name tells them apart
+    boost1 = lambda name, vec : zmf.get((frame, "h1", method_leg1, mode_leg1, name),
+                                        lambda: lorentz.boost(vec, beta))
+    boost2 = lambda name, vec : zmf.get((frame, "h2", method_leg2, mode_leg2, name),
+                                        lambda: lorentz.boost(vec, beta))
+
+    # the events without valid legs hold zero vectors
+    with np.errstate(divide="ignore", invalid="ignore"):
+        P1, R1, H1, Y1 = _reStructureVecs(boost1, _P1, _R1, leg1, method_leg1, mode_leg1, **kwargs)
+        P2, R2, H2, Y2 = _reStructureVecs(boost2, _P2, _R2, leg2, method_leg2, mode_leg2, **kwargs)
+
+    vecs = {"P1" : P1, "R1" : R1, "H1": H1, "C1": leg1["charge"],
+            "P2" : P2, "R2" : R2, "H2": H2, "C2": leg2["charge"],
+            "Y1" : Y1, "Y2" : Y2}
+    valid = leg1["valid"] & leg2["valid"]
+
+    if not kwargs.get("a1_variations", False):
+        return vecs, valid
+
+    # a1 legs with PV carry one R/H per a1 model, all the other vectors are shared
+    pick = lambda vec, name: vec[name] if isinstance(vec, dict) else vec
+    return {name: {key: pick(vec, name) for key, vec in vecs.items()} for name in A1_MODEL_SHIFTS}, valid
+
+
+def _leg(p4hcandinfodict: dict, ileg: int, leg_mode: str, dtype: str = "float64") -> dict:
+    # leg vectors from the fixed-width DecayRecord of the dict if there is one, else from the jagged arrays
+    record = p4hcandinfodict.get("decay")
+    if record is not None:
+        return _recordLegVecs(record, ileg - 1, leg_mode, dtype)
+    return _legVecs(p4hcandinfodict[f"p4h{ileg}"],
+                    p4hcandinfodict[f"p4h{ileg}pi"],
+                    p4hcandinfodict[f"p4h{ileg}pi0"],
+                    leg_mode, dtype)
+
+
+def _recordLegVecs(record: DecayRecord, leg: int, leg_mode: str, dtype: str = "float64") -> dict:
+    """
+    Same as _legVecs, from a DecayRecord, the float64 vectors are views of the record
+    """
+    if leg_mode not in PHICP_LEG_NPIONS:
+        raise RuntimeError(f"Wrong mode : {leg_mode}")
+
+    cast   = lambda vec: vec.astype(dtype, copy=False)
+    npions = PHICP_LEG_NPIONS[leg_mode]
+    vecs   = {"tau": cast(record.vec(leg, SLOT_TAU)),
+              "pi" : cast(record.vec(leg, SLOT_PI, npions) if npions > 1 else record.vec(leg, SLOT_PI))}
+    if leg_mode == "rho":
+        vecs["pi0"] = cast(record.vec(leg, SLOT_PI0))
+
+    vecs["charge"] = record.charge[:, leg]
+    vecs["valid"]  = record.hasProducts(leg, npions, 1 if leg_mode == "rho" else None)
+    return vecs
+
+
+def _legVecs(
+        hcand: ak.Array,
+        hcand_pi: ak.Array,
+        hcand_pi0: ak.Array,
+        leg_mode: str,
+        dtype: str = "float64",
+) -> dict:
+    """
+    Flat vectors of one leg, one per event, zero if missing
+      tau    : (4, events)
+      pi     : (4, events), (4, 3, events) for a1 ordered as os, ss1, ss2
+      pi0    : (4, events), only for rho
+      charge : (events) charge of hcand
+      valid  : (events) the leg has one hcand, the pions of its mode and one pi0 for rho
+    """
+    if leg_mode not in PHICP_LEG_NPIONS:
+        raise RuntimeError(f"Wrong mode : {leg_mode}")
+
+    p4, offsets = lorentz.from_awkward(hcand, dtype)
+    tau, _      = lorentz.nth(p4, offsets, 0)
+    valid       = np.diff(offsets) == 1
+
+    npions      = PHICP_LEG_NPIONS[leg_mode]
+    p4, offsets = lorentz.from_awkward(hcand_pi, dtype)
+    pi          = np.stack([lorentz.nth(p4, offsets, i)[0] for i in range(npions)], axis=1)
+    valid       = valid & (np.diff(offsets) == npions)
+
+    vecs = {"tau": tau, "pi": pi if npions > 1 else pi[:, 0]}
+    if leg_mode == "rho":
+        p4, offsets = lorentz.from_awkward(hcand_pi0, dtype)
+        vecs["pi0"] = lorentz.nth(p4, offsets, 0)[0]
+        valid       = valid & (np.diff(offsets) == 1)
+
+    vecs["charge"] = ak.to_numpy(ak.fill_none(ak.firsts(hcand.charge, axis=1), 0))
+    vecs["valid"]  = valid
+    return vecs
+
+
+def _toAwkwardVecs(vecs: dict, valid: np.ndarray) -> dict:
+    # jagged vectors / charges / phase-shifts with one entry per valid event
+    counts  = valid.astype(np.int64)
+    offsets = lorentz.offsets_from_counts(counts)
+    convert = lambda vec: (None if vec is None else
+                           lorentz.to_awkward(vec[:, valid], offsets) if vec.ndim == 2 else
+                           ak.unflatten(vec[valid], counts))
+    return {key: convert(vec) for key, vec in vecs.items()}
+
+
+def _sliceEvents(val, idx):
+    if isinstance(val, dict):
+        return {key: _sliceEvents(vec, idx) for key, vec in val.items()}
+    return val[..., idx]
+
+
+def _castPhiCP(acop: np.ndarray, valid: np.ndarray) -> ak.Array:
+    phicp = ak.unflatten(acop[valid].astype(np.float32), valid.astype(np.int64))
+    phicp = ak.enforce_type(phicp, "var * float32")
+    return phicp
+
+
 def _getSign(P1,H1,P2,H2,C1,C2):
     #embed()
-    Pm = ak.where(C1 < 0, P1, P2) # check tau-
-    Hm = ak.where(C1 < 0, H1, H2) # Sort according to tau charge
-    Hp = ak.where(C1 < 0, H2, H1) # Same
-    angle = Pm.dot(Hp.cross(Hm))
+    Pm = np.where(C1 < 0, P1, P2) # check tau-
+    Hm = np.where(C1 < 0, H1, H2) # Sort according to tau charge
+    Hp = np.where(C1 < 0, H2, H1) # Same
+    angle = lorentz.dot3(Pm, lorentz.cross(Hp, Hm))
     return angle
     
 
 def _getBoost(
-        P1   : ak.Array, 
-        R1   : ak.Array, 
-        P2   : ak.Array, 
-        R2   : ak.Array, 
+        P1   : np.ndarray,
+        R1   : np.ndarray,
+        P2   : np.ndarray,
+        R2   : np.ndarray,
         leg1_method: str, 
         leg2_method: str, 
         leg1_mode: str, 
         leg2_mode: str,
         **kwargs
-) -> ak.Array:
+) -> np.ndarray:
 
     frame = None
     if leg1_method == "PV" and leg2_method == "PV":
@@ -212,16 +518,26 @@ def _getBoost(
         # v2m -- pi0-
         frame = v1p + v1m
     """
-    return frame.boostvec
+    return lorentz.boostvec(frame)
+
+
+def _frameName(
+        leg1_method: str, 
+        leg2_method: str, 
+        leg1_mode: str, 
+        leg2_mode: str,
+) -> str:
+    # name of the frame given by _getBoost, the same for all the PVPV modes but pi-pi
+    if leg1_method == "PV" and leg2_method == "PV" and not (leg1_mode == "pi" and leg2_mode == "pi"):
+        return "tau_pair"
+    return f"{leg1_method}_{leg1_mode}-{leg2_method}_{leg2_mode}"
 
 
 def _prepareVecs(
-        hcand: ak.Array, 
-        hcand_pi: ak.Array, 
-        hcand_pi0: ak.Array, 
+        leg: dict,
         leg_method: str, 
         leg_mode: str
-) -> tuple[ak.Array, ak.Array, ak.Array]:
+) -> tuple[np.ndarray, np.ndarray]:
     """
     A private function to be used in PrepareVecsForPhiCP
     This mainly returns the required vectors for different modes and methods
@@ -248,40 +564,40 @@ def _prepareVecs(
 
     if leg_method == "DP":
         if leg_mode == "rho":
-            P = hcand_pi
-            R = hcand_pi0
+            P = leg["pi"]
+            R = leg["pi0"]
         elif leg_mode == "a1":
-            P = _get_pi_a1_DP(hcand_pi)
-            R = hcand_pi[:,:1]
+            P = _get_pi_a1_DP(leg["pi"])
+            R = leg["pi"][:, 0]
         else:
             raise RuntimeError(f"Wrong mode : {leg_mode}")
 
 
     elif leg_method == "PV":
-        P = hcand
-        R = hcand_pi
-
-    elif leg_method == "IP":
-        pass
+        P = leg["tau"]
+        R = leg["pi"]
 
     else:
+        # IP needs the impact parameters, see PHICP_LEG_METHODS
         raise RuntimeError(f"Wrong {leg_method}")
 
-    #embed()
-    hcand_charge = hcand.charge
-    return P, R, hcand_charge
+    return P, R
 
 
 def _reStructureVecs(
-        boostv: ak.Array, 
-        V1: ak.Array, 
-        V2: ak.Array, 
-        V3: ak.Array, 
+        boost, 
+        V1: np.ndarray,
+        V2: np.ndarray,
+        leg: dict,
         leg_method: str, 
-        leg_mode: str
-) -> tuple[ak.Array, ak.Array, ak.Array, ak.Array]:
+        leg_mode: str,
+        use_a1_kernel: bool = False,
+        use_a1_table: bool = False,
+        a1_variations: bool = False,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
     PostProcess the inputs to phicp with boost
+    boost(name, vec) returns vec in the zero momentum frame
     Output : 
     Method : PV
       Mode : Pi, Rho, a1 [only possible modes]
@@ -311,39 +627,38 @@ def _reStructureVecs(
         Input
           V1   : Pi   [from _prepareVecs]
           V2   : Pi0  [from _prepareVecs]
-          V3   : hcand_pi0 [not required]
+          leg  : leg vectors [not required]
         Output
           P : Pion at zero momentum frame
           R : Pi0 (Transverse) at zero momentum frame
           H : R [same, as it will be used to compute the sign]
           Y : Phase shift
         """
-        pi_ZMF  = V1.boost(boostv.negative())
+        pi_ZMF  = boost("pi", V1)
         #embed()
 
-        pi0_ZMF = V2.boost(boostv.negative())
-        pi_ZMF_unit  = pi_ZMF.pvec.unit
-        pi0_ZMF_unit = pi0_ZMF.pvec.unit
-        pi0_ZMF_unit_T = (pi0_ZMF_unit - pi_ZMF_unit*(pi_ZMF_unit.dot(pi0_ZMF_unit))).unit
+        pi0_ZMF = boost("pi0", V2)
+        pi_ZMF_unit  = lorentz.unit(pi_ZMF[1:])
+        pi0_ZMF_unit = lorentz.unit(pi0_ZMF[1:])
+        pi0_ZMF_unit_T = lorentz.unit(pi0_ZMF_unit - pi_ZMF_unit*lorentz.dot3(pi_ZMF_unit, pi0_ZMF_unit))
     
         P = pi_ZMF_unit
         R = pi0_ZMF_unit_T
         H = R
-        Y = (pi_ZMF.energy - pi0_ZMF.energy)/(pi_ZMF.energy + pi0_ZMF.energy)
+        Y = (pi_ZMF[0] - pi0_ZMF[0])/(pi_ZMF[0] + pi0_ZMF[0])
     
     elif leg_method == "PV":
         """
         Input
           V1   : tau [i.e. hcand]
           V2   : Pi  [hcand decay]
-          V3   : Pi0 [hcand decay]
+          leg  : leg vectors [Pi0, charge]
         """
 
-        P, R, H = _pv(boostv, V1, V2, V3, leg_mode)
-
-    elif leg_method == "IP":
-        pass
-
+        P, R, H = _pv(boost, V1, V2, leg, leg_mode,
+                      use_a1_kernel=use_a1_kernel,
+                      use_a1_table=use_a1_table,
+                      a1_variations=a1_variations)
 
     else:
         raise RuntimeError(f"Wrong method: {leg_method}")
@@ -352,41 +667,63 @@ def _reStructureVecs(
 
 
 def _get_pi_a1_DP(p4_pi):
-    Minv1 = (p4_pi[:,:1] + p4_pi[:,1:2]).mass
-    Minv2 = (p4_pi[:,:1] + p4_pi[:,2:3]).mass
-    Pi = ak.where(np.abs(0.77526-Minv1) < np.abs(0.77526-Minv2), p4_pi[:,1:2], p4_pi[:,2:3])
+    Minv1 = lorentz.mass(p4_pi[:, 0] + p4_pi[:, 1])
+    Minv2 = lorentz.mass(p4_pi[:, 0] + p4_pi[:, 2])
+    Pi = np.where(np.abs(0.77526-Minv1) < np.abs(0.77526-Minv2), p4_pi[:, 1], p4_pi[:, 2])
     return Pi
 
 
-def _pv(boostv: ak.Array, 
-        tau : ak.Array, 
-        pi  : ak.Array, 
-        pi0 : ak.Array, 
-        leg_mode: str) -> ak.Array:
-    P  = tau.boost(boostv.negative())
+def _pv(boost, 
+        tau : np.ndarray,
+        pi  : np.ndarray,
+        leg : dict,
+        leg_mode: str,
+        use_a1_kernel: bool = False,
+        use_a1_table: bool = False,
+        a1_variations: bool = False) -> tuple:
+    P  = boost("tau", tau)
     if leg_mode == "pi":
-        pv = pi.boost(boostv.negative()).pvec
+        pv = boost("pi", pi)[1:]
     elif leg_mode == "rho":
-        pi  = pi.boost(boostv.negative())
-        pi0 = pi0.boost(boostv.negative())
-        q   = pi.subtract(pi0)
-        N   = P.subtract(pi.add(pi0))
-        pv  = (((2*(q.dot(N))*q.pvec).subtract(q.mass2*N.pvec)))
+        pi  = boost("pi", pi)
+        pi0 = boost("pi0", leg["pi0"])
+        q   = pi - pi0
+        N   = P - (pi + pi0)
+        pv  = 2*(lorentz.dot3(q[1:], N[1:]))*q[1:] - lorentz.mass2(q)*N[1:]
     elif leg_mode == "a1":
-        os_pi_HRF   = pi[:, 0:1].boost(boostv.negative())
-        ss1_pi_HRF  = pi[:, 1:2].boost(boostv.negative()) 
-        ss2_pi_HRF  = pi[:, 2:3].boost(boostv.negative()) 
-        a1pol       = PolarimetricA1(P,
-                                     os_pi_HRF,
-                                     ss1_pi_HRF,
-                                     ss2_pi_HRF,
-                                     tau.charge)
-        pv          = -a1pol.PVC().pvec
+        # PolarimetricA1 only runs on the legs with three pions
+        valid       = leg["valid"]
+        counts      = valid.astype(np.int64)
+        jagged      = lambda vec: lorentz.to_awkward(vec[:, valid], lorentz.offsets_from_counts(counts))
+        pi_HRF      = boost("pi", pi)
+        a1pol       = PolarimetricA1(jagged(P),
+                                     jagged(pi_HRF[:, 0]),
+                                     jagged(pi_HRF[:, 1]),
+                                     jagged(pi_HRF[:, 2]),
+                                     ak.unflatten(leg["charge"][valid], counts))
+        a1pol.useLineshapeTable = use_a1_table
+        scatter     = lambda pvc: _scatterEvents(-lorentz.from_awkward(pvc)[0][1:], valid)
+        if a1_variations:
+            pv      = {name: scatter(pvc) for name, pvc in a1pol.PVCVariations().items()}
+        else:
+            pv      = scatter(a1pol.PVC(use_kernel=use_a1_kernel))
     else:
         raise RuntimeError(f"Wrong mode: {leg_mode}")
     
-    P = P.pvec.unit
-    H = pv.unit
-    R = (H.cross(P)).unit
+    P = lorentz.unit(P[1:])
+    if isinstance(pv, dict):
+        # one polarimetric vector per a1 model
+        H = {name: lorentz.unit(vec) for name, vec in pv.items()}
+        R = {name: lorentz.unit(lorentz.cross(h, P)) for name, h in H.items()}
+    else:
+        H = lorentz.unit(pv)
+        R = lorentz.unit(lorentz.cross(H, P))
 
     return P, R, H
+
+
+def _scatterEvents(vec: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    # (n, masked events) to (n, events), zero for the other events
+    out = np.zeros(vec.shape[:1] + mask.shape, dtype=vec.dtype)
+    out[:, mask] = vec
+    return out
@@ -5,10 +5,12 @@ A producer to create Acoplanarity angles for differennt methods
 
 import os
 from typing import Optional
+
+import law
 from columnflow.production import Producer, producer
 from columnflow.util import maybe_import
 
-from httcp.production.PhiCP_Estimator import GetPhiCP
+from httcp.production.PhiCP_Estimator import GetPhiCPMethods
 from columnflow.columnar_util import EMPTY_FLOAT, Route, set_ak_column, optional_column as optional
 
 np = maybe_import("numpy")
@@ -17,6 +19,22 @@ ak = maybe_import("awkward")
 from IPython import embed
 
 
+# hcand decayMode of the leg modes, a1 is the 3-prong decay (DM 10) only
+PHICP_DECAY_MODES = {"e": -1, "mu": -2, "pi": 0, "rho": 1, "a1": 10}
+
+# (mode_leg1, mode_leg2) evaluated by ProducePhiCP
+DPDP_MODES = [("rho", "rho"), ("rho", "a1"), ("a1", "rho"), ("a1", "a1")]
+PVPV_MODES = [("pi", "pi"), ("pi", "rho"), ("rho", "pi"), ("rho", "rho"), ("pi", "a1"),
+              ("a1", "pi"), ("rho", "a1"), ("a1", "rho"), ("a1", "a1")]
+
+# columns of ProduceDetPhiCP / ProduceGenPhiCP, only the ones requested by the config
+# (cfg.x.phicp_columns) or by the dataset (dataset_inst.x.phicp_columns) are computed and
+# stored, e.g. ("PhiCP_PVPV",) or () for datasets where PhiCP is not needed, patterns are
+# accepted, all the columns are produced if neither is set
+DET_PHICP_COLUMNS = ("PhiCP_PVPV", "PhiCP_DPDP", "PhiCP_PVPV_a1model_up", "PhiCP_PVPV_a1model_down")
+GEN_PHICP_COLUMNS = ("PhiCPGen_PVPV", "PhiCPGen_DPDP")
+
+
 
 @producer(
     uses={
@@ -27,194 +45,75 @@ from IPython import embed
         optional("GenTau.decayMode"), optional("GenTau.charge"), optional("GenTauProd.pt"),
         optional("GenTauProd.eta"), optional("GenTauProd.phi"), optional("GenTauProd.mass"),
     },
+    # evaluate the a1 polarimetric vector with the compiled per-event kernel (needs numba)
+    use_a1_kernel=False,
+    # interpolate the a1 lineshape from a precomputed table (see PolarimetricA1.LineshapeTable)
+    use_a1_table=False,
+    # compute the acoplanarity angle with the compiled kernel (needs numba)
+    use_acop_kernel=False,
+    # "float32" runs the rho legs in single precision (see PhiCP_Estimator.PHICP_PRECISIONS)
+    precision="float64",
 )
 def ProducePhiCP(
         self: Producer,
         events: ak.Array,
         p4hcandinfo: dict,
+        a1_variations: bool = False,
+        methods: tuple = ("PVPV", "DPDP"),
         **kwargs,
-) -> tuple[ak.Array,ak.Array,ak.Array]:
-
-    PrepareP4 = lambda p4dict, mask : {key: ak.where(mask, val, val[:,:0]) for key, val in p4dict.items()}
-
-    is_e      = lambda leg: ak.fill_none(ak.firsts(leg.decayMode == -1, axis=1), False)
-    is_mu     = lambda leg: ak.fill_none(ak.firsts(leg.decayMode == -2, axis=1), False)
-    is_pi     = lambda leg: ak.fill_none(ak.firsts(leg.decayMode ==  0, axis=1), False)
-    is_rho    = lambda leg: ak.fill_none(ak.firsts(leg.decayMode ==  1, axis=1), False)
-    is_a1DM2  = lambda leg: ak.fill_none(ak.firsts(leg.decayMode ==  2, axis=1), False)
-    is_a1DM10 = lambda leg: ak.fill_none(ak.firsts(leg.decayMode == 10, axis=1), False)
-    is_a1DM11 = lambda leg: ak.fill_none(ak.firsts(leg.decayMode == 11, axis=1), False)
-    is_a1     = is_a1DM10
-
-    p4h1      = p4hcandinfo["p4h1"]
-    p4h2      = p4hcandinfo["p4h2"]
-
-    # etau
-    mask_e_pi    = is_e(p4h1)   &   is_pi(p4h2)
-    mask_e_rho   = is_e(p4h1)   &   is_rho(p4h2)
-    mask_e_a1    = is_e(p4h1)   &   is_a1(p4h2)
-    # mutau
-    mask_mu_pi   = is_mu(p4h1)  &   is_pi(p4h2)
-    mask_mu_rho  = is_mu(p4h1)  &   is_rho(p4h2)
-    mask_mu_a1   = is_mu(p4h1)  &   is_a1(p4h2)
-    # tautau
-    mask_pi_pi   = is_pi(p4h1)  &   is_pi(p4h2)
-    mask_pi_rho  = is_pi(p4h1)  &   is_rho(p4h2)
-    mask_rho_pi  = is_rho(p4h1) &   is_pi(p4h2)
-    mask_pi_a1   = is_pi(p4h1)  &   is_a1(p4h2)
-    mask_a1_pi   = is_a1(p4h1)  &   is_pi(p4h2)
-    mask_rho_rho = is_rho(p4h1) &   is_rho(p4h2)
-    mask_rho_a1  = is_rho(p4h1) &   is_a1(p4h2)
-    mask_a1_rho  = is_a1(p4h1)  &   is_rho(p4h2)
-    mask_a1_a1   = is_a1(p4h1)  &   is_a1(p4h2)
+) -> tuple[ak.Array,ak.Array,ak.Array,dict]:
+    """
+    Returns events, PhiCP_PVPV, PhiCP_DPDP and a dict with the PVPV PhiCP for the
+    "up" and "down" a1 models, filled only if a1_variations is set
+    Only the methods are computed, the PhiCP of the others is None
+    """
+
+    SubsetP4 = lambda idx : {key: val[idx] for key, val in p4hcandinfo.items()}
+    GetPhiCPMethodsMode = lambda *args : GetPhiCPMethods(*args,
+                                                         use_a1_kernel=self.use_a1_kernel,
+                                                         use_a1_table=self.use_a1_table,
+                                                         use_acop_kernel=self.use_acop_kernel,
+                                                         precision=self.precision,
+                                                         a1_variations=a1_variations)
+
+    # event indices per (mode_leg1, mode_leg2), every estimator only runs
+    # on the events of its own modes and the results are scattered back
+    n_events  = len(events)
+    partition = _partitionByModes(p4hcandinfo["p4h1"], p4hcandinfo["p4h2"], PVPV_MODES)
 
     #print("BABUSHCHA")
     #embed()
 
-    # GetPhiCP
+    # GetPhiCPMethods
     # Inputs:
-    #   masked dict of p4hcand
-    #   leg1_method, leg2_method
+    #   dict of p4hcand for the events of the modes
+    #   list of (leg1_method, leg2_method)
     #   leg1_mode,lmeg2_mode
+    # all the methods of a mode pair are computed in one call, the a1 model
+    # variations only change the modes with an a1 polarimetric vector,
+    # nominal, up and down come from one pass over the a1 legs
+    a1_variations = a1_variations and "PVPV" in methods
+    columns = list(methods) + (["PVPV_a1model_up", "PVPV_a1model_down"] if a1_variations else [])
+    parts   = {column: [] for column in columns}
+    for modes in PVPV_MODES:
+        idx = partition[modes]
+        mode_methods = ([("PV", "PV")] if "PVPV" in methods else []) + \
+                       ([("DP", "DP")] if "DPDP" in methods and modes in DPDP_MODES else [])
+        if len(idx) == 0 or not mode_methods:
+            continue
+        phicps  = GetPhiCPMethodsMode(SubsetP4(idx), mode_methods, *modes)
+        for column in columns:
+            # modes without an a1 PV leg have no a1 model variations: the nominal PhiCP
+            phicp = phicps.get(column, phicps.get(column.split("_")[0]))
+            if phicp is not None:
+                parts[column].append((idx, phicp))
 
-    dummyPhiCP = ak.values_astype(events.event[:,None][:,:0], np.float32)
-
-    # DPDP
-    PhiCP_DPDP = ak.where(mask_rho_rho, GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_rho), "DP", "DP", "rho", "rho"), dummyPhiCP)
-    PhiCP_DPDP = ak.where(mask_rho_a1,  GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_a1),  "DP", "DP", "rho", "a1" ), PhiCP_DPDP)
-    PhiCP_DPDP = ak.where(mask_a1_rho,  GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_rho),  "DP", "DP", "a1",  "rho"), PhiCP_DPDP)
-    PhiCP_DPDP = ak.where(mask_a1_a1,   GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_a1),   "DP", "DP", "a1",  "a1" ), PhiCP_DPDP)
-
-    # PVPV
-    PhiCP_PVPV = ak.where(mask_pi_pi,   GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_pi),   "PV", "PV", "pi",  "pi"),  dummyPhiCP)
-    PhiCP_PVPV = ak.where(mask_pi_rho,  GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_rho),  "PV", "PV", "pi", "rho"),  PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_rho_pi,  GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_pi),  "PV", "PV", "rho", "pi"),  PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_rho_rho, GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_rho), "PV", "PV", "rho", "rho"), PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_pi_a1,   GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_a1),   "PV", "PV", "pi", "a1"),   PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_a1_pi,   GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_pi),   "PV", "PV", "a1", "pi"),   PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_rho_a1,  GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_a1),  "PV", "PV", "rho", "a1"),  PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_a1_rho,  GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_rho),  "PV", "PV", "a1", "rho"),  PhiCP_PVPV)
-    PhiCP_PVPV = ak.where(mask_a1_a1,   GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_a1),   "PV", "PV", "a1", "a1"),   PhiCP_PVPV)
-
-    """
-    PhiCP_DPDP = ak.where(mask_rho_rho, # rho-rho
-                          GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_rho), "DP", "DP", "rho", "rho"),
-                          ak.where(mask_rho_a1, # rho-a1
-                                   GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_a1), "DP", "DP", "rho", "a1"),
-                                   ak.where(mask_a1_rho, # a1-rho
-                                            GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_rho), "DP", "DP", "a1", "rho"),
-                                            ak.where(mask_a1_a1, # a1-a1
-                                                     GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_a1), "DP", "DP", "a1", "a1"),
-                                                     ak.values_astype(events.event[:,:0], np.float32) # dummy
-                                                 )
-                                        )
-                               )
-                      )
-
-    PhiCP_PVPV = ak.where(mask_pi_pi, # pi-pi
-                          GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_pi), "PV", "PV", "pi", "pi"),
-                          ak.where(mask_pi_rho, # pi-rho
-                                   GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_rho), "PV", "PV", "pi", "rho"),
-                                   ak.where(mask_rho_pi, # rho-pi
-                                            GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_pi), "PV", "PV", "rho", "pi"),
-                                            ak.where(mask_rho_rho, # rho-rho
-                                                     GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_rho), "PV", "PV", "rho", "rho"),
-                                                     ak.where(mask_rho_a1, #rho-a1
-                                                              GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_a1), "PV", "PV", "rho", "a1"),
-                                                              ak.where(mask_a1_rho, # a1-rho
-                                                                       GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_rho), "PV", "PV", "a1", "rho"),
-                                                                       ak.where(mask_a1_a1, # a1-a1
-                                                                                GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_a1), "PV", "PV", "a1", "a1"),
-                                                                                ak.values_astype(events.event[:,:0], np.float32)
-                                                                            )
-                                                                   )
-                                                          )
-                                                 )
-                                        )
-                               )
-                      )
-
-    # IPIP
-    PhiCP_IPIP = ak.where(mask_e_pi, # e-pi
-                          GetPhiCP(PrepareP4(p4hcandinfo, mask_e_pi), "IP", "IP"),
-                          ak.where(mask_mu_pi, # mu-pi
-                                   GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_pi), "IP", "IP"),
-                                   ak.where(mask_pi_pi, # pi-pi
-                                            GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_pi), "IP", "IP"),
-                                            ak.values_astype(events.event[:,:0], np.float32)
-                                        )
-                               )
-                      )
-    
-    # DPIP
-    PhiCP_DPIP = ak.where(mask_e_rho, # e-rho
-                          GetPhiCP(PrepareP4(p4hcandinfo, mask_e_rho), "IP", "DP"),
-                          ak.where(mask_e_a1, # e-a1
-                                   GetPhiCP(PrepareP4(p4hcandinfo, mask_e_a1), "IP", "DP"),
-                                   ak.where(mask_mu_rho, # mu-rho
-                                            GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_rho), "IP", "DP"),
-                                            ak.where(mask_mu_a1, # mu-a1
-                                                     GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_a1), "IP", "DP"),
-                                                     ak.where(mask_pi_rho, # pi-rho
-                                                              GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_rho), "IP", "DP"),
-                                                              ak.where(mask_rho_pi, # rho-pi
-                                                                       GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_pi), "DP", "IP"),
-                                                                       ak.where(mask_pi_a1, # pi-a1
-                                                                                GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_a1), "IP", "DP"),
-                                                                                ak.where(mask_a1_pi, # a1-pi
-                                                                                         GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_pi), "DP", "IP"),
-                                                                                         ak.values_astype(events.event[:,:0], np.float32)
-                                                                                     )
-                                                                            )
-                                                                   )
-                                                          )
-                                                 )
-                                        )
-                               )
-                      )
-
-    # PVIP
-    PhiCP_PVIP = ak.where(mask_e_pi,
-                          GetPhiCP(PrepareP4(p4hcandinfo, mask_e_pi), "IP", "PV"),
-                          ak.where(mask_e_rho, # e-rho
-                                   GetPhiCP(PrepareP4(p4hcandinfo, mask_e_rho), "IP", "PV"),
-                                   ak.where(mask_e_a1, # e-a1
-                                            GetPhiCP(PrepareP4(p4hcandinfo, mask_e_a1), "IP", "PV"),
-                                            ak.where(mask_mu_pi, # mu-rho
-                                                     GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_pi), "IP", "PV"),
-                                                     ak.where(mask_mu_rho, # mu-rho
-                                                              GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_rho), "IP", "PV"),
-                                                              ak.where(mask_mu_a1, # mu-a1
-                                                                       GetPhiCP(PrepareP4(p4hcandinfo, mask_mu_a1), "IP", "PV"),
-                                                                       ak.where(mask_pi_rho, # pi-rho
-                                                                                GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_rho), "IP", "PV"),
-                                                                                ak.where(mask_rho_pi, # rho-pi
-                                                                                         GetPhiCP(PrepareP4(p4hcandinfo, mask_rho_pi), "PV", "IP"),
-                                                                                         ak.where(mask_pi_a1, # pi-a1
-                                                                                                  GetPhiCP(PrepareP4(p4hcandinfo, mask_pi_a1), "IP", "PV"),
-                                                                                                  ak.where(mask_a1_pi, # a1-pi
-                                                                                                           GetPhiCP(PrepareP4(p4hcandinfo, mask_a1_pi), "PV", "IP"),
-                                                                                                           ak.values_astype(events.event[:,:0], np.float32)
-                                                                                                       )
-                                                                                              )
-                                                                                     )
-                                                                            )
-                                                                   )
-                                                          )
-                                                 )
-                                        )
-                               )
-                      )
+    PhiCP_PVPV = _scatterPhiCP(parts["PVPV"], n_events) if "PVPV" in parts else None
+    PhiCP_DPDP = _scatterPhiCP(parts["DPDP"], n_events) if "DPDP" in parts else None
+    PhiCP_PVPV_a1model = {shift: _scatterPhiCP(parts[f"PVPV_a1model_{shift}"], n_events)
+                          for shift in ["up", "down"]} if a1_variations else {}
 
-    """
-    #events = set_ak_column(events, f"PhiCP{label}_PVPV", PhiCP_PVPV)
-    #events = set_ak_column(events, f"PhiCP{label}_DPDP", PhiCP_DPDP)
-    #events = set_ak_column(events, "PhiCP_IPIP", PhiCP_IPIP)
-    #events = set_ak_column(events, "PhiCP_PVIP", PhiCP_PVIP)
-    #events = set_ak_column(events, "PhiCP_DPIP", PhiCP_DPIP)
-
-    
-    return events, PhiCP_PVPV, PhiCP_DPDP
+    return events, PhiCP_PVPV, PhiCP_DPDP, PhiCP_PVPV_a1model
 
 
 
@@ -223,8 +122,11 @@ def ProducePhiCP(
     uses={
         ProducePhiCP,
     },
+    # restricted to the requested columns in init
     produces={
         "PhiCP_PVPV", "PhiCP_DPDP", #"PhiCP_IPIP", "PhiCP_PVIP", "PhiCP_DPIP",
+        # PVPV with the a1 model couplings shifted up / down
+        "PhiCP_PVPV_a1model_up", "PhiCP_PVPV_a1model_down",
     },
 )
 def ProduceDetPhiCP(
@@ -233,20 +135,40 @@ def ProduceDetPhiCP(
         p4hcandinfo: dict,
         **kwargs,
 ) -> ak.Array:
-    events, PhiCP_PVPV, PhiCP_DPDP = self[ProducePhiCP](events, p4hcandinfo)
+    if not self.columns:
+        return events
+
+    methods       = [method for method in ["PVPV", "DPDP"]
+                     if any(column.startswith(f"PhiCP_{method}") for column in self.columns)]
+    a1_variations = any("_a1model_" in column for column in self.columns)
+    events, PhiCP_PVPV, PhiCP_DPDP, PhiCP_PVPV_a1model = self[ProducePhiCP](events, p4hcandinfo,
+                                                                            a1_variations=a1_variations,
+                                                                            methods=methods)
     
-    events = set_ak_column(events, "PhiCP_PVPV", PhiCP_PVPV)
-    events = set_ak_column(events, "PhiCP_DPDP", PhiCP_DPDP)
+    phicps = {"PhiCP_PVPV": PhiCP_PVPV, "PhiCP_DPDP": PhiCP_DPDP}
+    for shift, PhiCP_PVPV_shifted in PhiCP_PVPV_a1model.items():
+        phicps[f"PhiCP_PVPV_a1model_{shift}"] = PhiCP_PVPV_shifted
+    for column in self.columns:
+        events = set_ak_column(events, column, phicps[column])
 
     return events
 
 
+@ProduceDetPhiCP.init
+def ProduceDetPhiCP_init(self: Producer) -> None:
+    self.columns  = _requestedColumns(self, DET_PHICP_COLUMNS)
+    self.produces = set(self.columns)
+    if not self.columns:
+        self.uses.discard(ProducePhiCP)
+
+
 
 # ------------ GENERATOR LEVEL ----------- #
 @producer(
     uses={
         ProducePhiCP,
     },
+    # restricted to the requested columns in init
     produces={
         "PhiCPGen_PVPV", "PhiCPGen_DPDP", #"PhiCP_IPIP", "PhiCP_PVIP", "PhiCP_DPIP",
     },
@@ -258,9 +180,86 @@ def ProduceGenPhiCP(
         p4hcandinfo: dict,
         **kwargs,
 ) -> ak.Array:
-    events, PhiCP_PVPV, PhiCP_DPDP = self[ProducePhiCP](events, p4hcandinfo)
+    if not self.columns:
+        return events
+
+    methods = [method for method in ["PVPV", "DPDP"] if f"PhiCPGen_{method}" in self.columns]
+    events, PhiCP_PVPV, PhiCP_DPDP, _ = self[ProducePhiCP](events, p4hcandinfo, methods=methods)
     
-    events = set_ak_column(events, "PhiCPGen_PVPV", PhiCP_PVPV)
-    events = set_ak_column(events, "PhiCPGen_DPDP", PhiCP_DPDP)
+    phicps = {"PhiCPGen_PVPV": PhiCP_PVPV, "PhiCPGen_DPDP": PhiCP_DPDP}
+    for column in self.columns:
+        events = set_ak_column(events, column, phicps[column])
 
     return events
+
+
+@ProduceGenPhiCP.init
+def ProduceGenPhiCP_init(self: Producer) -> None:
+    self.columns  = _requestedColumns(self, GEN_PHICP_COLUMNS)
+    self.produces = set(self.columns)
+    if not self.columns:
+        self.uses.discard(ProducePhiCP)
+
+
+
+# PRIVATE
+def _requestedColumns(self: Producer, columns: tuple) -> list:
+    """
+    Returns the columns matching the phicp_columns of the dataset, or else of the config,
+    all the columns if neither is set (or without config, e.g. outside of the tasks)
+    """
+    requested = None
+    dataset_inst = getattr(self, "dataset_inst", None)
+    config_inst  = getattr(self, "config_inst", None)
+    if dataset_inst is not None:
+        requested = dataset_inst.x("phicp_columns", None)
+    if requested is None and config_inst is not None:
+        requested = config_inst.x("phicp_columns", None)
+    if requested is None:
+        return list(columns)
+
+    return [column for column in columns if law.util.multi_match(column, list(requested))]
+
+
+def _partitionByModes(p4h1: ak.Array, p4h2: ak.Array, modes: list) -> dict:
+    """
+    Returns {(mode_leg1, mode_leg2): sorted indices of the events with these modes}
+    One sort of the events by the decayMode pair, the partitions are slices of it
+    """
+    dm1 = ak.to_numpy(ak.fill_none(ak.firsts(p4h1.decayMode, axis=1), -99)).astype(np.int64)
+    dm2 = ak.to_numpy(ak.fill_none(ak.firsts(p4h2.decayMode, axis=1), -99)).astype(np.int64)
+    # only the events with both legs in one of the PHICP_DECAY_MODES, a missing leg (-99) or
+    # another decayMode would alias to the code of a mode pair
+    dm_codes = np.array(list(PHICP_DECAY_MODES.values()), dtype=np.int64)
+    valid = np.flatnonzero(np.isin(dm1, dm_codes) & np.isin(dm2, dm_codes))
+    # the PHICP_DECAY_MODES are within [-2, 10], 100 keeps the pair codes unique
+    code  = 100*dm1[valid] + dm2[valid]
+    sort  = np.argsort(code, kind="stable")
+    order = valid[sort]
+    code  = code[sort]
+
+    partition = {}
+    for mode_leg1, mode_leg2 in modes:
+        c = 100*PHICP_DECAY_MODES[mode_leg1] + PHICP_DECAY_MODES[mode_leg2]
+        lo, hi = np.searchsorted(code, [c, c + 1])
+        partition[(mode_leg1, mode_leg2)] = order[lo:hi]
+
+    return partition
+
+
+def _scatterPhiCP(parts: list, n_events: int) -> ak.Array:
+    """
+    parts : list of (event indices, PhiCP of these events), the indices of the parts are disjoint
+    Returns the PhiCP of all the events, empty for the events which are in no part
+    """
+    counts = np.zeros(n_events, dtype=np.int64)
+    if not parts:
+        return ak.unflatten(np.zeros(0, dtype=np.float32), counts)
+
+    idx   = np.concatenate([idx for idx, _ in parts])
+    phicp = ak.concatenate([phicp for _, phicp in parts], axis=0)
+    order = np.argsort(idx, kind="stable")
+    phicp = phicp[order]
+    counts[idx[order]] = ak.to_numpy(ak.num(phicp, axis=1))
+
+    return ak.unflatten(ak.values_astype(ak.flatten(phicp, axis=1), np.float32), counts)
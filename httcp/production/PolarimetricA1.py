@@ -1,14 +1,37 @@
 import os
+import hashlib
+import tempfile
 from columnflow.util import maybe_import
 
+from httcp.util import HAS_NUMBA
+from httcp import lorentz
+
 np     = maybe_import("numpy")
 ak     = maybe_import("awkward")
-coffea = maybe_import("coffea")
 
-from httcp.production.TComplex import TComplex
 from IPython import embed
 
 
+# Tabulated a1 lineshape FA1A1P(QQ), see PolarimetricA1.LineshapeTable
+# QQ range in GeV^2, outside of it the exact formula is used
+A1_TABLE_QQ_RANGE     = (0.0, 4.0)
+A1_TABLE_NCELLS       = 8192
+# Maximum relative error |table - exact| / |exact| of the tabulated lineshape.
+# Cells where linear interpolation does not reach it (discontinuity of WGA1C/WGA1N
+# at QQ = 0.823 and the K*K threshold around QQ = 1.932) fall back to the exact formula.
+A1_TABLE_MAX_REL_ERROR = 1e-6
+# 3pi thresholds of WGA1N/WGA1C: exactly at them the exact formula takes the polynomial
+# branch while the table stays continuous, so they fall back to the exact formula as well
+A1_TABLE_EXACT_QQ      = (0.1676, 0.1753)
+
+# per-process cache of the lineshape tables
+_A1_TABLES = {}
+
+# a1 model variations evaluated by PolarimetricA1.PVCVariations,
+# in units of the coupling uncertainties (see PolarimetricA1.Couplings)
+A1_MODEL_SHIFTS = {"nominal": 0.0, "up": 1.0, "down": -1.0}
+
+
 class PolarimetricA1:
     def __init__(self,
                  p4_tau    : ak.Array,
@@ -19,13 +42,18 @@ class PolarimetricA1:
         """
         Calculate Polarimetric vector for tau to a1 decay
         All the vectors in the arguments must be wrt the rest frame
+
+        The jagged inputs (one entry per tau) are only used to extract flat
+        px, py, pz, E buffers. The hadronic current, the form factors and the
+        Breit-Wigner propagators are then evaluated on flat numpy float64 /
+        complex128 arrays, and PVC() scatters the result back to the input layout.
         """
 
         self.p4_tau         =  p4_tau       # tau
         self.p4_os_pi       =  p4_os_pi     # os-pion
         self.p4_ss1_pi      =  p4_ss1_pi    # ss1-pion
         self.p4_ss2_pi      =  p4_ss2_pi    # ss2-pion
-        
+
         self.mpi            =  0.13957018   # GeV
         self.mpi0           =  0.1349766    # GeV
         self.mtau           =  1.776        # GeV
@@ -50,63 +78,164 @@ class PolarimetricA1:
         self.SIGN           = -taucharge
         self.doSystematic   =  False
         self.systType       =  "UP"
+        # interpolate FA1A1P from a precomputed table instead of the exact formula
+        self.useLineshapeTable = False
+        # Breit-Wigner propagators shared between the F3PI calls of one _pvc, see BWIGML
+        self._bwmemo        =  None
+
+
+    def PVC(self, use_kernel: bool = False) -> ak.Array:
+        """
+        Polarimetric vector (LorentzVector) with the same jagged layout as p4_tau
+        If use_kernel is set and numba is available, the compiled per-event kernel
+        in PolarimetricA1Kernel is used instead of the vectorized numpy engine
+        (the kernel always evaluates the exact lineshape).
+        """
+        P, offsets = lorentz.from_awkward(self.p4_tau, "float64")
+        q1, _ = lorentz.from_awkward(self.p4_ss1_pi, "float64")
+        q2, _ = lorentz.from_awkward(self.p4_ss2_pi, "float64")
+        q3, _ = lorentz.from_awkward(self.p4_os_pi, "float64")
+        sign = ak.to_numpy(ak.flatten(self.SIGN, axis=1))
+
+        if use_kernel and HAS_NUMBA:
+            from httcp.production.PolarimetricA1Kernel import pvc_a1_kernel
+            out = pvc_a1_kernel(P, q1, q2, q3, sign.astype(np.float64),
+                                np.array([self.COEF1, self.COEF2, self.COEF3]),
+                                np.array(self.Couplings(), dtype=np.complex128),
+                                self.mpi, self.mpi0)
+        else:
+            out = self._pvc(P, q1, q2, q3, sign)
+
+        return lorentz.to_awkward(out, offsets)
+
+
+    def PVCVariations(self) -> dict:
+        """
+        Polarimetric vectors for the nominal, UP and DOWN a1 models, see A1_MODEL_SHIFTS
+        Invariants, Breit-Wigner propagators and the a1 lineshape are computed once,
+        only the coupling-dependent sums are repeated for every model.
+        """
+        P, offsets = lorentz.from_awkward(self.p4_tau, "float64")
+        q1, _ = lorentz.from_awkward(self.p4_ss1_pi, "float64")
+        q2, _ = lorentz.from_awkward(self.p4_ss2_pi, "float64")
+        q3, _ = lorentz.from_awkward(self.p4_os_pi, "float64")
+        sign = ak.to_numpy(ak.flatten(self.SIGN, axis=1))
+
+        couplings = [self.Couplings(scale) for scale in A1_MODEL_SHIFTS.values()]
+        outs = self._pvcMulti(P, q1, q2, q3, sign, couplings)
+
+        return {name: lorentz.to_awkward(out, offsets) for name, out in zip(A1_MODEL_SHIFTS, outs)}
 
 
-    def PVC(self) -> ak.Array:
-        P  = self.p4_tau
-        q1 = self.p4_ss1_pi
-        q2 = self.p4_ss2_pi
-        q3 = self.p4_os_pi
+    def _pvc(self,
+             P    : np.ndarray,
+             q1   : np.ndarray,
+             q2   : np.ndarray,
+             q3   : np.ndarray,
+             sign : np.ndarray) -> np.ndarray:
+        """
+        Flat engine behind PVC()
+        All the 4-vectors are float64 arrays of shape (4, n) ordered as (E, px, py, pz)
+        """
+        return self._pvcMulti(P, q1, q2, q3, sign, [self.Couplings()])[0]
 
+
+    def _pvcMulti(self,
+                  P         : np.ndarray,
+                  q1        : np.ndarray,
+                  q2        : np.ndarray,
+                  q3        : np.ndarray,
+                  sign      : np.ndarray,
+                  couplings : list) -> list:
+        """
+        Same as _pvc, for a list of coupling sets BT1-BT7
+        Returns one (4, n) polarimetric vector per coupling set
+        """
         a1 = q1+q2+q3
 
-        N = P.subtract(a1)
+        N = P - a1
 
-        s1 = (q2+q3).mass2
-        s2 = (q1+q3).mass2
-        s3 = (q1+q2).mass2
+        s1 = lorentz.mass2(q2+q3)
+        s2 = lorentz.mass2(q1+q3)
+        s3 = lorentz.mass2(q1+q2)
 
         # Three Lorentzvector: Why??? : No idea!!!
-        getvec = lambda a,b,c: b - c - a*(a.dot((b - c))*(1/a.mass2))
+        # NOTE: dot products written as P.dot(...) on coffea LorentzVectors are 3-vector products
+        getvec = lambda a,b,c: b - c - a*(lorentz.dot3(a[1:], (b - c)[1:])*(1/lorentz.mass2(a)))
 
         vec1 = getvec(a1, q2, q3)
         vec2 = getvec(a1, q3, q1)
         vec3 = getvec(a1, q1, q2)
-        
-        F1 = TComplex(self.COEF1)*self.F3PI(1, a1.mass2, s1, s2)
-        F2 = TComplex(self.COEF2)*self.F3PI(2, a1.mass2, s2, s1)
-        F3 = TComplex(self.COEF3)*self.F3PI(3, a1.mass2, s3, s1)
 
-        HADCUR = []
+        QQ = lorentz.mass2(a1)
 
-        HADCUR.append(TComplex(vec1.energy)*F1 + TComplex(vec2.energy)*F2 + TComplex(vec3.energy)*F3)
-        HADCUR.append(TComplex(vec1.px)*F1 + TComplex(vec2.px)*F2 + TComplex(vec3.px)*F3)
-        HADCUR.append(TComplex(vec1.py)*F1 + TComplex(vec2.py)*F2 + TComplex(vec3.py)*F3)
-        HADCUR.append(TComplex(vec1.pz)*F1 + TComplex(vec2.pz)*F2 + TComplex(vec3.pz)*F3)
+        # the three form factors share the a1 lineshape and most of the Breit-Wigner propagators
+        FORMA1 = self.LineshapeA1(QQ)
+        self._bwmemo = []
+        try:
+            terms1 = self.F3PITerms(1, QQ, s1, s2)
+            terms2 = self.F3PITerms(2, QQ, s2, s1)
+            terms3 = self.F3PITerms(3, QQ, s3, s1)
+        finally:
+            self._bwmemo = None
 
-        HADCURC = [val.Conjugate() for val in HADCUR]
+        mass = np.sqrt(lorentz.mass2(P))
 
-        CLV = self.CLVEC(HADCUR, HADCURC, N)
-        CLA = self.CLAXI(HADCUR, HADCURC, N)
+        outs = []
+        for BT in couplings:
+            F1 = self.COEF1*(_couple(BT, terms1)*FORMA1)
+            F2 = self.COEF2*(_couple(BT, terms2)*FORMA1)
+            F3 = self.COEF3*(_couple(BT, terms3)*FORMA1)
 
-        pclv    = P.dot(CLV)
-        pcla    = P.dot(CLA)
-        omega   = pclv - pcla
-        A       = (P.mass)**2
-        CLAmCLV = CLA.subtract(CLV)
-        
-        out = ((P.mass)*(P.mass)*(CLA-CLV) - P*(P.dot(CLA) - P.dot(CLV)))*(1/omega/P.mass)
+            # (4, n) complex128: E, px, py, pz components of the hadronic current
+            HADCUR  = vec1*F1 + vec2*F2 + vec3*F3
+            HADCURC = np.conj(HADCUR)
+
+            CLV = self.CLVEC(HADCUR, HADCURC, N)
+            CLA = self.CLAXI(HADCUR, HADCURC, N, sign)
+
+            pclv    = lorentz.dot3(P[1:], CLV[1:])
+            pcla    = lorentz.dot3(P[1:], CLA[1:])
+            omega   = pclv - pcla
+
+            outs.append((mass*mass*(CLA-CLV) - P*(pcla - pclv))*(1/omega/mass))
+
+        return outs
 
-        return out
 
-    
     def F3PI(self,
              IFORM: float,
-             QQ: ak.Array,
-             SA: ak.Array,
-             SB: ak.Array):
+             QQ: np.ndarray,
+             SA: np.ndarray,
+             SB: np.ndarray,
+             FORMA1: np.ndarray = None,
+             BT: tuple = None) -> np.ndarray:
         """
             Calculate the F3PIFactor.
+            FORMA1 is the a1 lineshape at QQ and BT the couplings BT1-BT7,
+            both computed here if not given.
+        """
+        if BT is None:
+            BT = self.Couplings()
+        if FORMA1 is None:
+            FORMA1 = self.LineshapeA1(QQ) # complex128
+
+        F3PIFactor = _couple(BT, self.F3PITerms(IFORM, QQ, SA, SB))
+        out = F3PIFactor*FORMA1
+
+        return  out
+
+
+    def F3PITerms(self,
+                  IFORM: float,
+                  QQ: np.ndarray,
+                  SA: np.ndarray,
+                  SB: np.ndarray) -> list:
+        """
+            Contributions to the F3PIFactor multiplying the couplings BT1-BT7
+            (None if absent), i.e. F3PIFactor = sum_k BTk*terms[k].
+            They do not depend on the couplings, so they can be shared between
+            the nominal and the shifted a1 models.
         """
         MRO = 0.7743
         GRO = 0.1491
@@ -139,47 +268,20 @@ class PolarimetricA1:
         M1SQ = M1*M1
         M2SQ = M2*M2
         M3SQ = M3*M3
-        
-        
-        # parameter varioation for
-        # systematics from https://arxiv.org/pdf/hep-ex/9902022.pdf
-        db2, dph2 = 0.094, 0.253
-        db3, dph3 = 0.094, 0.104
-        db4, dph4 = 0.296, 0.170
-        db5, dph5 = 0.167, 0.104
-        db6, dph6 = 0.284, 0.036
-        db7, dph7 = 0.148, 0.063
 
-        scale = 0.0
-        if self.doSystematic:
-            if self.systType == "UP":
-                scale = 1
-            elif self.systType == "DOWN":
-                scale = -1
-                
-        # Breit-Wigner functions with isotropic decay angular distribution
-        # Real part must be equal to one, stupid polar implemenation in root
-        BT1 = TComplex(1., 0.)
-        BT2 = TComplex(0.12  + scale*db2, 0.) * TComplex(1, (0.99   +  scale*dph2)*np.pi, True)
-        BT3 = TComplex(0.37  + scale*db3, 0.) * TComplex(1, (-0.15  +  scale*dph3)*np.pi, True)
-        BT4 = TComplex(0.87  + scale*db4, 0.) * TComplex(1, (0.53   +  scale*dph4)*np.pi, True)
-        BT5 = TComplex(0.71  + scale*db5, 0.) * TComplex(1, (0.56   +  scale*dph5)*np.pi, True)
-        BT6 = TComplex(2.10  + scale*db6, 0.) * TComplex(1, (0.23   +  scale*dph6)*np.pi, True)
-        BT7 = TComplex(0.77  + scale*db7, 0.) * TComplex(1, (-0.54  +  scale*dph7)*np.pi, True)
-
-        F3PIFactor = None
-        
+        terms = None
+
         if IDK == 2:
             if IFORM == 1 or IFORM == 2:
                 S1 = SA
-                S2 = SB 
+                S2 = SB
                 S3 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
 
                 F134 = -(1 / 3.) * ((S3 - M3SQ) - (S1 - M1SQ))
                 F15A = -(1 / 2.) * ((S2 - M2SQ) - (S3 - M3SQ))
                 F15B = -(1 / 18.) * (QQ - M2SQ + S2) * (2 * M1SQ + 2 * M3SQ - S2) / S2
                 F167 = -(2 / 3.)
-    
+
                 # Breit Wigners for all the contributions:
                 FRO1 = self.BWIGML(S1, MRO, GRO, M2, M3, 1)
                 FRP1 = self.BWIGML(S1, MRP, GRP, M2, M3, 1)
@@ -190,17 +292,16 @@ class PolarimetricA1:
                 FSG2 = self.BWIGML(S2, MSG, GSG, M3, M1, 0)
                 FF02 = self.BWIGML(S2, MF0, GF0, M3, M1, 0)
 
-                F3PIFactor = BT1*FRO1 \
-                           + BT2*FRP1 \
-                           + BT3*TComplex(F134, 0.)*FRO2 \
-                           + BT4*TComplex(F134, 0.)*FRP2 \
-                           - BT5*TComplex(F15A, 0.)*FF21 \
-                           - BT5*TComplex(F15B, 0.)*FF22 \
-                           - BT6*TComplex(F167, 0.)*FSG2 \
-                           - BT7*TComplex(F167, 0.)*FF02
+                terms = [FRO1,
+                         FRP1,
+                         F134*FRO2,
+                         F134*FRP2,
+                         -(F15A*FF21) - F15B*FF22,
+                         -(F167*FSG2),
+                         -(F167*FF02)]
 
             elif IFORM == 3:
-                S3 = SA 
+                S3 = SA
                 S1 = SB
                 S2 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
 
@@ -222,15 +323,17 @@ class PolarimetricA1:
                 FF01 = self.BWIGML(S1, MF0, GF0, M2, M3, 0)
                 FF02 = self.BWIGML(S2, MF0, GF0, M3, M1, 0)
 
-                F3PIFactor = BT3*(TComplex(F34A, 0.)*FRO1 + TComplex(F34B, 0.)*FRO2) \
-                           + BT4*(TComplex(F34A, 0.)*FRP1 + TComplex(F34B, 0.)*FRP2) \
-                           - BT5*(TComplex(F35A, 0.)*FF21 + TComplex(F35B, 0.)*FF22) \
-                           - BT6*(TComplex(F36A, 0.)*FSG1 + TComplex(F36B, 0.)*FSG2) \
-                           - BT7*(TComplex(F36A, 0.)*FF01 + TComplex(F36B, 0.)*FF02)
+                terms = [None,
+                         None,
+                         F34A*FRO1 + F34B*FRO2,
+                         F34A*FRP1 + F34B*FRP2,
+                         -(F35A*FF21 + F35B*FF22),
+                         -(F36A*FSG1 + F36B*FSG2),
+                         -(F36A*FF01 + F36B*FF02)]
 
         if IDK == 1:
             if IFORM == 1 or IFORM == 2:
-                S1 = SA 
+                S1 = SA
                 S2 = SB
                 S3 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
 
@@ -240,7 +343,7 @@ class PolarimetricA1:
                 F150 =  (1 / 18.) * (QQ - M3SQ + S3) * (2*M1SQ + 2*M2SQ - S3) / S3   # array
                 F167 =  (2 / 3.)                                                     # scalar
 
-                # FR**: all are TComplex
+                # FR**: all are complex128
                 FRO1 = self.BWIGML(S1, MRO, GRO, M2, M3, 1)
                 FRP1 = self.BWIGML(S1, MRP, GRP, M2, M3, 1)
                 FRO2 = self.BWIGML(S2, MRO, GRO, M3, M1, 1)
@@ -249,18 +352,17 @@ class PolarimetricA1:
                 FSG3 = self.BWIGML(S3, MSG, GSG, M1, M2, 0)
                 FF03 = self.BWIGML(S3, MF0, GF0, M1, M2, 0)
 
-                
-                F3PIFactor = BT1*FRO1 \
-                           + BT2*FRP1 \
-                           + BT3*TComplex(F134)*FRO2 \
-                           + BT4*TComplex(F134)*FRP2 \
-                           + BT5*TComplex(F150)*FF23 \
-                           + BT6*TComplex(F167)*FSG3 \
-                           + BT7*TComplex(F167)*FF03
-                
+                terms = [FRO1,
+                         FRP1,
+                         F134*FRO2,
+                         F134*FRP2,
+                         F150*FF23,
+                         F167*FSG3,
+                         F167*FF03]
+
             elif IFORM == 3:
                 S3 = SA
-                S1 = SB 
+                S1 = SB
                 S2 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
 
                 F34A = (1 / 3.) * ((S2 - M2SQ) - (S3 - M3SQ)) # array
@@ -271,50 +373,220 @@ class PolarimetricA1:
                 FRP1 = self.BWIGML(S1, MRP, GRP, M2, M3, 1)
                 FRO2 = self.BWIGML(S2, MRO, GRO, M3, M1, 1)
                 FRP2 = self.BWIGML(S2, MRP, GRP, M3, M1, 1)
-                FF23 = self.BWIGML(S3, MF2, GF2, M1, M2, 2)                    
+                FF23 = self.BWIGML(S3, MF2, GF2, M1, M2, 2)
 
-                F3PIFactor = BT3*(TComplex(F34A)*FRO1 + TComplex(F34B)*FRO2) \
-                           + BT4*(TComplex(F34A)*FRP1 + TComplex(F34B)*FRP2) \
-                           + BT5*TComplex(F35)*FF23
+                terms = [None,
+                         None,
+                         F34A*FRO1 + F34B*FRO2,
+                         F34A*FRP1 + F34B*FRP2,
+                         F35*FF23,
+                         None,
+                         None]
 
-        FORMA1 = self.FA1A1P(QQ) # TComplex
-        out = F3PIFactor*FORMA1
+        return terms
 
-        return  out
 
+    def Couplings(self, scale: float = None) -> tuple:
+        """
+            Complex couplings BT1-BT7 of the F3PI contributions, shifted by
+            scale times their uncertainties (+1: UP, -1: DOWN). If scale is not
+            given, it follows doSystematic / systType.
+        """
+        # parameter varioation for
+        # systematics from https://arxiv.org/pdf/hep-ex/9902022.pdf
+        db2, dph2 = 0.094, 0.253
+        db3, dph3 = 0.094, 0.104
+        db4, dph4 = 0.296, 0.170
+        db5, dph5 = 0.167, 0.104
+        db6, dph6 = 0.284, 0.036
+        db7, dph7 = 0.148, 0.063
+
+        if scale is None:
+            scale = 0.0
+            if self.doSystematic:
+                if self.systType == "UP":
+                    scale = 1
+                elif self.systType == "DOWN":
+                    scale = -1
+
+        # Breit-Wigner functions with isotropic decay angular distribution
+        # Real part must be equal to one, stupid polar implemenation in root
+        BT1 = complex(1., 0.)
+        BT2 = _polar(0.12  + scale*db2, (0.99   +  scale*dph2)*np.pi)
+        BT3 = _polar(0.37  + scale*db3, (-0.15  +  scale*dph3)*np.pi)
+        BT4 = _polar(0.87  + scale*db4, (0.53   +  scale*dph4)*np.pi)
+        BT5 = _polar(0.71  + scale*db5, (0.56   +  scale*dph5)*np.pi)
+        BT6 = _polar(2.10  + scale*db6, (0.23   +  scale*dph6)*np.pi)
+        BT7 = _polar(0.77  + scale*db7, (-0.54  +  scale*dph7)*np.pi)
+
+        return BT1, BT2, BT3, BT4, BT5, BT6, BT7
+
+
+    def LineshapeA1(self, QQ: np.ndarray) -> np.ndarray:
+        """
+            a1 lineshape, tabulated if useLineshapeTable is set, exact otherwise
+        """
+        if self.useLineshapeTable:
+            return self.TabulatedFA1A1P(QQ)
+        return self.FA1A1P(QQ)
+
+
+    def TabulatedFA1A1P(self, QQ: np.ndarray) -> np.ndarray:
+        """
+            FA1A1P(QQ) by linear interpolation in the lineshape table.
+            Values outside A1_TABLE_QQ_RANGE, NaNs, flagged cells and A1_TABLE_EXACT_QQ use the
+            exact formula.
+        """
+        q0, h, F, slope, exact = self.LineshapeTable()
+        QQ = np.asarray(QQ, dtype=np.float64)
+        out = np.empty(QQ.shape, dtype=np.complex128)
+
+        inside = (QQ >= q0) & (QQ < q0 + h*len(slope))
+        idx = ((QQ[inside] - q0)*(1/h)).astype(np.int64)
+        idx = np.minimum(idx, len(slope) - 1)
+        out[inside] = F[idx] + slope[idx]*(QQ[inside] - (q0 + h*idx))
+
+        mask = ~inside
+        mask[inside] = exact[idx] | np.isin(QQ[inside], A1_TABLE_EXACT_QQ)
+        if np.any(mask):
+            out[mask] = self.FA1A1P(QQ[mask])
+
+        return out
+
+
+    def LineshapeTable(self) -> tuple:
+        """
+            Returns (q0, h, F, slope, exact) describing FA1A1P on A1_TABLE_NCELLS uniform cells.
+            F and slope are the complex values and derivatives at the cell edges, exact flags
+            cells evaluated with the exact formula. The table is built once per process and
+            cached on disk in $HTTCP_A1_TABLE_DIR (default: <tmpdir>/httcp_a1_tables), keyed
+            on the grid setup and on FA1A1P evaluated at probe points, so changing any of the
+            lineshape parameters creates a new table.
+        """
+        q0, q1 = A1_TABLE_QQ_RANGE
+        n = A1_TABLE_NCELLS
+        probe = self.FA1A1P(np.linspace(q0, q1, 97))
+        key = hashlib.sha1(
+            np.array([q0, q1, n, A1_TABLE_MAX_REL_ERROR]).tobytes() + probe.tobytes()
+        ).hexdigest()[:16]
+
+        if key in _A1_TABLES:
+            return _A1_TABLES[key]
+
+        cache_dir = os.getenv("HTTCP_A1_TABLE_DIR", os.path.join(tempfile.gettempdir(), "httcp_a1_tables"))
+        cache_file = os.path.join(cache_dir, f"fa1a1p_{key}.npz")
+
+        table = None
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as f:
+                    table = (float(f["q0"]), float(f["h"]), f["F"], f["slope"], f["exact"])
+            except (OSError, KeyError, ValueError):
+                table = None
+
+        if table is None:
+            table = self._buildLineshapeTable(q0, q1, n)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp.npz"
+                np.savez(tmp_file, q0=table[0], h=table[1], F=table[2], slope=table[3], exact=table[4])
+                os.replace(tmp_file, cache_file)
+            except OSError:
+                # read-only or full disk, keep the table in memory only
+                pass
+
+        _A1_TABLES[key] = table
+
+        return table
+
+
+    def _buildLineshapeTable(self, q0: float, q1: float, n: int) -> tuple:
+        h = (q1 - q0)/n
+        x = q0 + h*np.arange(n + 1)
+        F = self.FA1A1P(x)
+        slope = (F[1:] - F[:-1])*(1/h)
+
+        # compare with the exact formula at 7 points inside every cell and flag
+        # the cells which do not reach A1_TABLE_MAX_REL_ERROR
+        t = x[:-1, None] + h*(np.arange(1, 8)/8.0)[None, :]
+        ref = self.FA1A1P(t.ravel()).reshape(t.shape)
+        interp = F[:-1, None] + slope[:, None]*(t - x[:-1, None])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            relerr = np.abs(interp - ref)/np.abs(ref)
+        exact = ~np.all(relerr <= A1_TABLE_MAX_REL_ERROR, axis=1)
+
+        return q0, h, F, slope, exact
 
 
     # ------- L-wave BreightWigner for rho
     # Breit-Wigner function with isotropic decay angular distribution
     def BWIGML(self,
-               S: ak.Array,
+               S: np.ndarray,
                M: float,
                G: float,
                m1: float,
                m2: float,
-               L: int):
+               L: int) -> np.ndarray:
+        """
+            Within _pvc the propagators are memoised in self._bwmemo. The result only depends
+            on S, M, G, L and on (m1 + m2)^2, (m1 - m2)^2, which are symmetric in m1 <-> m2.
+            An invariant recomputed with a different summation order (e.g. S3 in IFORM 1 and 2)
+            is compared element-wise, and only the entries which differ are evaluated again,
+            so the outputs are bit-identical to the unmemoised evaluation.
+        """
+        MP = (m1 + m2)**2 # scalar
+        MM = (m1 - m2)**2 # scalar
+
+        if self._bwmemo is None:
+            return self._bwigml(S, M, G, m1, m2, L)
+
+        key = (M, G, MP, MM, L)
+        for _key, _S, _out in self._bwmemo:
+            if _key != key or _S.shape != S.shape:
+                continue
+            if _S is S:
+                return _out
+            diff = S != _S
+            ndiff = np.count_nonzero(diff)
+            if ndiff == 0:
+                return _out
+            if 2*ndiff <= S.size:
+                out = _out.copy()
+                out[diff] = self._bwigml(S[diff], M, G, m1, m2, L)
+                self._bwmemo.append((key, S, out))
+                return out
+
+        out = self._bwigml(S, M, G, m1, m2, L)
+        self._bwmemo.append((key, S, out))
+
+        return out
+
+
+    def _bwigml(self,
+                S: np.ndarray,
+                M: float,
+                G: float,
+                m1: float,
+                m2: float,
+                L: int) -> np.ndarray:
         MP = (m1 + m2)**2 # scalar
         MM = (m1 - m2)**2 # scalar
         MSQ = M**2        # scalar
         W = np.sqrt(S)    # array
 
-        # Prepare a WGS array
-        # use ak.where 
-        wgs = self.GetWGS(S, MP, MM, MSQ, L, G, W, M)
-        dummy = ak.zeros_like(wgs)
+        # WGS is only defined above the two-body threshold
+        with np.errstate(divide="ignore", invalid="ignore"):
+            wgs = self.GetWGS(S, MP, MM, MSQ, L, G, W, M)
         mask = (W > m1+m2)
-        WGS = ak.where(mask, wgs, dummy)
+        WGS = np.where(mask, wgs, 0.0)
 
-        num = TComplex(MSQ, 0)
-        den = TComplex((MSQ - S), -WGS)
-        
-        out = num/den
+        out = MSQ/((MSQ - S) - 1j*WGS)
 
         return out
 
-    
-    def GetWGS(self, S: ak.Array, MP: float, MM: float, MSQ: float, L: int,
-               G: float, W: ak.Array, M: float):
+
+    def GetWGS(self, S: np.ndarray, MP: float, MM: float, MSQ: float, L: int,
+               G: float, W: np.ndarray, M: float) -> np.ndarray:
 
         QS = np.sqrt(np.abs((S - MP) * (S - MM))) / W
         QM = np.sqrt(np.abs((MSQ - MP) * (MSQ - MM))) / M
@@ -323,13 +595,13 @@ class PolarimetricA1:
 
         return WGS
 
-    
-    def FA1A1P(self, XMSQ: ak.Array) -> TComplex:
+
+    def FA1A1P(self, XMSQ: np.ndarray) -> np.ndarray:
         XM1 = 1.275000
         XG1 = 0.700
         XM2 = 1.461000
         XG2 = 0.250
-        BET = TComplex(0.0, 0.0)
+        BET = complex(0.0, 0.0)
 
         GG1 = XM1*XG1/(1.3281*0.806)
         GG2 = XM2*XG2/(1.3281*0.806)
@@ -339,15 +611,15 @@ class PolarimetricA1:
         GF = self.WGA1(XMSQ) # array
         FG1 = GG1*GF
         FG2 = GG2*GF
-          
-        F1 = TComplex(-XM1SQ)/TComplex(XMSQ - XM1SQ, FG1)
-        F2 = TComplex(-XM2SQ)/TComplex(XMSQ - XM2SQ, FG2)
+
+        F1 = -XM1SQ/((XMSQ - XM1SQ) + 1j*FG1)
+        F2 = -XM2SQ/((XMSQ - XM2SQ) + 1j*FG2)
         FA1A1P = F1 + (BET*F2)
 
         return FA1A1P
 
 
-    def WGA1(self, QQ: ak.Array):
+    def WGA1(self, QQ: np.ndarray) -> np.ndarray:
         # C mass-dependent M*Gamma of a1 through its decays to
         # C.[(rho-pi S-wave) + (rho-pi D-wave) +
         # C.(f2 pi D-wave) + (f0pi S-wave)]
@@ -365,13 +637,13 @@ class PolarimetricA1:
         S = QQ
         WG3PIC = self.WGA1C(S)
         WG3PIN = self.WGA1N(S)
-            
+
         # C Contribution to M*Gamma(m(3pi)^2) from S-wave K*K, if above threshold
         #GKST = 0.0
         mask = S > MK1SQ
-        gskt = np.sqrt((S-MK1SQ)*(S-MK2SQ))/(2.0*S)
-        dummy = ak.zeros_like(gskt)
-        GKST = ak.where(mask, gskt, dummy)
+        with np.errstate(invalid="ignore"):
+            gskt = np.sqrt((S-MK1SQ)*(S-MK2SQ))/(2.0*S)
+        GKST = np.where(mask, gskt, 0.0)
 
         out = C3PI*(WG3PIC+WG3PIN) + (CKST*GKST)
 
@@ -379,36 +651,35 @@ class PolarimetricA1:
 
 
 
-    def WGA1C(self, S: ak.Array):
-        STH = 0.1753 
+    def WGA1C(self, S: np.ndarray) -> np.ndarray:
+        STH = 0.1753
         Q0  = 5.80900
-        Q1  = -3.00980 
-        Q2  = 4.57920 
-        P0  = -13.91400 
-        P1  = 27.67900 
-        P2  = -13.39300 
-        P3  = 3.19240 
+        Q1  = -3.00980
+        Q2  = 4.57920
+        P0  = -13.91400
+        P1  = 27.67900
+        P2  = -13.39300
+        P3  = 3.19240
         P4  = -0.10487
 
         mask1 = S < STH
         mask2 = (S > STH) & (S < 0.823)
 
-        dummy = ak.zeros_like(S)
         ifmask2 = Q0 * ((S - STH)*(S - STH)*(S - STH)) * (1.0 + Q1 * (S - STH) + Q2 * (S - STH)*(S - STH))
         elsemask2 = P0 + P1*S + P2*S*S + P3*S*S*S + P4*S*S*S*S
-        
-        G1_IM = ak.where(
+
+        G1_IM = np.where(
             mask1,
-            dummy,
-            ak.where(
+            0.0,
+            np.where(
                 mask2, ifmask2, elsemask2
             )
         )
 
         return G1_IM
 
-    
-    def WGA1N(self, S: ak.Array):
+
+    def WGA1N(self, S: np.ndarray) -> np.ndarray:
         Q0 = 6.28450
         Q1 = -2.95950
         Q2 = 4.33550
@@ -422,46 +693,34 @@ class PolarimetricA1:
         mask1 = S < STH
         mask2 = (S > STH) & (S < 0.823)
 
-        dummy = ak.zeros_like(S)
         ifmask2 = Q0 * ((S - STH)*(S - STH)*(S - STH)) * (1.0 + Q1 * (S - STH) + Q2 * (S - STH)*(S - STH))
         elsemask2 = P0 + P1*S + P2*S*S + P3*S*S*S + P4*S*S*S*S
-        
-        G1_IM = ak.where(
+
+        G1_IM = np.where(
             mask1,
-            dummy,
-            ak.where(
+            0.0,
+            np.where(
                 mask2, ifmask2, elsemask2
             )
         )
 
         return G1_IM
 
-        
-    def CLVEC(self, H: list, HC: list, N: ak.Array) -> ak.Array:
-        HN  = H[0]*N.energy - H[1]*N.px - H[2]*N.py - H[3]*N.pz        # TComplex
-        HCN = HC[0]*N.energy - HC[1]*N.px - HC[2]*N.py - HC[3]*N.pz    # TComplex
-        HH  = (H[0]*HC[0] - H[1]*HC[1] - H[2]*HC[2] - H[3]*HC[3]).Re() # ak.Array
-
-        PIVEC0 = 2*( 2*(HN*HC[0]).Re() - HH*N.energy )
-        PIVEC1 = 2*( 2*(HN*HC[1]).Re() - HH*N.px     )
-        PIVEC2 = 2*( 2*(HN*HC[2]).Re() - HH*N.py     )
-        PIVEC3 = 2*( 2*(HN*HC[3]).Re() - HH*N.pz     )
-
-        out = ak.zip(
-            {
-                "x": PIVEC1,
-                "y": PIVEC2,
-                "z": PIVEC3,
-                "t": PIVEC0,
-            },
-            with_name="LorentzVector",
-            behavior=coffea.nanoevents.methods.vector.behavior,
-        )
 
-        return out
-     
-    
-    def CLAXI(self, H: list, HC: list, N: ak.Array) -> ak.Array:
+    def CLVEC(self, H: np.ndarray, HC: np.ndarray, N: np.ndarray) -> np.ndarray:
+        """
+        H, HC : (4, n) complex128 hadronic current and its conjugate
+        N     : (4, n) float64 neutrino 4-vector
+        """
+        HN  = lorentz.dot(H, N)          # complex128
+        HH  = np.real(lorentz.dot(H, HC)) # float64
+
+        PIVEC = 2*( 2*np.real(HN*HC) - HH*N )
+
+        return PIVEC
+
+
+    def CLAXI(self, H: np.ndarray, HC: np.ndarray, N: np.ndarray, sign: np.ndarray) -> np.ndarray:
         a1 = HC[1]
         a2 = HC[2]
         a3 = HC[3]
@@ -472,32 +731,31 @@ class PolarimetricA1:
         b3 = H[3]
         b4 = H[0]
 
-        c1 = N.px
-        c2 = N.py
-        c3 = N.pz
-        c4 = N.energy   
-        
-        d34 = (a3*b4 - a4*b3).Im()
-        d24 = (a2*b4 - a4*b2).Im()
-        d23 = (a2*b3 - a3*b2).Im()
-        d14 = (a1*b4 - a4*b1).Im()
-        d13 = (a1*b3 - a3*b1).Im()
-        d12 = (a1*b2 - a2*b1).Im()
-
-        PIAX0 = -self.SIGN*2*(-c1*d23 + c2*d13 - c3*d12)
-        PIAX1 = self.SIGN*2*(c2*d34 - c3*d24 + c4*d23)
-        PIAX2 = self.SIGN*2*(-c1*d34 + c3*d14 - c4*d13)
-        PIAX3 = self.SIGN*2*(c1*d24 - c2*d14 + c4*d12)
-        
-        out = ak.zip(
-            {
-                "x": PIAX1,
-                "y": PIAX2,
-                "z": PIAX3,
-                "t": PIAX0,
-            },
-            with_name="LorentzVector",
-            behavior=coffea.nanoevents.methods.vector.behavior,
-        )
+        c1 = N[1]
+        c2 = N[2]
+        c3 = N[3]
+        c4 = N[0]
 
-        return out
+        d34 = np.imag(a3*b4 - a4*b3)
+        d24 = np.imag(a2*b4 - a4*b2)
+        d23 = np.imag(a2*b3 - a3*b2)
+        d14 = np.imag(a1*b4 - a4*b1)
+        d13 = np.imag(a1*b3 - a3*b1)
+        d12 = np.imag(a1*b2 - a2*b1)
+
+        PIAX0 = -sign*2*(-c1*d23 + c2*d13 - c3*d12)
+        PIAX1 = sign*2*(c2*d34 - c3*d24 + c4*d23)
+        PIAX2 = sign*2*(-c1*d34 + c3*d14 - c4*d13)
+        PIAX3 = sign*2*(c1*d24 - c2*d14 + c4*d12)
+
+        return np.stack([PIAX0, PIAX1, PIAX2, PIAX3])
+
+
+# PRIVATE
+def _couple(BT: tuple, terms: list) -> np.ndarray:
+    # F3PIFactor = sum_k BTk*terms[k], see PolarimetricA1.F3PITerms
+    return sum(bt*term for bt, term in zip(BT, terms) if term is not None)
+
+
+def _polar(rho: float, theta: float) -> complex:
+    return complex(rho*np.cos(theta), rho*np.sin(theta))
@@ -0,0 +1,227 @@
+"""
+Per-event compiled kernel for the tau -> a1 (3pi) polarimetric vector.
+
+Scalar port of PolarimetricA1._pvc for the 2pi0 pi- (IDK = 1) configuration. Every event is
+evaluated in a single pass over the flat (4, n) buffers, so no intermediate (4, n) complex arrays
+are allocated. Functions are compiled with numba when it is available (see httcp.util.maybe_njit).
+"""
+
+from columnflow.util import maybe_import
+
+from httcp.util import maybe_njit
+
+np = maybe_import("numpy")
+
+
+# Breit-Wigner masses and widths used in F3PI
+MRO, GRO = 0.7743, 0.1491
+MRP, GRP = 1.370, 0.386
+MF2, GF2 = 1.275, 0.185
+MF0, GF0 = 1.186, 0.350
+MSG, GSG = 0.860, 0.880
+
+
+@maybe_njit
+def _bwigml(S, M, G, m1, m2, L):
+    MP = (m1 + m2)**2
+    MM = (m1 - m2)**2
+    MSQ = M**2
+    WGS = 0.0
+    if S > 0.0:
+        W = np.sqrt(S)
+        if W > m1 + m2:
+            QS = np.sqrt(np.abs((S - MP) * (S - MM))) / W
+            QM = np.sqrt(np.abs((MSQ - MP) * (MSQ - MM))) / M
+            WGS = G * (MSQ / W) * (QS / QM)**(2 * L + 1)
+    return MSQ/((MSQ - S) - 1j*WGS)
+
+
+@maybe_njit
+def _wga1x(S, STH, Q0, Q1, Q2, P0, P1, P2, P3, P4):
+    if S < STH:
+        return 0.0
+    if S > STH and S < 0.823:
+        return Q0 * ((S - STH)*(S - STH)*(S - STH)) * (1.0 + Q1 * (S - STH) + Q2 * (S - STH)*(S - STH))
+    return P0 + P1*S + P2*S*S + P3*S*S*S + P4*S*S*S*S
+
+
+@maybe_njit
+def _wga1(S):
+    MKST = 0.894
+    MK = 0.496
+    MK1SQ = (MKST+MK)**2
+    MK2SQ = (MKST-MK)**2
+    C3PI = 0.2384*0.2384
+    CKST = 4.7621*4.7621*C3PI
+
+    WG3PIC = _wga1x(S, 0.1753, 5.80900, -3.00980, 4.57920,
+                    -13.91400, 27.67900, -13.39300, 3.19240, -0.10487)
+    WG3PIN = _wga1x(S, 0.1676, 6.28450, -2.95950, 4.33550,
+                    -15.41100, 32.08800, -17.66600, 4.93550, -0.37498)
+
+    GKST = 0.0
+    if S > MK1SQ:
+        GKST = np.sqrt((S-MK1SQ)*(S-MK2SQ))/(2.0*S)
+
+    return C3PI*(WG3PIC+WG3PIN) + (CKST*GKST)
+
+
+@maybe_njit
+def _fa1a1p(XMSQ):
+    XM1 = 1.275000
+    XG1 = 0.700
+    GG1 = XM1*XG1/(1.3281*0.806)
+    XM1SQ = XM1*XM1
+    # the second resonance enters with BET = 0
+    FG1 = GG1*_wga1(XMSQ)
+    return -XM1SQ/((XMSQ - XM1SQ) + 1j*FG1)
+
+
+@maybe_njit
+def _f3pi(IFORM, QQ, SA, SB, bt, M1, M2, M3):
+    M1SQ = M1*M1
+    M2SQ = M2*M2
+    M3SQ = M3*M3
+
+    if IFORM == 1 or IFORM == 2:
+        S1 = SA
+        S2 = SB
+        S3 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
+
+        F134 = -(1 / 3.)  * ((S3 - M3SQ) - (S1 - M1SQ))
+        F150 =  (1 / 18.) * (QQ - M3SQ + S3) * (2*M1SQ + 2*M2SQ - S3) / S3
+        F167 =  (2 / 3.)
+
+        FRO1 = _bwigml(S1, MRO, GRO, M2, M3, 1)
+        FRP1 = _bwigml(S1, MRP, GRP, M2, M3, 1)
+        FRO2 = _bwigml(S2, MRO, GRO, M3, M1, 1)
+        FRP2 = _bwigml(S2, MRP, GRP, M3, M1, 1)
+        FF23 = _bwigml(S3, MF2, GF2, M1, M2, 2)
+        FSG3 = _bwigml(S3, MSG, GSG, M1, M2, 0)
+        FF03 = _bwigml(S3, MF0, GF0, M1, M2, 0)
+
+        return bt[0]*FRO1 \
+             + bt[1]*FRP1 \
+             + bt[2]*F134*FRO2 \
+             + bt[3]*F134*FRP2 \
+             + bt[4]*F150*FF23 \
+             + bt[5]*F167*FSG3 \
+             + bt[6]*F167*FF03
+
+    S3 = SA
+    S1 = SB
+    S2 = QQ - SA - SB + M1SQ + M2SQ + M3SQ
+
+    F34A = (1 / 3.) * ((S2 - M2SQ) - (S3 - M3SQ))
+    F34B = (1 / 3.) * ((S3 - M3SQ) - (S1 - M1SQ))
+    F35 = -(1 / 2.) * ((S1 - M1SQ) - (S2 - M2SQ))
+
+    FRO1 = _bwigml(S1, MRO, GRO, M2, M3, 1)
+    FRP1 = _bwigml(S1, MRP, GRP, M2, M3, 1)
+    FRO2 = _bwigml(S2, MRO, GRO, M3, M1, 1)
+    FRP2 = _bwigml(S2, MRP, GRP, M3, M1, 1)
+    FF23 = _bwigml(S3, MF2, GF2, M1, M2, 2)
+
+    return bt[2]*(F34A*FRO1 + F34B*FRO2) \
+         + bt[3]*(F34A*FRP1 + F34B*FRP2) \
+         + bt[4]*F35*FF23
+
+
+@maybe_njit
+def pvc_a1_kernel(P, q1, q2, q3, sign, coefs, bt, mpi, mpi0):
+    """
+    Inputs:
+        P, q1, q2, q3 : (4, n) float64 tau, ss1, ss2 and os pion 4-vectors, ordered as (E, px, py, pz)
+        sign          : (n,) minus the tau charge
+        coefs         : (3,) COEF1, COEF2, COEF3
+        bt            : (7,) complex128 couplings BT1-BT7, see PolarimetricA1.Couplings
+        mpi, mpi0     : charged and neutral pion masses
+    Output:
+        (4, n) float64 polarimetric vector, ordered as (E, px, py, pz)
+    """
+    n = P.shape[1]
+    out = np.empty((4, n), dtype=np.float64)
+
+    # IDK = 1: 2pi0 pi-
+    M1 = mpi0
+    M2 = mpi0
+    M3 = mpi
+
+    a1 = np.empty(4)
+    Nv = np.empty(4)
+    v23 = np.empty(4)
+    v13 = np.empty(4)
+    v12 = np.empty(4)
+    vec1 = np.empty(4)
+    vec2 = np.empty(4)
+    vec3 = np.empty(4)
+    H = np.empty(4, dtype=np.complex128)
+    HC = np.empty(4, dtype=np.complex128)
+    CLV = np.empty(4)
+    CLA = np.empty(4)
+
+    for i in range(n):
+        for k in range(4):
+            a1[k] = q1[k, i] + q2[k, i] + q3[k, i]
+            Nv[k] = P[k, i] - a1[k]
+            v23[k] = q2[k, i] + q3[k, i]
+            v13[k] = q1[k, i] + q3[k, i]
+            v12[k] = q1[k, i] + q2[k, i]
+
+        s1 = v23[0]*v23[0] - v23[1]*v23[1] - v23[2]*v23[2] - v23[3]*v23[3]
+        s2 = v13[0]*v13[0] - v13[1]*v13[1] - v13[2]*v13[2] - v13[3]*v13[3]
+        s3 = v12[0]*v12[0] - v12[1]*v12[1] - v12[2]*v12[2] - v12[3]*v12[3]
+        QQ = a1[0]*a1[0] - a1[1]*a1[1] - a1[2]*a1[2] - a1[3]*a1[3]
+
+        # b - c - a*(a.(b - c))/a^2, with the 3-vector dot product as in PolarimetricA1._pvc
+        d1 = 0.0
+        d2 = 0.0
+        d3 = 0.0
+        for k in range(1, 4):
+            d1 += a1[k]*(q2[k, i] - q3[k, i])
+            d2 += a1[k]*(q3[k, i] - q1[k, i])
+            d3 += a1[k]*(q1[k, i] - q2[k, i])
+        for k in range(4):
+            vec1[k] = q2[k, i] - q3[k, i] - a1[k]*(d1*(1/QQ))
+            vec2[k] = q3[k, i] - q1[k, i] - a1[k]*(d2*(1/QQ))
+            vec3[k] = q1[k, i] - q2[k, i] - a1[k]*(d3*(1/QQ))
+
+        FORMA1 = _fa1a1p(QQ)
+        F1 = coefs[0]*(_f3pi(1, QQ, s1, s2, bt, M1, M2, M3)*FORMA1)
+        F2 = coefs[1]*(_f3pi(2, QQ, s2, s1, bt, M1, M2, M3)*FORMA1)
+        F3 = coefs[2]*(_f3pi(3, QQ, s3, s1, bt, M1, M2, M3)*FORMA1)
+
+        for k in range(4):
+            H[k] = vec1[k]*F1 + vec2[k]*F2 + vec3[k]*F3
+            HC[k] = np.conj(H[k])
+
+        # CLVEC
+        HN = H[0]*Nv[0] - H[1]*Nv[1] - H[2]*Nv[2] - H[3]*Nv[3]
+        HH = (H[0]*HC[0] - H[1]*HC[1] - H[2]*HC[2] - H[3]*HC[3]).real
+        for k in range(4):
+            CLV[k] = 2*(2*(HN*HC[k]).real - HH*Nv[k])
+
+        # CLAXI
+        d34 = (HC[3]*H[0] - HC[0]*H[3]).imag
+        d24 = (HC[2]*H[0] - HC[0]*H[2]).imag
+        d23 = (HC[2]*H[3] - HC[3]*H[2]).imag
+        d14 = (HC[1]*H[0] - HC[0]*H[1]).imag
+        d13 = (HC[1]*H[3] - HC[3]*H[1]).imag
+        d12 = (HC[1]*H[2] - HC[2]*H[1]).imag
+        c1, c2, c3, c4 = Nv[1], Nv[2], Nv[3], Nv[0]
+        sg = sign[i]
+        CLA[0] = -sg*2*(-c1*d23 + c2*d13 - c3*d12)
+        CLA[1] = sg*2*(c2*d34 - c3*d24 + c4*d23)
+        CLA[2] = sg*2*(-c1*d34 + c3*d14 - c4*d13)
+        CLA[3] = sg*2*(c1*d24 - c2*d14 + c4*d12)
+
+        pclv = P[1, i]*CLV[1] + P[2, i]*CLV[2] + P[3, i]*CLV[3]
+        pcla = P[1, i]*CLA[1] + P[2, i]*CLA[2] + P[3, i]*CLA[3]
+        omega = pclv - pcla
+        m2 = P[0, i]*P[0, i] - P[1, i]*P[1, i] - P[2, i]*P[2, i] - P[3, i]*P[3, i]
+        mass = np.sqrt(m2)
+
+        for k in range(4):
+            out[k, i] = (mass*mass*(CLA[k]-CLV[k]) - P[k, i]*(pcla - pclv))*(1/omega/mass)
+
+    return out
@@ -5,7 +5,10 @@ from columnflow.util import maybe_import
 from columnflow.production import Producer, producer
 #from httcp.production.ReconstructPi0 import reconstructPi0
 
+from httcp import lorentz
 from httcp.util import getGenTauDecayMode
+from httcp.production.PhiCP_Estimator import ZMFCache
+from httcp.production.DecayRecord import DecayRecord
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
@@ -13,6 +16,13 @@ coffea = maybe_import("coffea")
 maybe_import("coffea.nanoevents.methods.nanoaod")
 
 
+# pi0 reconstruction methods of reconstructPi0
+PI0_METHODS = ("simpleIC", "simpleMB")
+
+# simpleMB: nominal pi0 mass and width of the photon pair mass window (+- 2 pi0RecoW)
+pi0RecoM = 0.1349768
+pi0RecoW = 0.05
+
 
 def convert_to_coffea_p4(zipped_item):
     return ak.zip(
@@ -22,15 +32,16 @@ def convert_to_coffea_p4(zipped_item):
     )
 
 def getMaxEtaTauStrip(pt):
+    # works on numpy and awkward arrays
     temp = 0.20 * np.power(pt, -0.66)
-    ref1 = ak.where(temp > 0.15, 0.15, temp)
-    ref2 = ak.where(ref1 > 0.05, ref1, 0.05)
+    ref1 = np.minimum(temp, 0.15)
+    ref2 = np.maximum(ref1, 0.05)
     return ref2
 
 def getMaxPhiTauStrip(pt):
     temp = 0.35 * np.power(pt, -0.71)
-    ref1 = ak.where(temp > 0.30, 0.30, temp)
-    ref2 = ak.where(ref1 > 0.05, ref1, 0.05)
+    ref1 = np.minimum(temp, 0.30)
+    ref2 = np.maximum(ref1, 0.05)
     return ref2
 
 
@@ -42,8 +53,11 @@ def reconstructPi0(hcandp4, photons, method: Optional[str] = "simpleIC"):
     p4_pi0 = None
 
     if method == "simpleIC":
-        photons_px = ak.sum(photons.px, axis=1)
-        photons_py = ak.sum(photons.py, axis=1)
+        # photon px / py sums on flat buffers, see httcp.lorentz
+        photons_p4, offsets = lorentz.from_awkward(photons)
+        photons_evt = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        photons_px = np.bincount(photons_evt, weights=photons_p4[1], minlength=len(offsets) - 1)
+        photons_py = np.bincount(photons_evt, weights=photons_p4[2], minlength=len(offsets) - 1)
         photons_pt = np.sqrt(photons_px ** 2 + photons_py ** 2)
 
         #pt_pi0    = photons[:, 0:1].pt
@@ -62,78 +76,117 @@ def reconstructPi0(hcandp4, photons, method: Optional[str] = "simpleIC"):
         })
         
     elif method == "simpleMB":
-        has_atleast_one_photon = ak.num(photons.pt, axis=1) > 0
-        hcandp4 = ak.where(has_atleast_one_photon, hcandp4, hcandp4[:,:0])
-        photons_p4 = ak.where(has_atleast_one_photon,
-                              photons_p4[:,0:1],
-                              photons_p4[:,:0])
-        
-        deta_photons_hcand = (photons_p4).metric_table(hcandp4, metric = lambda a,b: np.abs(a.eta - b.eta))
-        dphi_photons_hcand = (photons_p4).metric_table(hcandp4, metric = lambda a,b: np.abs(a.delta_phi(b)))
-        
-        maxeta_photons = getMaxEtaTauStrip(photons_p4.pt)
-        maxphi_photons = getMaxPhiTauStrip(photons_p4.pt)
-
-        mask_photons = ((np.abs(deta_photons_hcand) < maxeta_photons)
-                        & (np.abs(dphi_photons_hcand) < maxphi_photons))
-        
-        strip_photons_p4 = convert_to_coffea_p4(
-            {
-                "pt"   : photons_p4.pt[mask_photons],
-                "eta"  : photons_p4.eta[mask_photons],
-                "phi"  : photons_p4.phi[mask_photons],
-                "mass" : photons_p4.mass[mask_photons],
-            }
-        )
-
-        has_one_photon = ak.num(strip_photons_p4.pt, axis=1) == 1
-        
-        strip_photons_p4_pair = ak.combinations(strip_photons_p4, 2, axis=1)
-        strip_photons_p4_pair_0, strip_photons_p4_pair_1 = ak.unzip(strip_photons_p4_pair)
-        strip_photons_mass = (strip_photons_p4_pair_0 + strip_photons_p4_pair_1).mass
-        mass_val = np.abs(strip_photons_mass - pi0RecoM)
-        mass_sorted_idx = ak.argsort(mass_val, axis=1)
-        strip_photons_p4_pair_sorted = strip_photons_p4_pair[mass_sorted_idx]
-        mass_mask = mass_val < 2 * pi0RecoW
-        evt_mask_no_pair = ak.sum(mass_mask, axis=1) == 0
-        strip_photons_p4_pair_sorted_pass_mass = strip_photons_p4_pair_sorted[mass_mask]
-        strip_photons_p4_mass_selected = ak.concatenate([strip_photons_p4_pair_sorted_pass_mass["0"][:,:1],
-                                                         strip_photons_p4_pair_sorted_pass_mass["1"][:,:1]], axis=1)
-
-        sel_strip_photons_p4 = ak.where(has_one_photon,
-                                        strip_photons_p4,
-                                        ak.where(evt_mask_no_pair,
-                                                 strip_photons_p4[:,:1],
-                                                 strip_photons_p4_mass_selected)
-                                    )
-        
-        sel_strip_pizero_p4 = ak.from_regular(ak.sum(sel_strip_photons_p4, axis=-1)[:,None])
+        p4_pi0 = _stripPi0(hcandp4, photons)
 
-        p4_pi0 = sel_strip_pizero_p4
+    else:
+        raise RuntimeError(f"Wrong pi0 method : {method}")
 
 
     return p4_pi0
 
 
-def getpions(decay_gentau: ak.Array) -> ak.Array :
-    ispion_pos = lambda prod: ((prod.pdgId ==  211) | (prod.pdgId ==  321))
-    ispion_neg = lambda prod: ((prod.pdgId == -211) | (prod.pdgId == -321))
-
-    pions_tau  = decay_gentau[(ispion_pos(decay_gentau) | ispion_neg(decay_gentau))]
-
-    has_three_pions = lambda prod : ak.sum((ispion_pos(prod) | ispion_neg(prod)), axis=1) == 3
-    has_two_pos_one_neg_pions = lambda prod : has_three_pions(prod) & (ak.sum(ispion_pos(prod), axis=1) == 2) & (ak.sum(ispion_neg(prod), axis=1) == 1)
-    has_two_neg_one_pos_pions = lambda prod : has_three_pions(prod) & (ak.sum(ispion_pos(prod), axis=1) == 1) & (ak.sum(ispion_neg(prod), axis=1) == 2)
-    get_sorted_pion_indices   = lambda pions: ak.where(has_two_pos_one_neg_pions(pions),
-                                                       ak.argsort(pions.pdgId, ascending=True),
-                                                       ak.where(has_two_neg_one_pos_pions(pions),
-                                                                ak.argsort(pions.pdgId, ascending=False),
-                                                                ak.local_index(pions.pdgId)))
-    
-    pions_tau_sorted_indices = get_sorted_pion_indices(pions_tau)
-    sorted_pions_tau = pions_tau[pions_tau_sorted_indices]
+def _stripPi0(hcandp4: ak.Array, photons: ak.Array) -> ak.Array:
+    """
+    simpleMB pi0 on flat photon buffers (see httcp.lorentz), photons sorted by pt
+      strip   : photons within the pt dependent eta / phi window around the tau,
+                see getMaxEtaTauStrip / getMaxPhiTauStrip
+      pi0     : the strip photon pair with the mass closest to pi0RecoM, within 2 pi0RecoW,
+                else the leading strip photon, no pi0 for the taus without strip photons
+    Output:
+      (events, 0/1) pi0 records as in simpleIC, the mass is the one of the photons
+    """
+    n = len(photons)
+    g, offsets = lorentz.from_awkward(photons, "float64")
+    tau_idx = np.repeat(np.arange(n), np.diff(offsets))
+    flat    = lambda array: ak.to_numpy(ak.flatten(array, axis=1)).astype(np.float64)
+    firsts  = lambda array: ak.to_numpy(ak.fill_none(ak.firsts(array, axis=1), np.nan))
+
+    g_pt    = flat(photons.pt)
+    deta    = np.abs(flat(photons.eta) - firsts(hcandp4.eta)[tau_idx])
+    dphi    = np.abs(lorentz.delta_phi(flat(photons.phi), firsts(hcandp4.phi)[tau_idx]))
+    strip   = (deta < getMaxEtaTauStrip(g_pt)) & (dphi < getMaxPhiTauStrip(g_pt))
+
+    # strip photons, still sorted by pt within every tau
+    g       = g[:, strip]
+    tau_idx = tau_idx[strip]
+    counts  = np.bincount(tau_idx, minlength=n)
+    offsets = lorentz.offsets_from_counts(counts)
+
+    # photon pairs (i < j) of every strip, in the order of ak.combinations
+    local   = np.arange(len(tau_idx)) - offsets[tau_idx]
+    npairs  = counts[tau_idx] - 1 - local
+    first   = np.repeat(np.arange(len(tau_idx)), npairs)
+    start   = np.repeat(lorentz.offsets_from_counts(npairs)[:-1], npairs)
+    second  = first + 1 + (np.arange(len(first)) - start)
+    with np.errstate(invalid="ignore"):
+        dm  = np.abs(lorentz.mass(g[:, first] + g[:, second]) - pi0RecoM)
+
+    # best pair of every strip, the first one in case of equal masses
+    passed  = np.flatnonzero(dm < 2*pi0RecoW)
+    pair_tau = tau_idx[first[passed]]
+    min_dm  = np.full(n, np.inf)
+    np.minimum.at(min_dm, pair_tau, dm[passed])
+    passed  = passed[dm[passed] == min_dm[pair_tau]]
+    best    = np.full(n, len(first))
+    np.minimum.at(best, tau_idx[first[passed]], passed)
+
+    has_pair = best < len(first)
+    single   = (counts > 0) & ~has_pair
+    pi0      = np.zeros((4, n))
+    pi0[:, has_pair] = g[:, first[best[has_pair]]] + g[:, second[best[has_pair]]]
+    pi0[:, single]   = g[:, offsets[:-1][single]]
+
+    has_pi0 = counts > 0
+    pi0     = pi0[:, has_pi0]
+    nums    = has_pi0.astype(np.int64)
+    unflat  = lambda values: ak.unflatten(values, nums)
+    return convert_to_coffea_p4({
+        "pt"    : unflat(lorentz.pt(pi0[1:])),
+        "eta"   : unflat(lorentz.eta(pi0[1:])),
+        "phi"   : unflat(lorentz.phi(pi0[1:])),
+        "mass"  : unflat(np.sqrt(np.maximum(lorentz.mass2(pi0), 0.0))),
+        "pdgId" : unflat(np.full(pi0.shape[1], 111, dtype=np.int64)),
+    })
+
 
-    return sorted_pions_tau
+def getpions(decay_gentau: ak.Array) -> ak.Array :
+    """
+    Charged pions (and kaons) of the taus. Taus with three of them and a total charge
+    of +-1 get the opposite sign one first, then the two same sign ones, in the order
+    of their pdgId (see _pionPermutation), the others keep the order of the products
+    """
+    abspdgid  = np.abs(decay_gentau.pdgId)
+    pions_tau = decay_gentau[(abspdgid == 211) | (abspdgid == 321)]
+
+    counts    = ak.to_numpy(ak.fill_none(ak.num(pions_tau, axis=1), 0))
+    pdgid     = ak.to_numpy(ak.fill_none(ak.flatten(pions_tau.pdgId, axis=1), 0))
+    order     = ak.unflatten(_pionPermutation(pdgid, lorentz.offsets_from_counts(counts)), counts)
+
+    return pions_tau[order]
+
+
+def _pionPermutation(pdgid: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Local indices that sort the pions of every tau, in one pass over the flat pdgId buffer
+    Three pions with two positive ones are sorted by ascending pdgId, with two negative ones
+    by descending pdgId, which puts the opposite sign pion first (ties keep their order,
+    like a stable argsort), the pions of the other taus are not moved
+    """
+    counts = np.diff(offsets)
+    local  = np.arange(len(pdgid)) - np.repeat(offsets[:-1], counts)
+
+    start  = offsets[:-1][counts == 3]
+    pdgid  = pdgid[start[:, None] + np.arange(3)]
+    npos   = np.sum(pdgid > 0, axis=1)
+    sign   = np.where(npos == 2, 1, np.where(npos == 1, -1, 0))
+    key    = sign[:, None]*pdgid
+
+    # rank of every pion in the stable sort of the three keys
+    before = (key[:, None, :] < key[:, :, None]) | ((key[:, None, :] == key[:, :, None])
+                                                    & (np.arange(3)[None, :] < np.arange(3)[:, None]))
+    rank   = np.sum(before, axis=2)
+    local[start[:, None] + rank] = np.arange(3)
+    return local
 
 
 def getphotons(decay_tau: ak.Array) -> ak.Array :
@@ -159,6 +212,8 @@ def getgenpizeros(decay_gentau: ak.Array) -> ak.Array :
         "hcand.pt", "hcand.eta", "hcand.phi", "hcand.mass", "hcand.decayMode",
         "hcandprod.pt", "hcandprod.eta", "hcandprod.phi", "hcandprod.mass","hcandprod.pdgId",
     },
+    # pi0 reconstruction from the photons of the taus, see PI0_METHODS
+    pi0_method="simpleIC",
 )
 def reArrangeDecayProducts(
         self: Producer,
@@ -182,24 +237,29 @@ def reArrangeDecayProducts(
     # hcand1 and its decay products
     p4_hcand1     = ak.with_name(hcand1, "PtEtaPhiMLorentzVector")
     p4_hcand1_pi  = ak.with_name(hcand1prod_pions, "PtEtaPhiMLorentzVector")
-    p4_hcand1_pi0 = reconstructPi0(p4_hcand1, hcand1prod_photons)
+    p4_hcand1_pi0 = reconstructPi0(p4_hcand1, hcand1prod_photons, method=self.pi0_method)
 
     # hcand2 and its decay products
     p4_hcand2     = ak.with_name(hcand2, "PtEtaPhiMLorentzVector")
     p4_hcand2_pi  = ak.with_name(hcand2prod_pions, "PtEtaPhiMLorentzVector")
-    p4_hcand2_pi0 = reconstructPi0(p4_hcand2, hcand2prod_photons)
+    p4_hcand2_pi0 = reconstructPi0(p4_hcand2, hcand2prod_photons, method=self.pi0_method)
 
     hcand1AndProds = ak.concatenate([p4_hcand1, p4_hcand1_pi, p4_hcand1_pi0], axis=1)
     hcand2AndProds = ak.concatenate([p4_hcand2, p4_hcand2_pi, p4_hcand2_pi0], axis=1)
 
     #from IPython import embed; embed()
 
+    # the zmf cache is shared by all the PhiCP methods run on these events,
+    # the PhiCP estimator reads the legs from the fixed-width decay record
     return events, {"p4h1"       : p4_hcand1, 
                     "p4h1pi"     : p4_hcand1_pi, 
                     "p4h1pi0"    : p4_hcand1_pi0, 
                     "p4h2"       : p4_hcand2, 
                     "p4h2pi"     : p4_hcand2_pi, 
-                    "p4h2pi0"    : p4_hcand2_pi0}
+                    "p4h2pi0"    : p4_hcand2_pi0,
+                    "decay"      : DecayRecord.fromLegs([(p4_hcand1, p4_hcand1_pi, p4_hcand1_pi0),
+                                                         (p4_hcand2, p4_hcand2_pi, p4_hcand2_pi0)]),
+                    "zmf"        : ZMFCache()}
 
 @producer(
     uses={
@@ -252,9 +312,14 @@ def reArrangeGenDecayProducts(
 
     #from IPython import embed; embed()
 
+    # the zmf cache is shared by all the PhiCP methods run on these events,
+    # the PhiCP estimator reads the legs from the fixed-width decay record
     return events, {"p4h1"        : p4_hcand1, 
                     "p4h1pi"      : p4_hcand1_pi, 
                     "p4h1pi0"     : p4_hcand1_pi0, 
                     "p4h2"        : p4_hcand2, 
                     "p4h2pi"      : p4_hcand2_pi, 
-                    "p4h2pi0"     : p4_hcand2_pi0}
+                    "p4h2pi0"     : p4_hcand2_pi0,
+                    "decay"       : DecayRecord.fromLegs([(p4_hcand1, p4_hcand1_pi, p4_hcand1_pi0),
+                                                          (p4_hcand2, p4_hcand2_pi, p4_hcand2_pi0)]),
+                    "zmf"         : ZMFCache()}
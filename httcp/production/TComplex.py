@@ -40,6 +40,17 @@ class TComplex:
             self.fRe = re
             self.fIm = im
 
+    @classmethod
+    def from_complex(cls, z):
+        """
+           Wraps a python complex or a numpy complex128 array,
+           e.g. the form factors returned by PolarimetricA1
+        """
+        return cls(np.real(z), np.imag(z))
+
+    def to_complex(self):
+        return self.fRe + 1j * self.fIm
+
     def Re(self):
         return self.fRe
 
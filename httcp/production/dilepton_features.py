@@ -4,6 +4,7 @@ from columnflow.util import maybe_import
 from columnflow.columnar_util import set_ak_column, EMPTY_FLOAT, Route, optional_column as optional
 from columnflow.production.util import attach_coffea_behavior
 from httcp.util import enforce_hcand_type
+from httcp import lorentz
 #from IPython import embed
 ak = maybe_import("awkward")
 np = maybe_import("numpy")
@@ -22,24 +23,14 @@ set_ak_column_f32 = functools.partial(set_ak_column, value_type=np.float32)
 )
 def hcand_mass_(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     print("Producing dilepton mass...")
-    from coffea.nanoevents.methods import vector
     events = self[attach_coffea_behavior](events, **kwargs)
-    lep = []
-    for i in range(2):
-        
-        hcand_lep = events.hcand[:,i]
-        lep.append( ak.zip(
-            {
-                "pt": hcand_lep.pt,
-                "eta": hcand_lep.eta,
-                "phi": hcand_lep.phi,
-                "mass": hcand_lep.mass,
-            },
-            with_name="PtEtaPhiMLorentzVector",
-            behavior=vector.behavior,
-        ))
-    hcand_obj = lep[0] + lep[1]
-    events = set_ak_column_f32(events,f"hcand_obj.mass", ak.where(hcand_obj.mass2 >=0, hcand_obj.mass, EMPTY_FLOAT))
+    # sum of the two legs on flat buffers, see httcp.lorentz
+    p4, offsets = lorentz.from_awkward(events.hcand)
+    lep1, _        = lorentz.nth(p4, offsets, 0)
+    lep2, has_pair = lorentz.nth(p4, offsets, 1)
+    hcand_obj_mass2 = lorentz.mass2(lep1 + lep2)
+    hcand_obj_mass  = np.where(has_pair & (hcand_obj_mass2 >= 0), np.sqrt(np.abs(hcand_obj_mass2)), EMPTY_FLOAT)
+    events = set_ak_column_f32(events,f"hcand_obj.mass", hcand_obj_mass)
     return events
 
 
@@ -96,24 +87,14 @@ def mT(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
 )
 def hcand_mass(self: Producer, events: ak.Array, **kwargs) -> ak.Array:
     print("Producing dilepton mass...")
-    from coffea.nanoevents.methods import vector
     events = self[attach_coffea_behavior](events, **kwargs)
-    lep = []
-    for i in range(2):
-        
-        hcand_lep = events.hcand[:,i]
-        lep.append( ak.zip(
-            {
-                "pt": hcand_lep.pt,
-                "eta": hcand_lep.eta,
-                "phi": hcand_lep.phi,
-                "mass": hcand_lep.mass,
-            },
-            with_name="PtEtaPhiMLorentzVector",
-            behavior=vector.behavior,
-        ))
-    hcand_obj = lep[0] + lep[1]
-    events = set_ak_column_f32(events,f"hcand_obj.mass", ak.where(hcand_obj.mass2 >=0, hcand_obj.mass, EMPTY_FLOAT))
+    # sum of the two legs on flat buffers, see httcp.lorentz
+    p4, offsets = lorentz.from_awkward(events.hcand)
+    lep1, _        = lorentz.nth(p4, offsets, 0)
+    lep2, has_pair = lorentz.nth(p4, offsets, 1)
+    hcand_obj_mass2 = lorentz.mass2(lep1 + lep2)
+    hcand_obj_mass  = np.where(has_pair & (hcand_obj_mass2 >= 0), np.sqrt(np.abs(hcand_obj_mass2)), EMPTY_FLOAT)
+    events = set_ak_column_f32(events,f"hcand_obj.mass", hcand_obj_mass)
     #from IPython import embed; embed()
      
     return events 
@@ -18,8 +18,10 @@ from columnflow.columnar_util import EMPTY_FLOAT, Route, set_ak_column
 from columnflow.columnar_util import optional_column as optional
 
 #from httcp.production.PhiCPNeutralPion import PhiCPNPMethod
+from httcp import lorentz
 from httcp.production.ReArrangeHcandProds import reArrangeDecayProducts, reArrangeGenDecayProducts
 from httcp.production.PhiCP_Producer import ProduceDetPhiCP, ProduceGenPhiCP
+from httcp.production.PhiCP_Producer import DET_PHICP_COLUMNS, GEN_PHICP_COLUMNS, _requestedColumns
 from IPython import embed
 
 
@@ -56,28 +58,47 @@ def hcand_features(
         **kwargs
 ) -> ak.Array:
     events = ak.Array(events, behavior=coffea.nanoevents.methods.nanoaod.behavior)
-    hcand_ = ak.with_name(events.hcand, "PtEtaPhiMLorentzVector")
-    hcand1 = hcand_[:,0:1]
-    hcand2 = hcand_[:,1:2]
-    
-    mass = (hcand1 + hcand2).mass
-    dr = ak.firsts(hcand1.metric_table(hcand2), axis=1)
-    dr = ak.enforce_type(dr, "var * float32")
+    # the pair on flat buffers, one entry per event with two hcand
+    p4, offsets      = lorentz.from_awkward(events.hcand)
+    hcand1, _        = lorentz.nth(p4, offsets, 0)
+    hcand2, has_pair = lorentz.nth(p4, offsets, 1)
+    counts = has_pair.astype(np.int64)
+    first  = offsets[:-1][has_pair]
+    eta    = ak.to_numpy(ak.flatten(events.hcand.eta, axis=1))
+    phi    = ak.to_numpy(ak.flatten(events.hcand.phi, axis=1))
+
+    mass = ak.unflatten(lorentz.mass(hcand1[:, has_pair] + hcand2[:, has_pair]), counts)
+    dr = lorentz.delta_r(eta[first], phi[first], eta[first + 1], phi[first + 1])
+    dr = ak.unflatten(dr.astype(np.float32), counts)
 
     events = set_ak_column(events, "hcand_invm", mass)
     events = set_ak_column(events, "hcand_dr",   dr)
 
-    events, P4_dict     = self[reArrangeDecayProducts](events)
-    events              = self[ProduceDetPhiCP](events, P4_dict)
+    # the decay products are only rearranged for the requested PhiCP columns,
+    # see PhiCP_Producer.DET_PHICP_COLUMNS
+    if self[ProduceDetPhiCP].columns:
+        events, P4_dict     = self[reArrangeDecayProducts](events)
+        events              = self[ProduceDetPhiCP](events, P4_dict)
 
     if "is_signal" in list(self.dataset_inst.aux.keys()):
-        if self.dataset_inst.aux["is_signal"]:
+        if self.dataset_inst.aux["is_signal"] and self[ProduceGenPhiCP].columns:
             events, P4_gen_dict = self[reArrangeGenDecayProducts](events)
             events = self[ProduceGenPhiCP](events, P4_gen_dict)
     
     return events
 
 
+@hcand_features.init
+def hcand_features_init(self: Producer) -> None:
+    # the decay products are not read if no PhiCP column is requested, decided from the
+    # phicp_columns aux as in ProduceDetPhiCP / ProduceGenPhiCP (the dependencies might not be
+    # created yet)
+    for rearrange, columns in [(reArrangeDecayProducts, DET_PHICP_COLUMNS),
+                               (reArrangeGenDecayProducts, GEN_PHICP_COLUMNS)]:
+        if not _requestedColumns(self, columns):
+            self.uses.discard(rearrange)
+
+
 @producer(
     uses={
         #deterministic_seeds,
@@ -10,30 +10,12 @@ from columnflow.selection import Selector, SelectionResult, selector
 from columnflow.util import maybe_import
 from columnflow.columnar_util import set_ak_column
 from IPython import embed
-from httcp.util import trigger_object_matching
+from httcp.selection.trigobj_matching import TrigObjGrid
+from httcp.selection.trigger import trigger_id_bits
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 
-### Function that stores the trigger.id of the objects (e, mu, and tau) ###
-
-def hlt_path_fired(dictionary):
-    if len(dictionary) > 0:# "Empty dictionary, babushcha alert !!! check triggers !!!"
-        max_length = 0
-        for key in dictionary.keys():
-            temp_length = ak.max(ak.num(dictionary[key], axis=1))
-            if temp_length > max_length: max_length = temp_length
-
-        hlt_condition = {}
-        for key in dictionary.keys():
-            hlt_condition[key] = ak.pad_none(dictionary[key], target=max_length)
-            hlt_condition[key] = ak.fill_none(hlt_condition[key],-1)[:,:,None]
-
-        hlt_condition_values = list(hlt_condition.values())
-        hlt_condition_values_concat = ak.concatenate(hlt_condition_values, axis=-1)
-        HLT_path_fired = ak.max(hlt_condition_values_concat, axis=-1)
-        return HLT_path_fired 
-
 @selector(
     uses={
         "Electron.pt", "Electron.eta", "Electron.phi", "Electron.mass",
@@ -44,7 +26,8 @@ def hlt_path_fired(dictionary):
     produces={"single_electron_triggered", "cross_electron_triggered", 
               "single_muon_triggered",     "cross_muon_triggered",
               "cross_tau_triggered", 
-              "matched_triggerID_e", "matched_triggerID_mu", "matched_triggerID_tau"
+              "matched_triggerID_e", "matched_triggerID_mu", "matched_triggerID_tau",
+              "matched_triggers_e", "matched_triggers_mu", "matched_triggers_tau",
           },
     exposed=False
 )
@@ -77,17 +60,35 @@ def match_trigobj(
     matched_triggerID_e   = ak.values_astype(-1 * ak.ones_like(electron_indices), np.int64)
     matched_triggerID_mu  = ak.values_astype(-1 * ak.ones_like(muon_indices), np.int64)
     matched_triggerID_tau = ak.values_astype(-1 * ak.ones_like(tau_indices), np.int64)
-    
-    hlt_path_fired_e   = {}
-    hlt_path_fired_mu  = {}   
-    hlt_path_fired_tau = {}      
+
+    # matched triggers of every lepton, one bit per configured trigger (see trigger_id_bits)
+    trigger_bits = trigger_id_bits(self.config_inst.x.triggers)
+    matched_triggers_e   = ak.values_astype(0 * electron_indices, np.uint64)
+    matched_triggers_mu  = ak.values_astype(0 * muon_indices, np.uint64)
+    matched_triggers_tau = ak.values_astype(0 * tau_indices, np.uint64)
+
+    # triggers with an electron / muon / tau leg
+    has_trigger_e   = False
+    has_trigger_mu  = False
+    has_trigger_tau = False
     if domatch:
+        # trigger objects bucketed once, each lepton collection matched once for all the triggers:
+        # the leg words of the matched trigger objects are OR-ed per lepton, and a leg decision
+        # is a test of the bit of the leg (see TriggerTable)
+        trigobj_grid  = TrigObjGrid(events.TrigObj, threshold=0.5)
+        trigobj_words = ak.to_numpy(ak.flatten(trigger_results.x.trigobj_leg_words, axis=1))
+        muon_legs     = trigobj_grid.match(events.Muon[muon_indices]).bits(trigobj_words)
+        electron_legs = trigobj_grid.match(events.Electron[electron_indices]).bits(trigobj_words)
+        tau_legs      = trigobj_grid.match(events.Tau[tau_indices]).bits(trigobj_words)
+
+        def leg_match(lepton_legs, leg_bit):
+            return (lepton_legs & leg_bit) != 0
+
         # perform each lepton election step separately per trigger
-        for trigger, trigger_fired, leg_masks in trigger_results.x.trigger_data:
-            #print(f"trigger: {trigger}")
-            #print(f"trigger_fired: {trigger_fired}")
-            #print(f"leg_masks:  {leg_masks}")
-            
+        for trigger, trigger_fired, leg_bits in trigger_results.x.trigger_data:
+            # bit of the trigger in the matched_triggers_* words, see trigger_id_bits
+            trigger_bit = trigger_bits[trigger.id]
+
             is_single_el = trigger.has_tag("single_e")
             is_cross_el  = trigger.has_tag("cross_e_tau")
             is_single_mu = trigger.has_tag("single_mu")
@@ -97,56 +98,55 @@ def match_trigobj(
             if is_single_mu or is_cross_mu:
                 mu_matches_leg0 = None
                 # muon selection
-                muons = events.Muon[muon_indices]
                 # start per-muon mask with trigger object matching
                 if is_single_mu:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) == 1
+                    assert trigger.n_legs == len(leg_bits) == 1
                     assert abs(trigger.legs[0].pdg_id) == 13
                     # match leg 0
-                    mu_matches_leg0 = trigger_object_matching(muons, events.TrigObj[leg_masks[0]])
+                    mu_matches_leg0 = leg_match(muon_legs, leg_bits[0])
                     single_muon_triggered = ak.where(trigger_fired & is_single_mu, True, single_muon_triggered)
                 elif is_cross_mu:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) == 2
+                    assert trigger.n_legs == len(leg_bits) == 2
                     assert abs(trigger.legs[0].pdg_id) == 13
                     # match leg 0
-                    mu_matches_leg0 = trigger_object_matching(muons, events.TrigObj[leg_masks[0]])
+                    mu_matches_leg0 = leg_match(muon_legs, leg_bits[0])
                     cross_muon_triggered = ak.where(trigger_fired & is_cross_mu, True, cross_muon_triggered)
-                hlt_path_fired_mu[trigger.hlt_field]= ak.where(mu_matches_leg0, trigger.id,-1)                    
+                matched_triggers_mu = matched_triggers_mu | ak.where(mu_matches_leg0, trigger_bit, np.uint64(0))
+                has_trigger_mu = True
 
             if is_single_el or is_cross_el:
                 el_matches_leg0 = None
                 # electron selection
-                electrons = events.Electron[electron_indices]
                 # start per-muon mask with trigger object matching
                 if is_single_el:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) == 1
+                    assert trigger.n_legs == len(leg_bits) == 1
                     assert abs(trigger.legs[0].pdg_id) == 11
                     # match leg 0
-                    el_matches_leg0 = trigger_object_matching(electrons, events.TrigObj[leg_masks[0]])
+                    el_matches_leg0 = leg_match(electron_legs, leg_bits[0])
                     single_electron_triggered = ak.where(trigger_fired & is_single_el, True, single_electron_triggered)
                 elif is_cross_el:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) == 2
+                    assert trigger.n_legs == len(leg_bits) == 2
                     assert abs(trigger.legs[0].pdg_id) == 11
                     # match leg 0
-                    el_matches_leg0 = trigger_object_matching(electrons, events.TrigObj[leg_masks[0]])
+                    el_matches_leg0 = leg_match(electron_legs, leg_bits[0])
                     cross_electron_triggered = ak.where(trigger_fired & is_cross_el, True, cross_electron_triggered)
                     # sel_electron_indices = ak.local_index(electrons[el_matches_leg0])
-                hlt_path_fired_e[trigger.hlt_field]= ak.where(el_matches_leg0, trigger.id,-1)
+                matched_triggers_e = matched_triggers_e | ak.where(el_matches_leg0, trigger_bit, np.uint64(0))
+                has_trigger_e = True
 
             if is_cross_el or is_cross_mu or is_cross_tau:
                 tau_matches = None
                 # start per-tau mask with trigger object matching per leg
-                taus = events.Tau[tau_indices]
                 if is_cross_el or is_cross_mu:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) == 2
+                    assert trigger.n_legs == len(leg_bits) == 2
                     assert abs(trigger.legs[1].pdg_id) == 15
                     # match leg 1
-                    tau_matches_leg1 = trigger_object_matching(taus, events.TrigObj[leg_masks[1]])
+                    tau_matches_leg1 = leg_match(tau_legs, leg_bits[1])
                     tau_matches = tau_matches_leg1
                     if is_cross_el:
                         cross_electron_triggered = ak.where(trigger_fired & is_cross_el, True, cross_electron_triggered)
@@ -154,53 +154,40 @@ def match_trigobj(
                         cross_muon_triggered = ak.where(trigger_fired & is_cross_mu, True, cross_muon_triggered)
                 elif is_cross_tau:
                     # catch config errors
-                    assert trigger.n_legs == len(leg_masks) >= 2
+                    assert trigger.n_legs == len(leg_bits) >= 2
                     assert abs(trigger.legs[0].pdg_id) == 15
                     assert abs(trigger.legs[1].pdg_id) == 15
                     # match both legs
-                    tau_matches_leg0 = trigger_object_matching(taus, events.TrigObj[leg_masks[0]])
-                    tau_matches_leg1 = trigger_object_matching(taus, events.TrigObj[leg_masks[1]])
+                    tau_matches_leg0 = leg_match(tau_legs, leg_bits[0])
+                    tau_matches_leg1 = leg_match(tau_legs, leg_bits[1])
                     cross_mask = ((tau_matches_leg0 | tau_matches_leg1) 
                                   & ak.any(tau_matches_leg0, axis=1) 
                                   & ak.any(tau_matches_leg1, axis=1))
                     tau_matches = cross_mask
                     cross_tau_triggered = ak.where(trigger_fired & is_cross_tau, True, cross_tau_triggered)
-                hlt_path_fired_tau[trigger.hlt_field]= ak.where(tau_matches, trigger.id,-1)
-
-        
-        
-        
-        
-        triggerID_e   = hlt_path_fired(hlt_path_fired_e  ) if len(hlt_path_fired_e  ) > 0 else ak.values_astype(ak.ones_like(electron_indices), np.int32)
-        triggerID_mu  = hlt_path_fired(hlt_path_fired_mu ) if len(hlt_path_fired_mu ) > 0 else ak.values_astype(ak.ones_like(muon_indices), np.int32)
-        triggerID_tau = hlt_path_fired(hlt_path_fired_tau) if len(hlt_path_fired_tau) > 0 else ak.values_astype(ak.ones_like(tau_indices), np.int32)        
-        
-        # if len(hlt_path_fired_e) > 0 :
-        #     triggerID_e = hlt_path_fired(hlt_path_fired_e)
-        # else :
-        #     triggerID_e = ak.ones_like(electron_indices, np.int32) #matched_triggerID_e
-            
-        # if len(hlt_path_fired_mu) > 0 :
-        #     triggerID_mu = hlt_path_fired(hlt_path_fired_mu)
-        # else :
-        #     triggerID_mu = ak.ones_like(electron_indices, np.int32)
-        
-        # if len(hlt_path_fired_tau) > 0 :
-        #     triggerID_tau = hlt_path_fired(hlt_path_fired_tau)
-        # else :
-        #     triggerID_tau = matched_triggerID_tau
-            
-        mask_triggerID_e = ak.fill_none(triggerID_e > 0, False)
+                matched_triggers_tau = matched_triggers_tau | ak.where(tau_matches, trigger_bit, np.uint64(0))
+                has_trigger_tau = True
+
+        # the largest matched trigger id, all the leptons are kept with id 1 if there is no
+        # trigger for them
+        triggerID_e   = _maxTriggerId(matched_triggers_e, trigger_bits, has_trigger_e)
+        triggerID_mu  = _maxTriggerId(matched_triggers_mu, trigger_bits, has_trigger_mu)
+        triggerID_tau = _maxTriggerId(matched_triggers_tau, trigger_bits, has_trigger_tau)
+
+        mask_triggerID_e = triggerID_e > 0
         matched_idx_e = electron_indices[mask_triggerID_e]
         matched_triggerID_e = triggerID_e[mask_triggerID_e]
-    
-        mask_triggerID_mu = ak.fill_none(triggerID_mu > 0, False)
+        matched_triggers_e = matched_triggers_e[mask_triggerID_e]
+
+        mask_triggerID_mu = triggerID_mu > 0
         matched_idx_mu = muon_indices[mask_triggerID_mu]
         matched_triggerID_mu = triggerID_mu[mask_triggerID_mu]
-        
-        mask_triggerID_tau = ak.fill_none(triggerID_tau > 0, False)
+        matched_triggers_mu = matched_triggers_mu[mask_triggerID_mu]
+
+        mask_triggerID_tau = triggerID_tau > 0
         matched_idx_tau = tau_indices[mask_triggerID_tau]
         matched_triggerID_tau = triggerID_tau[mask_triggerID_tau]
+        matched_triggers_tau = matched_triggers_tau[mask_triggerID_tau]
 
         electron_indices = matched_idx_e
         muon_indices = matched_idx_mu
@@ -215,6 +202,9 @@ def match_trigobj(
     events = set_ak_column(events, "matched_triggerID_e", matched_triggerID_e)
     events = set_ak_column(events, "matched_triggerID_mu", matched_triggerID_mu)
     events = set_ak_column(events, "matched_triggerID_tau", matched_triggerID_tau)
+    events = set_ak_column(events, "matched_triggers_e", matched_triggers_e)
+    events = set_ak_column(events, "matched_triggers_mu", matched_triggers_mu)
+    events = set_ak_column(events, "matched_triggers_tau", matched_triggers_tau)
 
     events = set_ak_column(events, "single_electron_triggered", single_electron_triggered)
     events = set_ak_column(events, "cross_electron_triggered", cross_electron_triggered)
@@ -223,4 +213,18 @@ def match_trigobj(
     events = set_ak_column(events, "cross_tau_triggered", cross_tau_triggered)
                 
     
-    return events, sel_electron_indices, sel_muon_indices, sel_tau_indices 
\ No newline at end of file
+    return events, sel_electron_indices, sel_muon_indices, sel_tau_indices
+
+
+# PRIVATE
+def _maxTriggerId(matched_triggers: ak.Array, trigger_bits: dict, has_trigger: bool) -> ak.Array:
+    # highest set bit of the bitsets, -1 without a matched trigger, 1 if there is no trigger at all
+    if not has_trigger:
+        return ak.values_astype(ak.ones_like(matched_triggers), np.int32)
+    counts = ak.to_numpy(ak.num(matched_triggers, axis=1))
+    words  = ak.to_numpy(ak.flatten(matched_triggers, axis=1))
+    trigger_id = np.full(len(words), -1, dtype=np.int64)
+    # bits in increasing trigger id, the last matched one is the largest
+    for tid, bit in trigger_bits.items():
+        trigger_id[(words & bit) != 0] = tid
+    return ak.unflatten(trigger_id, counts)
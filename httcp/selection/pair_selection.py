@@ -0,0 +1,227 @@
+# coding: utf-8
+
+"""
+Streaming selection of the best lepton pair of every event.
+
+Instead of building the ak.cartesian / ak.combinations of the two lepton lists, evaluating the
+preselection on every pair and ranking the survivors, the (lep1, lep2) pairs of an event are
+enumerated inside a compiled loop: the cuts of the channel are applied on the fly, in their
+order, and only the running best pair by the ranking keys (see httcp.util.get_best_pair) is
+kept. Besides the lepton buffers, the memory is proportional to the number of events.
+
+The pairs are visited in the order of ak.cartesian (ak.combinations if both legs are the same
+collection), so that the earliest pair wins a full tie as with the jagged ranking.
+
+Usage:
+  pair_indices, steps = select_best_pair(events.Electron, events.Tau, lep1_indices, lep2_indices,
+                                         cuts=[("etau_is_os", PAIR_CUT_OS, 0.0), ...],
+                                         sort_keys=ETAU_PAIR_SORT_KEYS,
+                                         met=events.PuppiMET)
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+from httcp.util import maybe_njit
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+# cuts of a pair, the value is the threshold of the cut
+PAIR_CUT_PT   = 0  # pt of both legs > value
+PAIR_CUT_ETA  = 1  # |eta| of both legs < value
+PAIR_CUT_OS   = 2  # opposite charges, value unused
+PAIR_CUT_DR   = 3  # deltaR(lep1, lep2) > value
+PAIR_CUT_MT   = 4  # transverse mass of lep1 and MET < value
+PAIR_CUT_MASS = 5  # invariant mass of the pair > value
+
+# columns of the lepton buffers
+_PT, _ETA, _PHI, _MASS, _CHARGE = 0, 1, 2, 3, 4
+
+
+def select_best_pair(
+        leps1: ak.Array,
+        leps2: ak.Array,
+        lep1_indices: ak.Array,
+        lep2_indices: ak.Array,
+        cuts: list,
+        sort_keys: list,
+        met: ak.Array | None = None,
+) -> tuple[ak.Array, dict]:
+    """
+    Inputs:
+      leps1, leps2 : (events, var) lepton collections of the two legs, e.g. events.Electron, events.Tau
+      lep1_indices : (events, var) indices of the leg 1 candidates, in the order of the pairs
+      lep2_indices : (events, var) indices of the leg 2 candidates, None if leg 2 is taken from
+                     lep1_indices as well (pairs i < j, as ak.combinations)
+      cuts         : ordered list of (step name, PAIR_CUT_*, value)
+      sort_keys    : ordered list of (leg, field, ascending) with leg "0" or "1", see get_best_pair
+      met          : MET record with pt and phi, only read for PAIR_CUT_MT
+    Output:
+      pair_indices : (events, 2) indices of the two leptons of the best pair, [] without pairs
+      steps        : {step name: (events,) at least one pair passes the cuts up to this step}
+    """
+    same_collection = lep2_indices is None
+    if same_collection:
+        leps2, lep2_indices = leps1, lep1_indices
+
+    offsets1 = _offsets(lep1_indices)
+    offsets2 = _offsets(lep2_indices)
+    # positions of the candidates in the flat collections
+    flat1 = _flatIndex(leps1, lep1_indices, offsets1)
+    flat2 = _flatIndex(leps2, lep2_indices, offsets2)
+
+    # lepton-wise ranking keys, the key k of a pair is keys1[i, k] + keys2[j, k]
+    keys1 = np.zeros((offsets1[-1], len(sort_keys)), dtype=np.float64)
+    keys2 = np.zeros((offsets2[-1], len(sort_keys)), dtype=np.float64)
+    for k, (leg, field, ascending) in enumerate(sort_keys):
+        if leg not in ("0", "1"):
+            raise RuntimeError(f"Wrong leg : {leg}")
+        keys, leps, flat = (keys1, leps1, flat1) if leg == "0" else (keys2, leps2, flat2)
+        keys[:, k] = ak.to_numpy(ak.flatten(leps[field], axis=1))[flat]
+        if not ascending:
+            keys[:, k] = -keys[:, k]
+    # a NaN key loses, as in get_best_pair (the comparisons of the kernel would take it as a tie)
+    np.nan_to_num(keys1, copy=False, nan=np.inf)
+    np.nan_to_num(keys2, copy=False, nan=np.inf)
+
+    nevents = len(offsets1) - 1
+    met_buffer = np.zeros((nevents, 2), dtype=np.float64)
+    if any(cut_id == PAIR_CUT_MT for _, cut_id, _ in cuts):
+        met_buffer[:, 0] = ak.to_numpy(met.pt)
+        met_buffer[:, 1] = ak.to_numpy(met.phi)
+
+    best    = np.full((nevents, 2), -1, dtype=np.int64)
+    npassed = np.zeros(nevents, dtype=np.int64)
+    _best_pair_kernel(offsets1, offsets2, _lepBuffer(leps1, flat1), _lepBuffer(leps2, flat2), met_buffer,
+                      keys1, keys2,
+                      np.array([cut_id for _, cut_id, _ in cuts], dtype=np.int64),
+                      np.array([value for _, _, value in cuts], dtype=np.float64),
+                      same_collection, best, npassed)
+
+    has_pair = best[:, 0] >= 0
+    lep1idx = ak.to_numpy(ak.flatten(lep1_indices, axis=1))[best[has_pair, 0]]
+    lep2idx = ak.to_numpy(ak.flatten(lep2_indices, axis=1))[best[has_pair, 1]]
+    pair_indices = ak.unflatten(np.stack([lep1idx, lep2idx], axis=1).ravel(), 2*has_pair)
+
+    steps = {name: npassed > k for k, (name, _, _) in enumerate(cuts)}
+    return pair_indices, steps
+
+
+@maybe_njit
+def _best_pair_kernel(offsets1, offsets2, leg1, leg2, met, keys1, keys2, cut_ids, cut_values,
+                      same_collection, best, npassed):
+    """
+    Inputs:
+      offsets1, offsets2 : (events + 1) offsets of the leg buffers
+      leg1, leg2         : (n, 5) pt, eta, phi, mass, charge of the leptons
+      met                : (events, 2) MET pt and phi
+      keys1, keys2       : (n, keys) ranking keys, smaller is better
+      cut_ids            : (cuts,) PAIR_CUT_* in the order of the steps
+      cut_values         : (cuts,) thresholds
+      same_collection    : pairs i < j of leg1 only
+      best               : (events, 2) output, flat positions of the best pair in the leg buffers, -1
+      npassed            : (events,) output, most consecutive cuts passed by a pair
+    """
+    ncuts = len(cut_ids)
+    nkeys = keys1.shape[1]
+    for ev in range(len(offsets1) - 1):
+        b1 = -1
+        b2 = -1
+        for i in range(offsets1[ev], offsets1[ev + 1]):
+            jstart = i + 1 if same_collection else offsets2[ev]
+            for j in range(jstart, offsets2[ev + 1]):
+                # consecutive cuts passed, evaluated inline (array arguments would be reference
+                # counted at every call of a helper)
+                n = 0
+                while n < ncuts:
+                    cut_id = cut_ids[n]
+                    value  = cut_values[n]
+                    if cut_id == PAIR_CUT_PT:
+                        passed = leg1[i, _PT] > value and leg2[j, _PT] > value
+                    elif cut_id == PAIR_CUT_ETA:
+                        passed = abs(leg1[i, _ETA]) < value and abs(leg2[j, _ETA]) < value
+                    elif cut_id == PAIR_CUT_OS:
+                        passed = leg1[i, _CHARGE]*leg2[j, _CHARGE] < 0
+                    elif cut_id == PAIR_CUT_DR:
+                        deta = leg1[i, _ETA] - leg2[j, _ETA]
+                        dphi = _deltaPhi(leg1[i, _PHI], leg2[j, _PHI])
+                        passed = np.sqrt(deta*deta + dphi*dphi) > value
+                    elif cut_id == PAIR_CUT_MT:
+                        passed = _transverseMass(leg1[i, _PT], leg1[i, _PHI], met[ev, 0], met[ev, 1]) < value
+                    elif cut_id == PAIR_CUT_MASS:
+                        passed = _invariantMass(leg1[i, _PT], leg1[i, _ETA], leg1[i, _PHI], leg1[i, _MASS],
+                                                leg2[j, _PT], leg2[j, _ETA], leg2[j, _PHI], leg2[j, _MASS]) > value
+                    else:
+                        passed = False
+                    if not passed:
+                        break
+                    n += 1
+                if n > npassed[ev]:
+                    npassed[ev] = n
+                if n < ncuts:
+                    continue
+                # lexicographic comparison with the running best pair, the earlier pair wins a tie
+                better = b1 < 0
+                k = 0
+                while not better and k < nkeys:
+                    key  = keys1[i, k] + keys2[j, k]
+                    bkey = keys1[b1, k] + keys2[b2, k]
+                    if key < bkey:
+                        better = True
+                    elif key > bkey:
+                        break
+                    k += 1
+                if better:
+                    b1 = i
+                    b2 = j
+        best[ev, 0] = b1
+        best[ev, 1] = b2
+
+
+# PRIVATE
+@maybe_njit
+def _deltaPhi(phi1, phi2):
+    # same as coffea.nanoevents.methods.vector.delta_phi
+    return (phi1 - phi2 + np.pi) % (2*np.pi) - np.pi
+
+
+@maybe_njit
+def _transverseMass(pt, phi, met_pt, met_phi):
+    # same as httcp.util.transverse_mass
+    return np.sqrt(2*pt*met_pt*(1 - np.cos(_deltaPhi(phi, met_phi))))
+
+
+@maybe_njit
+def _invariantMass(pt1, eta1, phi1, mass1, pt2, eta2, phi2, mass2):
+    # as the coffea LorentzVector sum, NaN for a negative mass squared
+    pz1 = pt1*np.sinh(eta1)
+    pz2 = pt2*np.sinh(eta2)
+    px = pt1*np.cos(phi1) + pt2*np.cos(phi2)
+    py = pt1*np.sin(phi1) + pt2*np.sin(phi2)
+    pz = pz1 + pz2
+    e  = np.sqrt(pt1*pt1 + pz1*pz1 + mass1*mass1) + np.sqrt(pt2*pt2 + pz2*pz2 + mass2*mass2)
+    return np.sqrt(e*e - px*px - py*py - pz*pz)
+
+
+def _offsets(indices: ak.Array) -> np.ndarray:
+    counts  = ak.to_numpy(ak.num(indices, axis=1))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _flatIndex(leps: ak.Array, indices: ak.Array, offsets: np.ndarray) -> np.ndarray:
+    start = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(ak.to_numpy(ak.num(leps.pt, axis=1)), out=start[1:])
+    index = ak.to_numpy(ak.flatten(indices, axis=1)).astype(np.int64)
+    return index + np.repeat(start[:-1], np.diff(offsets))
+
+
+def _lepBuffer(leps: ak.Array, flat: np.ndarray) -> np.ndarray:
+    buffer = np.empty((len(flat), 5), dtype=np.float64)
+    for col, field in ((_PT, "pt"), (_ETA, "eta"), (_PHI, "phi"), (_MASS, "mass"), (_CHARGE, "charge")):
+        buffer[:, col] = ak.to_numpy(ak.flatten(leps[field], axis=1))[flat]
+    return buffer
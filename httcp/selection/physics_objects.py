@@ -14,8 +14,10 @@ from columnflow.columnar_util import EMPTY_FLOAT, Route, set_ak_column
 from columnflow.columnar_util import optional_column as optional
 
 from httcp.util import IF_NANO_V9, IF_NANO_V11
-from httcp.util import getGenTauDecayMode
-from httcp.util import step_flatten
+from httcp.util import classifyGenTauDecays
+from httcp.util import step_flatten, flat_fields, CutFlow
+from httcp.util import plain_array
+from httcp.gentree import GenPartTree
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
@@ -59,78 +61,47 @@ def muon_selection(
     events = set_ak_column(events, "Muon.rawIdx",    ak.local_index(events.Muon))
     events = set_ak_column(events, "Muon.decayMode", -2)
 
-    good_selections = {
-        "muon_pt_26"          : events.Muon.pt > 26,
-        "muon_eta_2p4"        : abs(events.Muon.eta) < 2.4,
-        "mediumID"            : events.Muon.mediumId == 1,
-        "muon_dxy_0p045"      : abs(events.Muon.dxy) < 0.045,
-        "muon_dz_0p2"         : abs(events.Muon.dz) < 0.2,
-        "muon_iso_0p15"       : events.Muon.pfRelIso04_all < 0.15
-    }
-    single_veto_selections = {
-        "muon_pt_10"          : events.Muon.pt > 10,
-        "muon_eta_2p4"        : abs(events.Muon.eta) < 2.4,
-        "mediumID"            : events.Muon.mediumId == 1,
-        "muon_dxy_0p045"      : abs(events.Muon.dxy) < 0.045,
-        "muon_dz_0p2"         : abs(events.Muon.dz) < 0.2,
-        "muon_iso_0p3"        : events.Muon.pfRelIso04_all < 0.3
-    }
-    double_veto_selections = {
-        "muon_pt_15"          : events.Muon.pt > 15,
-        "muon_eta_2p4"        : abs(events.Muon.eta) < 2.4,
-        "muon_isGlobal"       : events.Muon.isGlobal == True,
-        "muon_isPF"           : events.Muon.isPFcand == True,
-        #"muon_isTracker"      : events.Muon.isTracker ==True,
-        "muon_dxy_0p045"      : abs(events.Muon.dxy) < 0.045,
-        "muon_dz_0p2"         : abs(events.Muon.dz) < 0.2,
-        "muon_iso_0p3"        : events.Muon.pfRelIso04_all < 0.3
+    # all the distinct cuts, one bit of the cut word each, evaluated on the flat columns
+    muon = flat_fields(events.Muon, ["pt", "eta", "mediumId", "dxy", "dz",
+                                     "pfRelIso04_all", "isGlobal", "isPFcand"])
+    selections = {
+        "muon_pt_26"          : muon.pt > 26,
+        "muon_pt_10"          : muon.pt > 10,
+        "muon_pt_15"          : muon.pt > 15,
+        "muon_eta_2p4"        : abs(muon.eta) < 2.4,
+        "mediumID"            : muon.mediumId == 1,
+        "muon_isGlobal"       : muon.isGlobal == True,
+        "muon_isPF"           : muon.isPFcand == True,
+        #"muon_isTracker"      : muon.isTracker == True,
+        "muon_dxy_0p045"      : abs(muon.dxy) < 0.045,
+        "muon_dz_0p2"         : abs(muon.dz) < 0.2,
+        "muon_iso_0p15"       : muon.pfRelIso04_all < 0.15,
+        "muon_iso_0p3"        : muon.pfRelIso04_all < 0.3,
     }
+    good_cuts        = ["muon_pt_26", "muon_eta_2p4", "mediumID", "muon_dxy_0p045", "muon_dz_0p2", "muon_iso_0p15"]
+    single_veto_cuts = ["muon_pt_10", "muon_eta_2p4", "mediumID", "muon_dxy_0p045", "muon_dz_0p2", "muon_iso_0p3"]
+    double_veto_cuts = ["muon_pt_15", "muon_eta_2p4", "muon_isGlobal", "muon_isPF", "muon_dxy_0p045", "muon_dz_0p2",
+                        "muon_iso_0p3"]
 
     # pt sorted indices for converting masks to indices
     sorted_indices = ak.argsort(events.Muon.pt, axis=-1, ascending=False)
 
-    muon_mask      = ak.local_index(events.Muon.pt) >= 0   
-    good_muon_mask = muon_mask
-    single_veto_muon_mask = muon_mask
-    double_veto_muon_mask = muon_mask
-    selection_steps = {}
-    #selection_steps_single_veto = {}
-    #selection_steps_double_veto = {}
+    cutflow = CutFlow(ak.to_numpy(ak.num(events.Muon.pt, axis=1)), selections)
 
-    selection_steps = {"Starts with": good_muon_mask}
-    for cut in good_selections.keys():
-        good_muon_mask = good_muon_mask & ak.fill_none(good_selections[cut], False)
-        selection_steps[cut] = good_muon_mask
-    
-    for cut in single_veto_selections.keys():
-        single_veto_muon_mask = single_veto_muon_mask & ak.fill_none(single_veto_selections[cut], False)
-        #selection_steps_single_veto[cut] = single_veto_muon_mask
-    #single_veto_muon_mask = single_veto_muon_mask & ~good_muon_mask
-    selection_steps["mu_single_veto"] = single_veto_muon_mask
-
-    for cut in double_veto_selections.keys():
-        double_veto_muon_mask = double_veto_muon_mask & ak.fill_none(double_veto_selections[cut], False)
-        #selection_steps_double_veto[cut] = double_veto_muon_mask
-    #double_veto_muon_mask = double_veto_muon_mask & ~good_muon_mask
-    selection_steps["mu_double_veto"] = double_veto_muon_mask
-    
+    # cumulative good cuts and veto sets, evaluated from the cut words on access
+    selection_steps = cutflow.steps(CutFlow.cumulative(good_cuts)
+                                    + [("mu_single_veto", single_veto_cuts),
+                                       ("mu_double_veto", double_veto_cuts)])
     
     # muon mask 10<pt<26
     # muon_mask_pt_10_26 = ak.any(good_muon_mask & ak.fill_none(events.Muon.pt > 10, False) & ak.fill_none(events.Muon.pt <26 , False),axis = 1)
     
     # convert to sorted indices
-    good_muon_indices = sorted_indices[good_muon_mask[sorted_indices]]
-    good_muon_indices = ak.values_astype(good_muon_indices, np.int32)
+    good_muon_indices        = cutflow.indices(good_cuts, sorted_indices)
+    veto_muon_indices        = cutflow.indices(single_veto_cuts, sorted_indices)
+    double_veto_muon_indices = cutflow.indices(double_veto_cuts, sorted_indices)
 
-    veto_muon_indices = sorted_indices[single_veto_muon_mask[sorted_indices]]
-    veto_muon_indices = ak.values_astype(veto_muon_indices, np.int32)
 
-    double_veto_muon_indices = sorted_indices[double_veto_muon_mask[sorted_indices]]
-    double_veto_muon_indices = ak.values_astype(double_veto_muon_indices, np.int32)   
-    
-       
-    
-    
     return events, SelectionResult(
         objects={
             "Muon": {
@@ -141,7 +112,7 @@ def muon_selection(
         },
         
         steps = step_flatten(selection_steps),
-        aux = selection_steps,
+        aux = {"muon_cutflow": selection_steps},
         
     ), good_muon_indices, veto_muon_indices, double_veto_muon_indices
 
@@ -184,68 +155,45 @@ def electron_selection(
     events = set_ak_column(events, "Electron.decayMode", -1)
 
     # >= nano v10
-    mva_iso_wp80 = events.Electron.mvaIso_WP80
-    mva_iso_wp90 = events.Electron.mvaIso_WP90
-    mva_noniso_wp90 = events.Electron.mvaNoIso_WP90
-
-    good_selections = {
-        "electron_pt_25"          : events.Electron.pt > 25,
-        "electron_eta_2p1"        : abs(events.Electron.eta) < 2.1,
-        "electron_dxy_0p045"      : abs(events.Electron.dxy) < 0.045,
-        "electron_dz_0p2"         : abs(events.Electron.dz) < 0.2,
-        "electron_mva_iso_wp80"   : mva_iso_wp80 == 1,
-    }
-    single_veto_selections = {
-        "electron_pt_10"          : events.Electron.pt > 10,
-        "electron_eta_2p5"        : abs(events.Electron.eta) < 2.5,
-        "electron_dxy_0p045"      : abs(events.Electron.dxy) < 0.045,
-        "electron_dz_0p2"         : abs(events.Electron.dz) < 0.2,
-        "electron_mva_noniso_wp90": mva_noniso_wp90 == 1,
-        "electron_convVeto"       : events.Electron.convVeto == 1,
-        #"electron_lostHits"       : events.Electron.lostHits <= 1,
-        "electron_pfRelIso03_all" : events.Electron.pfRelIso03_all < 0.3,
-    }
-    double_veto_selections = {
-        "electron_pt_15"          : events.Electron.pt > 15,
-        "electron_eta_2p5"        : abs(events.Electron.eta) < 2.5,
-        "electron_dxy_0p045"      : abs(events.Electron.dxy) < 0.045,
-        "electron_dz_0p2"         : abs(events.Electron.dz) < 0.2,
-        "electron_cutBased"       : events.Electron.cutBased == 1,
-        "electron_pfRelIso03_all" : events.Electron.pfRelIso03_all < 0.3,
+    # all the distinct cuts, one bit of the cut word each, evaluated on the flat columns
+    electron = flat_fields(events.Electron, ["pt", "eta", "dxy", "dz", "mvaIso_WP80", "mvaNoIso_WP90",
+                                             "convVeto", "cutBased", "pfRelIso03_all"])
+    selections = {
+        "electron_pt_25"          : electron.pt > 25,
+        "electron_pt_10"          : electron.pt > 10,
+        "electron_pt_15"          : electron.pt > 15,
+        "electron_eta_2p1"        : abs(electron.eta) < 2.1,
+        "electron_eta_2p5"        : abs(electron.eta) < 2.5,
+        "electron_dxy_0p045"      : abs(electron.dxy) < 0.045,
+        "electron_dz_0p2"         : abs(electron.dz) < 0.2,
+        "electron_mva_iso_wp80"   : electron.mvaIso_WP80 == 1,
+        "electron_mva_noniso_wp90": electron.mvaNoIso_WP90 == 1,
+        "electron_convVeto"       : electron.convVeto == 1,
+        #"electron_lostHits"       : electron.lostHits <= 1,
+        "electron_cutBased"       : electron.cutBased == 1,
+        "electron_pfRelIso03_all" : electron.pfRelIso03_all < 0.3,
     }
+    good_cuts        = ["electron_pt_25", "electron_eta_2p1", "electron_dxy_0p045", "electron_dz_0p2",
+                        "electron_mva_iso_wp80"]
+    single_veto_cuts = ["electron_pt_10", "electron_eta_2p5", "electron_dxy_0p045", "electron_dz_0p2",
+                        "electron_mva_noniso_wp90", "electron_convVeto", "electron_pfRelIso03_all"]
+    double_veto_cuts = ["electron_pt_15", "electron_eta_2p5", "electron_dxy_0p045", "electron_dz_0p2",
+                        "electron_cutBased", "electron_pfRelIso03_all"]
 
     # pt sorted indices for converting masks to indices
     sorted_indices = ak.argsort(events.Electron.pt, axis=-1, ascending=False)    
-    electron_mask  = ak.local_index(events.Electron.pt) >= 0
-    good_electron_mask        = electron_mask
-    single_veto_electron_mask = electron_mask
-    double_veto_electron_mask = electron_mask
-    selection_steps = {}
 
-    selection_steps = {"Starts with": good_electron_mask}
-    for cut in good_selections.keys():
-        good_electron_mask = good_electron_mask & ak.fill_none(good_selections[cut], False)
-        selection_steps[cut] = good_electron_mask
+    cutflow = CutFlow(ak.to_numpy(ak.num(events.Electron.pt, axis=1)), selections)
 
-    for cut in single_veto_selections.keys():
-        single_veto_electron_mask = single_veto_electron_mask & ak.fill_none(single_veto_selections[cut], False)
-    #single_veto_electron_mask = single_veto_electron_mask & ~good_electron_mask
-    selection_steps["e_single_veto"] = single_veto_electron_mask
-    
-    for cut in double_veto_selections.keys():
-        double_veto_electron_mask = double_veto_electron_mask & ak.fill_none(double_veto_selections[cut], False)
-    #double_veto_electron_mask = double_veto_electron_mask & ~good_electron_mask
-    selection_steps["e_double_veto"] = double_veto_electron_mask
+    # cumulative good cuts and veto sets, evaluated from the cut words on access
+    selection_steps = cutflow.steps(CutFlow.cumulative(good_cuts)
+                                    + [("e_single_veto", single_veto_cuts),
+                                       ("e_double_veto", double_veto_cuts)])
     
     # convert to sorted indices
-    good_electron_indices = sorted_indices[good_electron_mask[sorted_indices]]
-    good_electron_indices = ak.values_astype(good_electron_indices, np.int32)
-
-    veto_electron_indices = sorted_indices[single_veto_electron_mask[sorted_indices]]
-    veto_electron_indices = ak.values_astype(veto_electron_indices, np.int32)
-
-    double_veto_electron_indices = sorted_indices[double_veto_electron_mask[sorted_indices]]
-    double_veto_electron_indices = ak.values_astype(double_veto_electron_indices, np.int32)
+    good_electron_indices        = cutflow.indices(good_cuts, sorted_indices)
+    veto_electron_indices        = cutflow.indices(single_veto_cuts, sorted_indices)
+    double_veto_electron_indices = cutflow.indices(double_veto_cuts, sorted_indices)
 
 
     return events, SelectionResult(
@@ -257,7 +205,7 @@ def electron_selection(
             },
         },
         steps=step_flatten(selection_steps),
-        aux=selection_steps,
+        aux={"electron_cutflow": selection_steps},
     ), good_electron_indices, veto_electron_indices, double_veto_electron_indices
 
 
@@ -305,47 +253,38 @@ def tau_selection(
     tau_vs_mu = DotDict(vloose=1, tight=4)
     tau_vs_jet = DotDict(vvloose=2, loose=4, medium=5)
     
-    good_selections = {
-        "tau_pt_20"     : events.Tau.pt > 20,
-        "tau_eta_2p3"   : abs(events.Tau.eta) < 2.3,
-        "tau_dz_0p2"    : abs(events.Tau.dz) < 0.2,
-        "DeepTauVSjet"  : events.Tau.idDeepTau2018v2p5VSjet >= tau_vs_jet.medium,
-        "DeepTauVSe"    : events.Tau.idDeepTau2018v2p5VSe   >= tau_vs_e.vvloose,
-        "DeepTauVSmu"   : events.Tau.idDeepTau2018v2p5VSmu  >= tau_vs_mu.tight,
-        "DecayMode"     : ((events.Tau.decayMode == 0) 
-                           | (events.Tau.decayMode == 1)
-                           | (events.Tau.decayMode == 2)
-                           | (events.Tau.decayMode == 10)
-                           | (events.Tau.decayMode == 11))
-        #"CleanFromEle"  : ak.all(events.Tau.metric_table(events.Electron[electron_indices]) > 0.5, axis=2),
-        #"CleanFromMu"   : ak.all(events.Tau.metric_table(events.Muon[muon_indices]) > 0.5, axis=2),
+    # all the cuts, one bit of the cut word each, evaluated on the flat columns
+    tau = flat_fields(events.Tau, ["pt", "eta", "dz", "idDeepTau2018v2p5VSjet", "idDeepTau2018v2p5VSe",
+                                   "idDeepTau2018v2p5VSmu", "decayMode"])
+    selections = {
+        "tau_pt_20"     : tau.pt > 20,
+        "tau_eta_2p3"   : abs(tau.eta) < 2.3,
+        "tau_dz_0p2"    : abs(tau.dz) < 0.2,
+        "DeepTauVSjet"  : tau.idDeepTau2018v2p5VSjet >= tau_vs_jet.medium,
+        "DeepTauVSe"    : tau.idDeepTau2018v2p5VSe   >= tau_vs_e.vvloose,
+        "DeepTauVSmu"   : tau.idDeepTau2018v2p5VSmu  >= tau_vs_mu.tight,
+        "DecayMode"     : np.isin(tau.decayMode, [0, 1, 2, 10, 11]),
     }
+    if electron_indices is not None:
+        dr_electrons = events.Tau.metric_table(events.Electron[electron_indices])
+        selections["clean_against_electrons"] = ak.all(dr_electrons > 0.2, axis=2)
+    if muon_indices is not None:
+        dr_muons = events.Tau.metric_table(events.Muon[muon_indices])
+        selections["clean_against_muons"] = ak.all(dr_muons > 0.2, axis=2)
+    good_cuts = list(selections)
 
     # pt sorted indices for converting masks to indices
     sorted_indices = ak.argsort(events.Tau.pt, axis=-1, ascending=False)
-    tau_mask  = ak.local_index(events.Tau.pt) >= 0
 
-    good_tau_mask = tau_mask
-    selection_steps = {}
-
-    selection_steps = {"Starts with": good_tau_mask}
-    for cut in good_selections.keys():
-        good_tau_mask = good_tau_mask & ak.fill_none(good_selections[cut], False)
-        selection_steps[cut] = good_tau_mask
-        
-    if electron_indices is not None:
-        good_tau_mask = good_tau_mask & ak.all(events.Tau.metric_table(events.Electron[electron_indices]) > 0.2, axis=2)
-        selection_steps["clean_against_electrons"] = good_tau_mask 
+    cutflow = CutFlow(ak.to_numpy(ak.num(events.Tau.pt, axis=1)), selections)
 
-    if muon_indices is not None:
-        good_tau_mask = good_tau_mask & ak.all(events.Tau.metric_table(events.Muon[muon_indices]) > 0.2, axis=2)
-        selection_steps["clean_against_muons"] = good_tau_mask
+    # cumulative good cuts, evaluated from the cut words on access
+    selection_steps = cutflow.steps(CutFlow.cumulative(good_cuts))
 
     # convert to sorted indices
-    good_tau_indices = sorted_indices[good_tau_mask[sorted_indices]]
-    good_tau_indices = ak.values_astype(good_tau_indices, np.int32)
-    
-    
+    good_tau_indices = cutflow.indices(good_cuts, sorted_indices)
+
+
     return events, SelectionResult(
         objects={
             "Tau": {
@@ -353,7 +292,7 @@ def tau_selection(
             },
         },
         steps = step_flatten(selection_steps),
-        aux=selection_steps,
+        aux={"tau_cutflow": selection_steps},
     ), good_tau_indices
 
 
@@ -466,6 +405,17 @@ def gentau_selection(
     genpart_indices = ak.local_index(events.GenPart.pt)
     events = set_ak_column(events, "GenPart.rawIdx", genpart_indices)
 
+    # decay tree of the chunk, built once for the parents and the decay products below
+    tree = GenPartTree.from_genpart(events.GenPart)
+
+    # mother of the distinct parent, as GenPart[GenPart.distinctParent.genPartIdxMother]:
+    # False if there is no distinct parent, the last particle of the event for a -1 index
+    gen_counts     = np.diff(tree.offsets)
+    has_parent     = tree.distinct_parent >= 0
+    grandmother    = tree.parent[np.where(has_parent, tree.distinct_parent, 0)]
+    grandmother    = np.where(grandmother >= 0, grandmother, np.repeat(tree.offsets[1:] - 1, gen_counts))
+    genpart_status = ak.to_numpy(ak.flatten(events.GenPart.status, axis=1))
+
     # masks to select gen tau+ and tau-    
     good_selections = {
         "genpart_pdgId"           : np.abs(events.GenPart.pdgId) == 15,
@@ -473,8 +423,8 @@ def gentau_selection(
         "genpart_status_flags"    : events.GenPart.hasFlags(["isPrompt", "isFirstCopy"]),
         "genpart_pt_10"           : events.GenPart.pt > 10.0,
         "genpart_eta_2p3"         : np.abs(events.GenPart.eta) < 2.3,
-        "genpart_momid_25"        : events.GenPart[events.GenPart.distinctParent.genPartIdxMother].pdgId == 25,
-        "genpart_mom_status_22"   : events.GenPart[events.GenPart.distinctParent.genPartIdxMother].status == 22,
+        "genpart_momid_25"        : ak.unflatten(has_parent & (tree.pdgid[grandmother] == 25), gen_counts),
+        "genpart_mom_status_22"   : ak.unflatten(has_parent & (genpart_status[grandmother] == 22), gen_counts),
     }
     
     gen_mask  = genpart_indices >= 0
@@ -504,24 +454,15 @@ def gentau_selection(
     gentaus_of_opposite_sign = ak.fill_none(ak.sum(matched_gentaus.pdgId, axis=1) == 0, False)
 
     # Get gentau decay products 
-    # hack: _apply_global_index [todo: https://github.com/columnflow/columnflow/discussions/430]
     # get decay modes for the GenTaus
-    decay_gentau_indices = matched_gentaus.distinctChildrenIdxG
-    decay_gentaus = events.GenPart._apply_global_index(decay_gentau_indices)
-    gentaus_dm = getGenTauDecayMode(decay_gentaus)
-
-    mask_genmatchedtaus_1 = ak.fill_none(ak.firsts((( gentaus_dm[:,:1] == -2)
-                                                    |(gentaus_dm[:,:1] == -1)
-                                                    |(gentaus_dm[:,:1] == 0) 
-                                                    |(gentaus_dm[:,:1] == 1)
-                                                    |(gentaus_dm[:,:1] == 2)
-                                                    |(gentaus_dm[:,:1] == 10)
-                                                    |(gentaus_dm[:,:1] == 11)), axis=1), False) # ele/had
-    mask_genmatchedtaus_2 = ak.fill_none(ak.firsts((( gentaus_dm[:,1:2] == 0) 
-                                                    |(gentaus_dm[:,1:2] == 1)
-                                                    |(gentaus_dm[:,1:2] == 2)
-                                                    |(gentaus_dm[:,1:2] == 10)
-                                                    |(gentaus_dm[:,1:2] == 11)), axis=1), False) # had only
+    decay_gentau_indices = tree.get_children(tree.to_global(matched_gentaus.rawIdx), distinct=True)
+    decay_gentaus = tree.take(events.GenPart, decay_gentau_indices)
+    gentaus_decay = classifyGenTauDecays(decay_gentaus)
+    gentaus_dm    = gentaus_decay.decayMode
+
+    # first leg: ele/mu/had, second leg: had only (GENTAU_ALLOWED_DM)
+    mask_genmatchedtaus_1 = ak.fill_none(ak.firsts(gentaus_decay.allowed[:,:1], axis=1), False)
+    mask_genmatchedtaus_2 = ak.fill_none(ak.firsts(gentaus_decay.allowed[:,1:2], axis=1), False)
 
     mask_genmatchedtaus   = mask_genmatchedtaus_1 & mask_genmatchedtaus_2
     
@@ -540,16 +481,17 @@ def gentau_selection(
     
 
     # creating a proper array to save it as a new column
-    dummy_decay_gentaus = decay_gentaus[:,:0][:,None]
+    # the dummy is one empty list of products, with the same type as decay_1 / decay_2 (no union)
+    dummy_decay_gentaus = ak.flatten(decay_gentaus[:,:0][:,None], axis=3)
     decay_1             = decay_gentaus[:,:1]
     decay_1             = ak.where(ak.num(decay_1, axis=1) > 0, decay_1, dummy_decay_gentaus)
     decay_2             = decay_gentaus[:,1:2]
     decay_2             = ak.where(ak.num(decay_2, axis=1) > 0, decay_2, dummy_decay_gentaus)
     decay_gentaus       = ak.concatenate([decay_1, decay_2], axis=1)
     
-    # WARNING: Not a smart way to convert ak.Array -> List -> ak.Array
-    # Must use ak.enforce_type: NOT WORKING here, but it was good for hcand selection
-    events = set_ak_column(events, "GenTau",           ak.Array(ak.to_list(matched_gentaus)))
+    # plain records (no behavior, int64 / float64 fields) as with ak.Array(ak.to_list(...)),
+    # but converted on the buffers
+    events = set_ak_column(events, "GenTau",           plain_array(matched_gentaus))
     events = set_ak_column(events, "GenTau.decayMode", gentaus_dm)
     events = set_ak_column(events, "GenTau.mass",      ak.ones_like(events.GenTau.mass) * 1.777)
     events = set_ak_column(events, "GenTau.charge",    ak.where(events.GenTau.pdgId > 0,
@@ -557,7 +499,7 @@ def gentau_selection(
                                                                 ak.where(events.GenTau.pdgId < 0, 
                                                                          1, 
                                                                          0)))
-    events = set_ak_column(events, "GenTauProd",       ak.Array(ak.to_list(decay_gentaus)))
+    events = set_ak_column(events, "GenTauProd",       plain_array(decay_gentaus))
 
     #from IPython import embed; embed()
     #1/0
@@ -13,6 +13,77 @@ np = maybe_import("numpy")
 ak = maybe_import("awkward")
 
 
+# one bit per distinct leg in the uint64 leg words of the trigger objects
+MAX_TRIGGER_LEGS = 64
+
+
+def trigger_id_bits(triggers: list) -> dict:
+    """
+    uint64 bit of every configured trigger in the per-lepton matched trigger bitsets
+    (matched_triggers_e/mu/tau), assigned in increasing trigger id: {trigger id: bit}
+    """
+    ids = sorted({trigger.id for trigger in triggers})
+    if len(ids) > 64:
+        raise RuntimeError(f"More than 64 triggers configured: {len(ids)}")
+    return {trigger_id: np.uint64(1) << np.uint64(i) for i, trigger_id in enumerate(ids)}
+
+
+class TriggerTable(object):
+    """
+    Legs of the triggers of a dataset, compiled once. Legs with the same pdg id, pt threshold
+    and trigger bits are evaluated once and share a bit of the per-TrigObj leg words.
+
+    Attributes:
+      legs     : distinct (pdg_id, min_pt, trigger_bits) requirements, leg i is bit i
+      triggers : [(trigger, [uint64 bit of each leg of the trigger])]
+    """
+    def __init__(self, triggers: list):
+        self.legs     = []
+        self.triggers = []
+        leg_index = {}
+        for trigger in triggers:
+            leg_bits = []
+            for leg in trigger.legs:
+                key = (leg.pdg_id, leg.min_pt,
+                       None if leg.trigger_bits is None else tuple(leg.trigger_bits))
+                if key not in leg_index:
+                    if len(self.legs) == MAX_TRIGGER_LEGS:
+                        raise RuntimeError(f"More than {MAX_TRIGGER_LEGS} distinct trigger legs")
+                    leg_index[key] = len(self.legs)
+                    self.legs.append(key)
+                leg_bits.append(np.uint64(1) << np.uint64(leg_index[key]))
+            self.triggers.append((trigger, leg_bits))
+
+    def leg_words(self, trigobj: ak.Array) -> ak.Array:
+        """
+        Inputs:
+          trigobj : events.TrigObj with id, pt and filterBits
+        Output:
+          (events, TrigObj) uint64, bit i set if the object passes the distinct leg i
+        """
+        counts  = ak.to_numpy(ak.num(trigobj.id, axis=1))
+        abs_id  = np.abs(ak.to_numpy(ak.flatten(trigobj.id, axis=1)))
+        pt      = ak.to_numpy(ak.flatten(trigobj.pt, axis=1))
+        filters = ak.to_numpy(ak.flatten(trigobj.filterBits, axis=1))
+
+        words = np.zeros(len(abs_id), dtype=np.uint64)
+        for ileg, (pdg_id, min_pt, trigger_bits) in enumerate(self.legs):
+            leg_mask = np.ones(len(abs_id), dtype=bool)
+            # pdg id selection
+            if pdg_id is not None:
+                leg_mask &= abs_id == pdg_id
+            # pt cut
+            if min_pt is not None:
+                leg_mask &= pt >= min_pt
+            # OR across bits themselves, AND between all decision in the list
+            if trigger_bits is not None:
+                for bits in trigger_bits:
+                    leg_mask &= (filters & bits) > 0
+            words |= leg_mask.astype(np.uint64) << np.uint64(ileg)
+
+        return ak.unflatten(words, counts)
+
+
 @selector(
     uses={
         # nano columns
@@ -37,44 +108,28 @@ def trigger_selection(
     trigger_data = []
     trigger_ids = []
 
-    # index of TrigObj's to repeatedly convert masks to indices
-    index = ak.local_index(events.TrigObj)
-    
-    for trigger in self.config_inst.x.triggers:
-        # skip the trigger if it does not apply to the dataset
-        if not trigger.applies_to_dataset(self.dataset_inst):
-            continue
-        
+    # distinct legs of all the triggers evaluated at once, one bit per leg
+    trigobj_leg_words = self.trigger_table.leg_words(events.TrigObj)
+    # legs with at least one object in the event
+    counts      = ak.to_numpy(ak.num(trigobj_leg_words, axis=1))
+    event_words = np.zeros(len(counts), dtype=np.uint64)
+    np.bitwise_or.at(event_words, np.repeat(np.arange(len(counts)), counts),
+                     ak.to_numpy(ak.flatten(trigobj_leg_words, axis=1)))
+
+    for trigger, leg_bits in self.trigger_table.triggers:
         # get bare decisions
         fired = events.HLT[trigger.hlt_field] == 1
         any_fired = any_fired | fired
 
-        # get trigger objects for fired events per leg
-        leg_masks = []
-        all_legs_match = True
-        for leg in trigger.legs:
-            # start with a True mask
-            leg_mask = abs(events.TrigObj.id) >= 0
-            # pdg id selection
-            if leg.pdg_id is not None:
-                leg_mask = leg_mask & (abs(events.TrigObj.id) == leg.pdg_id)
-            # pt cut
-            if leg.min_pt is not None:
-                leg_mask = leg_mask & (events.TrigObj.pt >= leg.min_pt)
-            # trigger bits match
-            if leg.trigger_bits is not None:
-                # OR across bits themselves, AND between all decision in the list
-                for bits in leg.trigger_bits:
-                    leg_mask = leg_mask & ((events.TrigObj.filterBits & bits) > 0)
-            leg_masks.append(index[leg_mask])
-            # at least one object must match this leg
-            all_legs_match = all_legs_match & ak.any(leg_mask, axis=1)
+        # at least one object must match each leg
+        all_legs = np.bitwise_or.reduce(leg_bits, initial=np.uint64(0))
+        all_legs_match = (event_words & all_legs) == all_legs
 
         # final trigger decision
         fired_and_all_legs_match = fired & all_legs_match
         any_fired_all_legs_match = any_fired_all_legs_match | fired_and_all_legs_match
         # store all intermediate results for subsequent selectors
-        trigger_data.append((trigger, fired_and_all_legs_match, leg_masks))
+        trigger_data.append((trigger, fired_and_all_legs_match, leg_bits))
 
         # store the trigger id
         ids = ak.where(fired_and_all_legs_match, np.float32(trigger.id), np.float32(np.nan))
@@ -90,6 +145,7 @@ def trigger_selection(
         },
         aux={
             "trigger_data": trigger_data,
+            "trigobj_leg_words": trigobj_leg_words,
         },
     )
 
@@ -99,9 +155,14 @@ def trigger_selection_init(self: Selector) -> None:
     if getattr(self, "dataset_inst", None) is None:
         return
 
-    # full used columns
-    self.uses |= {
-        opt(trigger.name)
+    triggers = [
+        trigger
         for trigger in self.config_inst.x.triggers
         if trigger.applies_to_dataset(self.dataset_inst)
-    }
+    ]
+
+    # full used columns
+    self.uses |= {opt(trigger.name) for trigger in triggers}
+
+    # legs of the triggers compiled once
+    self.trigger_table = TriggerTable(triggers)
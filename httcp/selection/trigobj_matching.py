@@ -0,0 +1,161 @@
+# coding: utf-8
+
+"""
+Trigger object matching on an eta-phi grid.
+
+The trigger objects of the chunk are bucketed once into (event, eta, phi) cells of at least
+the matching cone in both directions, phi cells wrapping around at +-pi. The trigger objects
+within dR of an offline object are then among the ones of its 3x3 neighbouring cells, found
+with a binary search in the sorted cell keys, so that the dR is only computed for the close
+pairs instead of the full metric table of every trigger leg. The matched pairs of an offline
+collection are kept as compressed-sparse-row arrays and every trigger leg decision is a
+reduction of a flat mask (or bit word) of the trigger objects over them.
+
+Usage:
+  grid    = TrigObjGrid(events.TrigObj, threshold=0.5)
+  matches = grid.match(events.Muon[muon_indices])
+  matches.any(grid.flat_mask(leg_masks[0]))  # same as trigger_object_matching(muons, events.TrigObj[leg_masks[0]])
+"""
+
+from __future__ import annotations
+
+from columnflow.util import maybe_import
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.vector")
+
+
+class TrigObjGrid(object):
+    """
+    Attributes:
+      threshold : dR of the matching
+      offsets   : (events + 1) offsets of the TrigObj lists
+      eta, phi  : flat TrigObj coordinates
+      order     : TrigObj indices sorted by cell
+      keys      : sorted cell keys of the TrigObj
+    """
+    def __init__(self, trigobj: ak.Array, threshold: float = 0.5):
+        self.threshold = threshold
+
+        counts = ak.to_numpy(ak.num(trigobj.eta, axis=1))
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.eta = ak.to_numpy(ak.flatten(trigobj.eta, axis=1))
+        self.phi = ak.to_numpy(ak.flatten(trigobj.phi, axis=1))
+
+        # cells at least as large as the cone, an integer number of them in phi
+        self.nphi = max(int(np.floor(2*np.pi/threshold)), 1)
+        self.eta_min = int(np.floor(self.eta.min()/threshold)) - 1 if len(self.eta) else 0
+        eta_max = int(np.floor(self.eta.max()/threshold)) + 1 if len(self.eta) else 0
+        self.neta = eta_max - self.eta_min + 1
+
+        event = np.repeat(np.arange(len(counts)), counts)
+        keys = self._keys(event, self._etaCell(self.eta), self._phiCell(self.phi))
+        self.order = np.argsort(keys, kind="stable")
+        self.keys  = keys[self.order]
+
+    def __len__(self) -> int:
+        return len(self.eta)
+
+    def flat_mask(self, trigobj_sel: ak.Array) -> np.ndarray:
+        """
+        Flat TrigObj mask of a (events, var) index list (as the leg masks of trigger_selection)
+        or of a (events, var) boolean mask
+        """
+        flat = ak.to_numpy(ak.flatten(trigobj_sel, axis=1))
+        if flat.dtype == bool:
+            return flat
+        counts = ak.to_numpy(ak.num(trigobj_sel, axis=1))
+        index  = flat + np.repeat(self.offsets[:-1], counts)
+        mask   = np.zeros(len(self), dtype=bool)
+        mask[index] = True
+        return mask
+
+    def match(self, vectors: ak.Array) -> "TrigObjMatches":
+        """
+        Inputs:
+          vectors : (events, var) offline objects with eta and phi
+        Output:
+          TrigObjMatches, all the (object, TrigObj) pairs with dR < threshold
+        """
+        counts = ak.to_numpy(ak.num(vectors.eta, axis=1))
+        eta = ak.to_numpy(ak.flatten(vectors.eta, axis=1))
+        phi = ak.to_numpy(ak.flatten(vectors.phi, axis=1))
+        event = np.repeat(np.arange(len(counts)), counts)
+
+        # clipped to the eta range, padded by one empty row of cells on both sides: objects outside
+        # have no trigger object around, and the keys of the rows beyond the padding (the padding
+        # rows of the previous / next event) are empty as well
+        eta_cell = np.clip(self._etaCell(eta), self.eta_min, self.eta_min + self.neta - 1)
+        phi_cell = self._phiCell(phi)
+        # the 3x3 neighbouring cells: the three phi cells of a row are consecutive keys, searched
+        # as one range, plus the cell on the other side of +-pi for the first / last phi cell
+        objs, starts, stops = [], [], []
+        def add_range(sel, eta_row, phi_first, phi_last):
+            objs.append(sel)
+            starts.append(np.searchsorted(self.keys, self._keys(event[sel], eta_row, phi_first), side="left"))
+            stops.append(np.searchsorted(self.keys, self._keys(event[sel], eta_row, phi_last), side="right"))
+        all_objs = np.arange(len(eta))
+        first = np.flatnonzero(phi_cell == 0)
+        last  = np.flatnonzero(phi_cell == self.nphi - 1)
+        for deta in (-1, 0, 1):
+            row = eta_cell + deta
+            add_range(all_objs, row, np.maximum(phi_cell - 1, 0), np.minimum(phi_cell + 1, self.nphi - 1))
+            if self.nphi >= 3:
+                add_range(first, row[first], self.nphi - 1, self.nphi - 1)
+                add_range(last, row[last], 0, 0)
+        objs, starts, stops = np.concatenate(objs), np.concatenate(starts), np.concatenate(stops)
+
+        # candidate pairs of all the cells at once
+        ncand = stops - starts
+        inner = np.arange(ncand.sum()) - np.repeat(np.cumsum(ncand) - ncand, ncand)
+        obj   = np.repeat(objs, ncand)
+        trig  = self.order[np.repeat(starts, ncand) + inner]
+
+        # same dR as the coffea metric table
+        dr   = coffea.nanoevents.methods.vector.delta_r(eta[obj], phi[obj], self.eta[trig], self.phi[trig])
+        keep = dr < self.threshold
+        obj, trig = obj[keep], trig[keep]
+        sort = np.lexsort((trig, obj))
+        return TrigObjMatches(counts, obj[sort], trig[sort])
+
+    # PRIVATE
+    def _etaCell(self, eta: np.ndarray) -> np.ndarray:
+        return np.floor(eta/self.threshold).astype(np.int64)
+
+    def _phiCell(self, phi: np.ndarray) -> np.ndarray:
+        width = 2*np.pi/self.nphi
+        return np.floor((phi + np.pi)/width).astype(np.int64) % self.nphi
+
+    def _keys(self, event: np.ndarray, eta_cell: np.ndarray, phi_cell: np.ndarray) -> np.ndarray:
+        return (event*self.neta + (eta_cell - self.eta_min))*self.nphi + phi_cell
+
+
+class TrigObjMatches(object):
+    """
+    Attributes:
+      counts : (events,) offline objects per event
+      obj    : flat index of the offline object of every matched pair, sorted
+      trig   : flat TrigObj index of every matched pair
+    """
+    def __init__(self, counts: np.ndarray, obj: np.ndarray, trig: np.ndarray):
+        self.counts = counts
+        self.obj    = obj
+        self.trig   = trig
+
+    def any(self, trigobj_mask: np.ndarray) -> ak.Array:
+        """
+        (events, var) True for the offline objects matched to at least one TrigObj of the flat mask
+        """
+        nobj = np.bincount(self.obj[trigobj_mask[self.trig]], minlength=self.counts.sum())
+        return ak.unflatten(nobj > 0, self.counts)
+
+    def bits(self, trigobj_bits: np.ndarray) -> ak.Array:
+        """
+        (events, var) bitwise OR of a flat TrigObj bit word (e.g. filterBits) over the matched TrigObj
+        """
+        out = np.zeros(self.counts.sum(), dtype=trigobj_bits.dtype)
+        np.bitwise_or.at(out, self.obj, trigobj_bits[self.trig])
+        return ak.unflatten(out, self.counts)
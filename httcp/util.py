@@ -10,15 +10,30 @@ from __future__ import annotations
 import law
 import order as od
 from typing import Any
-from columnflow.util import maybe_import
+from collections import OrderedDict
+from collections.abc import Mapping
+from columnflow.util import maybe_import, MockModule, DotDict
 from columnflow.columnar_util import ArrayFunction, deferred_column
 
 np = maybe_import("numpy")
 ak = maybe_import("awkward")
 coffea = maybe_import("coffea")
+nb = maybe_import("numba")
 maybe_import("coffea.nanoevents.methods.nanoaod")
 
 
+# numba is optional, compiled kernels are only used when it is available
+HAS_NUMBA = not isinstance(nb, MockModule)
+
+
+def maybe_njit(func):
+    """
+    Compiles *func* with numba in nopython mode if numba is available, and returns it unchanged
+    otherwise. Callers should check *HAS_NUMBA* before choosing a kernel over a vectorized path.
+    """
+    return nb.njit(cache=True, error_model="numpy")(func) if HAS_NUMBA else func
+
+
 @deferred_column
 def IF_NANO_V9(self, func: ArrayFunction) -> Any | set[Any]:
     return self.get() if func.config_inst.campaign.x.version == 9 else None
@@ -71,32 +86,125 @@ def get_dataset_lfns(
     return paths
 
 
+# gen tau decay modes accepted for the first leg (e / mu / tau_h) and the second leg (tau_h only)
+GENTAU_ALLOWED_DM = ((-2, -1, 0, 1, 2, 10, 11),
+                     (0, 1, 2, 10, 11))
+
+
 def getGenTauDecayMode(prod: ak.Array):
-    pids = prod.pdgId
+    """
+    (events, taus) decay modes of the (events, taus, products) gen tau decay products, see classifyGenTauDecays
+    """
+    return classifyGenTauDecays(prod).decayMode
+
+
+def classifyGenTauDecays(prod: ak.Array, allowed: tuple = GENTAU_ALLOWED_DM) -> ak.Array:
+    """
+    Inputs:
+      prod    : (events, taus, products) gen tau decay products, only the pdgId is read
+      allowed : decay modes accepted for the tau at each position of the event
+    Output:
+      (events, taus) records:
+        decayMode : -1 (e), -2 (mu), 5*(nProngs - 1) + nNeutrals for the hadronic decays
+        nProngs   : charged pions / kaons
+        nNeutrals : pi0 / K0 / K0L / K0S
+        allowed   : the decayMode is in allowed for the position of the tau, False after the last one
+    Steps:
+      - the products of all the taus are counted in a single pass over the flat pdgId buffer
+    """
+    pdgid  = ak.fill_none(prod.pdgId, [], axis=1)
+    ntaus  = ak.to_numpy(ak.num(pdgid, axis=1))
+    nprods = ak.to_numpy(ak.flatten(ak.num(pdgid, axis=2), axis=1))
+    offsets = np.zeros(len(nprods) + 1, dtype=np.int64)
+    np.cumsum(nprods, out=offsets[1:])
+    flat_pdgid = ak.to_numpy(ak.flatten(pdgid, axis=None)).astype(np.int64)
+
+    dm       = np.empty(len(nprods), dtype=np.int64)
+    nprongs  = np.empty(len(nprods), dtype=np.int64)
+    nneutral = np.empty(len(nprods), dtype=np.int64)
+    _gen_tau_decay_kernel(offsets, flat_pdgid, dm, nprongs, nneutral)
 
-    is_ele  = np.abs(pids) == 11
-    is_muon = np.abs(pids) == 13
-    is_charged = ((np.abs(pids) == 211) | (np.abs(pids) == 321))
-    is_neutral = ((pids == 111) | (pids == 311) | (pids == 130) | (pids == 310))
+    position = np.arange(len(dm)) - np.repeat(np.cumsum(ntaus) - ntaus, ntaus)
+    is_allowed = np.zeros(len(dm), dtype=bool)
+    for ileg, modes in enumerate(allowed):
+        leg = position == ileg
+        is_allowed[leg] = np.isin(dm[leg], modes)
 
-    edecay = ak.sum(is_ele,  axis=-1) > 0
-    mdecay = ak.sum(is_muon, axis=-1) > 0
-    hdecay = (ak.sum(is_charged, axis=-1) > 0) | (ak.sum(is_neutral, axis=-1) >= 0)
+    return ak.zip({"decayMode" : ak.unflatten(dm, ntaus),
+                   "nProngs"   : ak.unflatten(nprongs, ntaus),
+                   "nNeutrals" : ak.unflatten(nneutral, ntaus),
+                   "allowed"   : ak.unflatten(is_allowed, ntaus)})
 
-    Nc = ak.sum(is_charged, axis=-1)
-    Np = ak.sum(is_neutral, axis=-1)
 
-    dm = ak.where(edecay, 
-                  -1, 
-                  ak.where(mdecay, 
-                           -2, 
-                           ak.where(hdecay, 
-                                    (5 * (Nc - 1) + Np),
-                                    -9)
-                       )
-              )
+@maybe_njit
+def _gen_tau_decay_kernel(offsets, pdgid, dm, nprongs, nneutral):
+    # e / mu take precedence over the hadrons, the K0 / pi0 ids are not signed
+    for i in range(len(dm)):
+        nele = 0
+        nmu  = 0
+        nc   = 0
+        nn   = 0
+        for j in range(offsets[i], offsets[i + 1]):
+            pid  = pdgid[j]
+            apid = abs(pid)
+            if apid == 11:
+                nele += 1
+            elif apid == 13:
+                nmu += 1
+            elif apid == 211 or apid == 321:
+                nc += 1
+            elif pid == 111 or pid == 311 or pid == 130 or pid == 310:
+                nn += 1
+        nprongs[i]  = nc
+        nneutral[i] = nn
+        if nele > 0:
+            dm[i] = -1
+        elif nmu > 0:
+            dm[i] = -2
+        else:
+            dm[i] = 5*(nc - 1) + nn
 
-    return dm
+
+def get_best_pair(
+        pairs: ak.Array,
+        pair_indices: ak.Array,
+        sort_keys: list,
+) -> ak.Array:
+    """
+    Lexicographic ranking of the lepton pairs of every event (AN Section 7.6)
+
+    Inputs:
+      pairs        : (events, pairs) lepton pairs, fields "0" and "1"
+      pair_indices : (events, pairs) indices of the leptons of the pairs, fields "0" and "1"
+      sort_keys    : ordered list of (leg, field, ascending), e.g. ("0", "pfRelIso03_all", True),
+                     the next key only decides between pairs with equal values of the previous ones
+    Output:
+      (events, 2) indices of the two leptons of the best pair, [] for events without pairs
+
+    The best pair is found with one lexicographic argmin over the flat pairs of the chunk: for
+    every key in turn only the pairs equal to the minimum of their event are kept, and the
+    earliest pair of the event wins if all the keys are equal (as a stable sort would do).
+    """
+    counts = ak.to_numpy(ak.num(pair_indices, axis=1))
+    event  = np.repeat(np.arange(len(counts)), counts)
+    cand   = np.arange(len(event))
+
+    for leg, field, ascending in sort_keys:
+        # the candidates stay grouped by event, every event with pairs keeps at least one
+        starts = np.flatnonzero(np.diff(event[cand], prepend=-1))
+        if len(starts) == len(cand):
+            break
+        values = ak.to_numpy(ak.flatten(pairs[leg][field], axis=1))[cand]
+        if not ascending:
+            values = -values
+        minval = np.repeat(np.fmin.reduceat(values, starts), np.diff(starts, append=len(cand)))
+        keep   = (values == minval) | np.isnan(minval)
+        cand   = cand[keep]
+
+    best = cand[np.flatnonzero(np.diff(event[cand], prepend=-1))]
+    lep1idx = ak.to_numpy(ak.flatten(pair_indices["0"], axis=1))[best]
+    lep2idx = ak.to_numpy(ak.flatten(pair_indices["1"], axis=1))[best]
+    return ak.unflatten(np.stack([lep1idx, lep2idx], axis=1).ravel(), 2*(counts > 0))
 
 
 def enforce_hcand_type(hcand_pair_concat, field_type_dict):
@@ -106,6 +214,158 @@ def enforce_hcand_type(hcand_pair_concat, field_type_dict):
     hcand_array = ak.zip(temp)
     return hcand_array
 
+def plain_array(array: ak.Array) -> ak.Array:
+    """
+    Same array and type as ak.Array(ak.to_list(array)), without the python objects: records lose
+    their names and behaviors, integers become int64 and floats float64 (the only copies), option
+    types are kept where there is a None, lists become var. Unlike the python round trip, empty
+    lists keep the type of their content instead of becoming unknown.
+    """
+    return ak.Array(_plain_layout(array.layout))
+
+
+def _plain_layout(layout):
+    contents = ak.contents
+    if layout.is_numpy:
+        if layout.data.ndim > 1:
+            return _plain_layout(layout.to_RegularArray())
+        kind = layout.data.dtype.kind
+        dtype = {"b": np.bool_, "i": np.int64, "u": np.int64, "f": np.float64}.get(kind, layout.data.dtype)
+        return contents.NumpyArray(layout.data.astype(dtype, copy=False))
+    if layout.is_unknown:
+        return layout
+    if layout.is_option:
+        is_none = ak.to_numpy(layout.mask_as_bool(valid_when=False))
+        content = _plain_layout(layout.project())
+        if not is_none.any():
+            return content
+        index = np.where(is_none, -1, np.cumsum(~is_none) - 1)
+        return contents.IndexedOptionArray(ak.index.Index64(index), content)
+    if layout.is_indexed:
+        return _plain_layout(layout.project())
+    if layout.is_list:
+        if layout.parameter("__array__") in ("string", "bytestring"):
+            return layout
+        layout = layout.to_ListOffsetArray64(True)
+        return contents.ListOffsetArray(layout.offsets, _plain_layout(layout.content))
+    if layout.is_record:
+        return contents.RecordArray([_plain_layout(content) for content in layout.contents],
+                                    None if layout.is_tuple else layout.fields,
+                                    length=layout.length)
+    return layout
+
+
+def flat_fields(collection: ak.Array, fields: list) -> DotDict:
+    """
+    Flat numpy arrays of the *fields* of a (events, var) collection, e.g. to evaluate the cuts of an
+    object selection in a single flat pass
+    """
+    return DotDict((field, ak.to_numpy(ak.flatten(collection[field], axis=1))) for field in fields)
+
+
+class CutFlow(object):
+    """
+    Bit-packed cuts of the objects of a collection: one uint32 word per object, bit i set if the
+    object passes cuts[i], so that the objects passing any set of cuts are found with a single mask
+    test on the words.
+
+    Attributes:
+      cuts   : names of the cuts, in the order of the bits
+      counts : (events,) objects per event
+      word   : (objects,) flat uint32 cut words
+    """
+    MAX_CUTS = 32
+
+    def __init__(self, counts: np.ndarray, selections: dict):
+        """
+        Inputs:
+          counts     : (events,) objects per event
+          selections : {cut name: (objects,) flat mask}, (events, var) jagged masks are flattened,
+                       None fails the cut
+        """
+        if len(selections) > self.MAX_CUTS:
+            raise RuntimeError(f"Too many cuts for a uint32 cut word : {len(selections)}")
+        self.cuts   = list(selections)
+        self.counts = np.asarray(counts)
+        self.word   = np.zeros(self.counts.sum(), dtype=np.uint32)
+        for bit, mask in enumerate(selections.values()):
+            if isinstance(mask, ak.Array):
+                mask = ak.to_numpy(ak.flatten(ak.fill_none(mask, False), axis=1))
+            self.word |= np.asarray(mask, dtype=np.uint32) << np.uint32(bit)
+
+    def bits(self, cuts: list) -> np.uint32:
+        bits = np.uint32(0)
+        for cut in cuts:
+            bits |= np.uint32(1) << np.uint32(self.cuts.index(cut))
+        return bits
+
+    def passes(self, cuts: list) -> ak.Array:
+        """
+        (events, var) objects passing all the *cuts*
+        """
+        bits = self.bits(cuts)
+        return ak.unflatten((self.word & bits) == bits, self.counts)
+
+    def indices(self, cuts: list, sorted_indices: ak.Array) -> ak.Array:
+        """
+        (events, var) int32 indices of the objects passing all the *cuts*, in the order of the
+        (events, var) *sorted_indices* (e.g. pt sorted, any subset of the objects), same as
+        sorted_indices[mask[sorted_indices]]
+        """
+        bits   = self.bits(cuts)
+        # event of every entry of sorted_indices, start of every event in the words
+        event  = np.repeat(np.arange(len(self.counts)), ak.to_numpy(ak.num(sorted_indices, axis=1)))
+        start  = np.cumsum(self.counts) - self.counts
+        local  = ak.to_numpy(ak.flatten(sorted_indices, axis=1))
+        passed = (self.word[local + start[event]] & bits) == bits
+        return ak.unflatten(local[passed].astype(np.int32),
+                            np.bincount(event[passed], minlength=len(self.counts)))
+
+    def steps(self, steps: list) -> "CutFlowSteps":
+        """
+        Inputs:
+          steps : ordered list of (step name, cuts of the step)
+        """
+        return CutFlowSteps(self, steps)
+
+    @staticmethod
+    def cumulative(cuts: list, start: str = "Starts with") -> list:
+        """
+        Steps of the cumulative *cuts*, after a *start* step with all the objects
+        """
+        return [(start, [])] + [(cut, cuts[:i + 1]) for i, cut in enumerate(cuts)]
+
+
+class CutFlowSteps(Mapping):
+    """
+    Cut-flow steps of a CutFlow, {step name: (events, var) objects passing all the cuts of the
+    step}. The masks are only evaluated on access from the cut words, see also step_flatten.
+    """
+    def __init__(self, cutflow: CutFlow, steps: list):
+        self.cutflow = cutflow
+        self.bits    = OrderedDict((name, cutflow.bits(cuts)) for name, cuts in steps)
+
+    def __getitem__(self, name: str) -> ak.Array:
+        bits = self.bits[name]
+        return ak.unflatten((self.cutflow.word & bits) == bits, self.cutflow.counts)
+
+    def __iter__(self):
+        return iter(self.bits)
+
+    def __len__(self) -> int:
+        return len(self.bits)
+
+    def flatten(self) -> dict:
+        """
+        {step name: (events,) at least one object passes the step}
+        """
+        counts = self.cutflow.counts
+        event  = np.repeat(np.arange(len(counts)), counts)
+        word   = self.cutflow.word
+        return {name: ak.Array(np.bincount(event[(word & bits) == bits], minlength=len(counts)) > 0)
+                for name, bits in self.bits.items()}
+
+
 def step_extraction(
         *selection_steps: dict,
         suffix_keys_list: list
@@ -139,6 +399,9 @@ def step_flatten(
         """
         The function return a dictionary of flatten mask to propagate the steps in the exposed selector.
         """
+        if isinstance(selection_steps, CutFlowSteps):
+            return selection_steps.flatten()
+
         selection_steps_flatten = {}
         
         for cut in selection_steps.keys():
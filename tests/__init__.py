@@ -15,4 +15,8 @@ sys.path.append(base)
 import httcp  # noqa
 
 # import all tests
-# ...
+from .test_util import *
+from .test_polarimetric_a1 import *
+from .test_production import *
+from .test_pair_selection import *
+from .test_trigobj_matching import *
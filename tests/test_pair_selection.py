@@ -0,0 +1,158 @@
+# coding: utf-8
+
+__all__ = ["PairSelectionTest"]
+
+import math
+import unittest
+
+from columnflow.util import maybe_import
+
+from httcp.util import get_best_pair, transverse_mass
+from httcp.selection.pair_selection import (
+    select_best_pair, PAIR_CUT_PT, PAIR_CUT_ETA, PAIR_CUT_OS, PAIR_CUT_DR, PAIR_CUT_MT, PAIR_CUT_MASS,
+)
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.nanoaod")
+
+
+# coarse values, so that the pairs tie on the first keys and some on all of them
+SORT_KEYS = [
+    ("0", "iso", True),
+    ("1", "score", False),
+    ("0", "pt", False),
+    ("1", "pt", False),
+]
+
+CUTS = [
+    ("pt", PAIR_CUT_PT, 25.0),
+    ("eta", PAIR_CUT_ETA, 2.1),
+    ("os", PAIR_CUT_OS, 0.0),
+    ("dr", PAIR_CUT_DR, 0.5),
+    ("mt", PAIR_CUT_MT, 70.0),
+    ("mass", PAIR_CUT_MASS, 20.0),
+]
+
+
+class PairSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_events = 2000
+        self.leps1 = _leptons(rng, rng.integers(0, 5, n_events))
+        self.leps2 = _leptons(rng, rng.integers(0, 5, n_events))
+        self.met = ak.zip({"pt": rng.uniform(0, 60, n_events), "phi": rng.uniform(-np.pi, np.pi, n_events)},
+                          with_name="MissingET", behavior=coffea.nanoevents.methods.nanoaod.behavior)
+        # candidates as in the channel selections: a subset of the leptons, in a different order
+        self.lep1_indices = _candidates(rng, self.leps1)
+        self.lep2_indices = _candidates(rng, self.leps2)
+
+    def test_get_best_pair(self):
+        for idx2 in (self.lep2_indices, None):
+            pairs, pair_indices = _pairs(self.leps1, self.leps2, self.lep1_indices, idx2)
+            best = get_best_pair(pairs, pair_indices, SORT_KEYS)
+            passed = ak.ones_like(pair_indices["0"], dtype=bool)
+            self.assertEqual(best.to_list(), _bruteForceBest(pairs, pair_indices, passed))
+
+    def test_select_best_pair(self):
+        # the same collection path (lep2_indices None) is the one of tautau
+        for idx2 in (self.lep2_indices, None):
+            leps2 = self.leps2 if idx2 is not None else self.leps1
+            best, steps = select_best_pair(self.leps1, leps2, self.lep1_indices, idx2, CUTS, SORT_KEYS,
+                                           met=self.met)
+            pairs, pair_indices = _pairs(self.leps1, self.leps2, self.lep1_indices, idx2)
+
+            # steps: at least one pair passes the cuts up to the step
+            passed = ak.ones_like(pair_indices["0"], dtype=bool)
+            self.assertEqual(list(steps), [name for name, _, _ in CUTS])
+            for (name, _, _), mask in zip(CUTS, _pairMasks(pairs, self.met)):
+                passed = passed & mask
+                np.testing.assert_array_equal(np.asarray(steps[name]), ak.to_numpy(ak.any(passed, axis=1)))
+            self.assertTrue(0 < ak.sum(passed) < ak.sum(ak.num(passed, axis=1)))
+
+            self.assertEqual(best.to_list(), _bruteForceBest(pairs, pair_indices, passed))
+
+    def test_nan_key(self):
+        # an earlier pair with a NaN key loses against a finite one, whatever the next keys
+        leps1 = _leptons(np.random.default_rng(1), np.array([2]))
+        leps1 = ak.with_field(leps1, [[np.nan, 0.05]], "iso")
+        leps1 = ak.with_field(leps1, [[100.0, 30.0]], "pt")
+        leps2 = _leptons(np.random.default_rng(2), np.array([1]))
+        idx1, idx2 = ak.local_index(leps1.pt), ak.local_index(leps2.pt)
+
+        best, _ = select_best_pair(leps1, leps2, idx1, idx2, [], SORT_KEYS)
+        self.assertEqual(best.to_list(), [[1, 0]])
+
+        pair_indices = ak.cartesian({"0": idx1, "1": idx2}, axis=1)
+        pairs = ak.zip({"0": leps1[pair_indices["0"]], "1": leps2[pair_indices["1"]]})
+        self.assertEqual(get_best_pair(pairs, pair_indices, SORT_KEYS).to_list(), [[1, 0]])
+
+
+# PRIVATE
+def _leptons(rng, counts: np.ndarray) -> ak.Array:
+    n = counts.sum()
+    iso = rng.choice([0.0, 0.05, 0.1, np.nan], n, p=[0.4, 0.3, 0.2, 0.1])
+    fields = {
+        "pt": rng.choice([20.0, 30.0, 45.0], n),
+        "eta": rng.uniform(-2.5, 2.5, n),
+        "phi": rng.uniform(-np.pi, np.pi, n),
+        "mass": rng.choice([0.0, 0.106, 1.777], n),
+        "charge": rng.choice([-1, 1], n),
+        "iso": iso,
+        "score": rng.choice([0.5, 0.9], n),
+    }
+    return ak.zip({field: ak.unflatten(values, counts) for field, values in fields.items()},
+                  with_name="PtEtaPhiMCandidate", behavior=coffea.nanoevents.methods.nanoaod.behavior)
+
+
+def _candidates(rng, leps: ak.Array) -> ak.Array:
+    index = ak.local_index(leps.pt)
+    index = index[ak.unflatten(rng.random(ak.sum(ak.num(index))) < 0.9, ak.num(index))]
+    return index[ak.argsort(leps.pt[index], ascending=False)]
+
+
+def _pairs(leps1: ak.Array, leps2: ak.Array, idx1: ak.Array, idx2: ak.Array) -> tuple:
+    # pairs in the order of ak.cartesian, pairs i < j of leps1 if idx2 is None
+    if idx2 is None:
+        leps2 = leps1
+        pair_indices = ak.combinations(idx1, 2, axis=1, fields=["0", "1"])
+    else:
+        pair_indices = ak.cartesian({"0": idx1, "1": idx2}, axis=1)
+    pairs = ak.zip({"0": leps1[pair_indices["0"]], "1": leps2[pair_indices["1"]]})
+    return pairs, pair_indices
+
+
+def _pairMasks(pairs: ak.Array, met: ak.Array) -> list:
+    # per-pair masks of CUTS, evaluated with the coffea behaviors
+    lep1, lep2 = pairs["0"], pairs["1"]
+    return [
+        (lep1.pt > 25.0) & (lep2.pt > 25.0),
+        (abs(lep1.eta) < 2.1) & (abs(lep2.eta) < 2.1),
+        lep1.charge * lep2.charge < 0,
+        lep1.delta_r(lep2) > 0.5,
+        transverse_mass(lep1, met) < 70.0,
+        (lep1 + lep2).mass > 20.0,
+    ]
+
+
+def _bruteForceBest(pairs: ak.Array, pair_indices: ak.Array, passed: ak.Array) -> list:
+    # python min over the key tuples of the passing pairs, a NaN key loses, the earliest pair wins ties
+    best = []
+    for event_pairs, event_indices, event_passed in zip(pairs.to_list(), pair_indices.to_list(), passed.to_list()):
+        candidates = []
+        for position, (pair, ok) in enumerate(zip(event_pairs, event_passed)):
+            if not ok:
+                continue
+            keys = []
+            for leg, field, ascending in SORT_KEYS:
+                value = pair[leg][field] if ascending else -pair[leg][field]
+                keys.append(math.inf if math.isnan(value) else value)
+            candidates.append((tuple(keys), position))
+        if not candidates:
+            best.append([])
+            continue
+        position = min(candidates)[1]
+        best.append([event_indices[position]["0"], event_indices[position]["1"]])
+    return best
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+__all__ = ["PolarimetricA1Test"]
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from columnflow.util import maybe_import
+
+from httcp.production import PolarimetricA1 as pa1
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+
+
+class PolarimetricA1Test(unittest.TestCase):
+
+    def setUp(self):
+        # a fresh table, built in a temporary cache directory
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        env = mock.patch.dict(os.environ, {"HTTCP_A1_TABLE_DIR": tmp_dir.name})
+        env.start()
+        self.addCleanup(env.stop)
+        cache = mock.patch.dict(pa1._A1_TABLES, clear=True)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+        empty = ak.Array(np.zeros(0))
+        self.a1 = pa1.PolarimetricA1(empty, empty, empty, empty, empty)
+        self.a1.useLineshapeTable = True
+
+        # dense grid, not aligned with the cells of the table
+        q0, q1 = pa1.A1_TABLE_QQ_RANGE
+        self.QQ = np.linspace(q0, q1, 400001)[:-1]
+
+    def test_table_max_rel_error(self):
+        table = self.a1.LineshapeA1(self.QQ)
+        exact = self.a1.FA1A1P(self.QQ)
+        relerr = np.abs(table - exact) / np.abs(exact)
+        self.assertFalse(np.any(np.isnan(relerr)))
+        self.assertLessEqual(relerr.max(), pa1.A1_TABLE_MAX_REL_ERROR)
+
+    def test_table_exact_fallback(self):
+        q0, h, F, slope, exact_cells = self.a1.LineshapeTable()
+        self.assertTrue(np.any(exact_cells))
+
+        QQ = np.concatenate([self.QQ, pa1.A1_TABLE_EXACT_QQ])
+        table = self.a1.TabulatedFA1A1P(QQ)
+        exact = self.a1.FA1A1P(QQ)
+
+        # the flagged cells are evaluated with the exact formula
+        cell = np.minimum(((QQ - q0) / h).astype(np.int64), len(slope) - 1)
+        flagged = exact_cells[cell]
+        np.testing.assert_array_equal(table[flagged], exact[flagged])
+
+        # and so is every value where the interpolation misses the bound
+        interp = F[cell] + slope[cell] * (QQ - (q0 + h * cell))
+        fails = np.abs(interp - exact) / np.abs(exact) > pa1.A1_TABLE_MAX_REL_ERROR
+        self.assertTrue(np.any(fails & ~flagged))
+        np.testing.assert_array_equal(table[fails], exact[fails])
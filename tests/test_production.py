@@ -0,0 +1,72 @@
+# coding: utf-8
+
+__all__ = ["HcandFeaturesTest"]
+
+import unittest
+
+from columnflow.util import maybe_import
+
+from httcp.production.main import hcand_features
+from httcp.production.PhiCP_Producer import DET_PHICP_COLUMNS, GEN_PHICP_COLUMNS
+from httcp.production.ReArrangeHcandProds import reArrangeDecayProducts, reArrangeGenDecayProducts
+
+od = maybe_import("order")
+
+
+class HcandFeaturesTest(unittest.TestCase):
+
+    def assertRearranged(self, producer, det: bool, gen: bool):
+        self.assertEqual(reArrangeDecayProducts in producer.uses, det)
+        self.assertEqual(reArrangeDecayProducts in producer.deps, det)
+        self.assertEqual(reArrangeGenDecayProducts in producer.uses, gen)
+        self.assertEqual(reArrangeGenDecayProducts in producer.deps, gen)
+        self.assertEqual(any(str(column).startswith("hcandprod.") for column in producer.used_columns), det)
+
+    def test_all_phicp_columns(self):
+        # no phicp_columns aux: all the columns, as before
+        producer = _hcandFeatures()
+        self.assertRearranged(producer, det=True, gen=True)
+        self.assertTrue(_produced(producer) >= set(DET_PHICP_COLUMNS) | set(GEN_PHICP_COLUMNS))
+
+    def test_config_phicp_columns(self):
+        producer = _hcandFeatures(config_columns=("PhiCP_PVPV*",))
+        self.assertRearranged(producer, det=True, gen=False)
+        produced = _produced(producer)
+        self.assertTrue({"PhiCP_PVPV", "PhiCP_PVPV_a1model_up", "PhiCP_PVPV_a1model_down"} <= produced)
+        self.assertFalse(produced & ({"PhiCP_DPDP"} | set(GEN_PHICP_COLUMNS)))
+
+    def test_no_phicp_columns(self):
+        # the dataset aux takes precedence over the config
+        producer = _hcandFeatures(config_columns=("PhiCP*",), dataset_columns=())
+        self.assertRearranged(producer, det=False, gen=False)
+        self.assertFalse(_produced(producer) & (set(DET_PHICP_COLUMNS) | set(GEN_PHICP_COLUMNS)))
+        self.assertTrue({"hcand_invm", "hcand_dr"} <= _produced(producer))
+
+    def test_data(self):
+        # the generator level producers are mc_only
+        producer = _hcandFeatures(is_mc=False)
+        self.assertIn(reArrangeDecayProducts, producer.deps)
+        self.assertNotIn(reArrangeGenDecayProducts, producer.deps)
+        self.assertFalse(_produced(producer) & set(GEN_PHICP_COLUMNS))
+
+
+# PRIVATE
+def _hcandFeatures(config_columns=None, dataset_columns=None, is_mc=True):
+    analysis_inst = od.Analysis("test_analysis", 1)
+    campaign_inst = od.Campaign("test_campaign", 1)
+    config_inst = od.Config(name="test_config", id=1, campaign=campaign_inst)
+    if config_columns is not None:
+        config_inst.x.phicp_columns = config_columns
+    aux = {"is_signal": True}
+    if dataset_columns is not None:
+        aux["phicp_columns"] = dataset_columns
+    dataset_inst = od.Dataset(name="test_dataset", id=1, is_data=not is_mc, aux=aux)
+    return hcand_features(inst_dict={
+        "analysis_inst": analysis_inst,
+        "config_inst": config_inst,
+        "dataset_inst": dataset_inst,
+    })
+
+
+def _produced(producer) -> set:
+    return {str(column) for column in producer.produced_columns}
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+__all__ = ["TrigObjMatchingTest"]
+
+import unittest
+
+from columnflow.util import maybe_import
+
+from httcp.util import trigger_object_matching
+from httcp.selection.trigobj_matching import TrigObjGrid
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.vector")
+
+
+class TrigObjMatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n_events = 1000
+        self.trigobj = _vectors(rng, rng.integers(0, 8, n_events))
+        self.leptons = _vectors(rng, rng.integers(0, 4, n_events))
+        # leg selections of the trigger objects, as index lists and as masks
+        self.leg_indices = ak.local_index(self.trigobj.pt)[self.trigobj.pt > 20]
+        self.leg_mask = self.trigobj.pt > 35
+
+    def test_any(self):
+        for threshold in (0.3, 0.5, 2.5, 4.0):
+            grid = TrigObjGrid(self.trigobj, threshold=threshold)
+            matches = grid.match(self.leptons)
+            for leg in (self.leg_indices, self.leg_mask):
+                ref = trigger_object_matching(self.leptons, self.trigobj[leg], threshold=threshold)
+                self.assertEqual(matches.any(grid.flat_mask(leg)).to_list(), ref.to_list())
+
+    def test_phi_wrap(self):
+        # pairs on both sides of +-pi only match through the wrap of the phi cells
+        trigobj = _vectors(np.random.default_rng(1), np.array([1, 1]))
+        trigobj = ak.with_field(trigobj, [[np.pi - 0.05], [-np.pi + 0.05]], "phi")
+        leptons = ak.with_field(trigobj, [[-np.pi + 0.1], [np.pi - 0.1]], "phi")
+        grid = TrigObjGrid(trigobj, threshold=0.5)
+        all_trigobj = np.ones(len(grid), dtype=bool)
+        self.assertEqual(grid.match(leptons).any(all_trigobj).to_list(), [[True], [True]])
+        self.assertEqual(trigger_object_matching(leptons, trigobj).to_list(), [[True], [True]])
+
+    def test_bits(self):
+        # the OR of the matched bit words has the bits of the legs matched by any()
+        grid = TrigObjGrid(self.trigobj, threshold=0.5)
+        matches = grid.match(self.leptons)
+        masks = [grid.flat_mask(self.leg_indices), grid.flat_mask(self.leg_mask)]
+        words = sum(mask.astype(np.uint64) << np.uint64(bit) for bit, mask in enumerate(masks))
+        bits = matches.bits(words)
+        for bit, mask in enumerate(masks):
+            self.assertEqual(((bits & np.uint64(1 << bit)) != 0).to_list(), matches.any(mask).to_list())
+
+
+# PRIVATE
+def _vectors(rng, counts: np.ndarray) -> ak.Array:
+    n = counts.sum()
+    fields = {
+        "pt": rng.uniform(10, 60, n),
+        "eta": rng.uniform(-2.5, 2.5, n),
+        # a fraction of the objects close to +-pi
+        "phi": np.where(rng.random(n) < 0.2, np.pi * rng.choice([-1, 1], n) * rng.uniform(0.9, 1, n),
+                        rng.uniform(-np.pi, np.pi, n)),
+        "mass": np.zeros(n),
+    }
+    return ak.zip({field: ak.unflatten(values, counts) for field, values in fields.items()},
+                  with_name="PtEtaPhiMLorentzVector", behavior=coffea.nanoevents.methods.vector.behavior)
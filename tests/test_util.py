@@ -0,0 +1,116 @@
+# coding: utf-8
+
+__all__ = ["UtilTest"]
+
+import unittest
+
+from columnflow.util import maybe_import
+
+from httcp.util import plain_array, CutFlow
+
+np = maybe_import("numpy")
+ak = maybe_import("awkward")
+coffea = maybe_import("coffea")
+maybe_import("coffea.nanoevents.methods.vector")
+
+
+class UtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.genpart = _genpart(np.random.default_rng(0), 500)
+
+    def assertPlain(self, array):
+        # plain_array is a drop-in replacement of the python list round trip
+        ref = ak.Array(_to_list(array))
+        out = plain_array(array)
+        self.assertEqual(str(out.type), str(ref.type))
+        self.assertEqual(_to_list(out), _to_list(ref))
+
+    def test_plain_array_records(self):
+        self.assertPlain(self.genpart)
+        self.assertPlain(self.genpart[ak.argsort(self.genpart.pt, ascending=False)])
+
+    def test_plain_array_options(self):
+        gp = self.genpart
+        self.assertPlain(ak.mask(gp, np.arange(len(gp)) % 3 != 0))
+        self.assertPlain(ak.mask(gp, gp.pt > 20))
+
+        # GenTau matching in gentau_selection
+        nearest = gp[:, :2].nearest(_genpart(np.random.default_rng(2), len(gp)), threshold=0.5)
+        self.assertTrue(ak.any(ak.is_none(nearest, axis=1)))
+        self.assertPlain(nearest)
+        is_none = ak.any(ak.is_none(nearest, axis=1), axis=1)
+        self.assertPlain(ak.where(is_none, gp[:, :0], nearest))
+
+    def test_plain_array_gentauprod(self):
+        # (events, taus, products) with the dummy padding of the GenTauProd column
+        rng = np.random.default_rng(1)
+        gp = self.genpart
+        ntaus = rng.integers(0, 3, len(gp))
+        nprods = rng.integers(1, 4, ntaus.sum())
+        index = ak.unflatten(ak.unflatten(rng.integers(0, 1000, nprods.sum()), nprods), ntaus)
+        flat_gp = ak.flatten(gp, axis=1)
+        prods = ak.unflatten(ak.unflatten(flat_gp[ak.to_numpy(ak.flatten(index, axis=None)) % len(flat_gp)],
+                                          ak.flatten(ak.num(index, axis=2))), ak.num(index, axis=1))
+
+        dummy = ak.flatten(prods[:, :0][:, None], axis=3)
+        decay_1 = ak.where(ak.num(prods[:, :1], axis=1) > 0, prods[:, :1], dummy)
+        decay_2 = ak.where(ak.num(prods[:, 1:2], axis=1) > 0, prods[:, 1:2], dummy)
+        gentauprod = ak.concatenate([decay_1, decay_2], axis=1)
+        self.assertTrue(ak.all(ak.num(gentauprod, axis=1) == 2))
+        self.assertPlain(gentauprod)
+
+    def test_cutflow_indices(self):
+        rng = np.random.default_rng(3)
+        pt = self.genpart.pt
+        cutflow = CutFlow(ak.to_numpy(ak.num(pt, axis=1)), {"pt": pt > 10, "eta": abs(self.genpart.eta) < 2.5})
+        mask = (pt > 10) & (abs(self.genpart.eta) < 2.5)
+
+        # a permutation of all the objects, and a subset of them
+        sorted_indices = ak.argsort(pt, ascending=False)
+        subset = sorted_indices[ak.unflatten(rng.random(ak.sum(ak.num(pt))) < 0.5, ak.num(pt))]
+        for indices in (sorted_indices, subset):
+            self.assertEqual(cutflow.indices(["pt", "eta"], indices).to_list(), indices[mask[indices]].to_list())
+
+        steps = cutflow.steps(CutFlow.cumulative(["pt", "eta"]))
+        self.assertEqual(steps.flatten()["eta"].to_list(), ak.any(mask, axis=1).to_list())
+
+
+# PRIVATE
+def _to_list(array: ak.Array) -> list:
+    # to_list with byte-masked options only, to_packed of an IndexedOptionArray with a None fails
+    # with awkward 2.6 and numpy >= 2.3
+    return ak.Array(_byteMasked(array.layout)).to_list()
+
+
+def _byteMasked(layout):
+    if layout.is_option:
+        layout = layout.to_ByteMaskedArray(True)
+        return ak.contents.ByteMaskedArray(layout.mask, _byteMasked(layout.content), valid_when=True)
+    if layout.is_indexed:
+        return _byteMasked(layout.project())
+    if layout.is_list:
+        layout = layout.to_ListOffsetArray64(True)
+        return ak.contents.ListOffsetArray(layout.offsets, _byteMasked(layout.content))
+    if layout.is_record:
+        return ak.contents.RecordArray([_byteMasked(content) for content in layout.contents],
+                                       None if layout.is_tuple else layout.fields, length=layout.length)
+    return layout
+
+
+def _genpart(rng, n_events: int) -> ak.Array:
+    # GenPart-like records with the NanoAOD dtypes
+    counts = rng.integers(0, 6, n_events)
+    n = counts.sum()
+    fields = {
+        "pt": rng.uniform(0, 50, n).astype(np.float32),
+        "eta": rng.normal(0, 2, n).astype(np.float32),
+        "phi": rng.uniform(-3, 3, n).astype(np.float32),
+        "mass": np.zeros(n, dtype=np.float32),
+        "pdgId": rng.choice([15, -15, 211, -211, 111, 22], n).astype(np.int32),
+        "genPartIdxMother": rng.integers(-1, 3, n).astype(np.int16),
+        "statusFlags": rng.integers(0, 1 << 15, n).astype(np.uint16),
+        "isPrompt": rng.random(n) < 0.5,
+    }
+    return ak.zip({field: ak.unflatten(values, counts) for field, values in fields.items()},
+                  with_name="PtEtaPhiMLorentzVector", behavior=coffea.nanoevents.methods.vector.behavior)